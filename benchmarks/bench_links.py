@@ -0,0 +1,109 @@
+"""
+Benchmark of commentary link generation against the implementation it
+replaced, on synthetic commentaries of 100k+ segments.
+
+    python benchmarks/bench_links.py
+"""
+
+import random
+import re
+import timeit
+from collections import defaultdict
+
+from pecha_uploader.links.create_ref_json import iter_links
+
+ROOT_DETAIL = {"base_text_titles": ["Root text"]}
+
+
+def legacy_get_list_depth(lst):
+    if not isinstance(lst, list):
+        return 0
+    max_depth = 0
+    for item in lst:
+        max_depth = max(max_depth, legacy_get_list_depth(item))
+    return max_depth + 1
+
+
+def legacy_get_range(data):
+    indices = defaultdict(list)
+    for i, elem in enumerate(data):
+        matches = re.search(r"<\d+><\d+>", elem)
+        if matches:
+            indices[matches.group()].append(i)
+    output = {}
+    for key, value in indices.items():
+        output[key] = []
+        if value[0] == value[-1]:
+            output[key].append(str(value[0] + 1))
+        else:
+            output[key].append(f"{value[0] + 1}-{value[-1] + 1}")
+        output[key].append(list(map(int, re.findall(r"\d+", key))))
+    return output
+
+
+def legacy_link_mapper(title, contents, root_detail):
+    """link_mapper before the linear rewrite, for comparison"""
+    links = []
+    root_title = root_detail["base_text_titles"][0]
+
+    def add(prefix, data):
+        for value in legacy_get_range(data).values():
+            ref = [f"{root_title} {value[1][0]}:{value[1][1]}", f"{prefix}{value[0]}"]
+            links.append({"refs": ref, "type": "commentary"})
+
+    if legacy_get_list_depth(contents) == 1:
+        add(f"{title} ", contents)
+        return links
+    for i, content in enumerate(contents):
+        if isinstance(content, list):
+            if legacy_get_list_depth(content) == 1:
+                add(f"{title} {i + 1}:", content)
+            else:
+                for j, data in enumerate(content):
+                    if isinstance(data, list):
+                        add(f"{title} {i + 1}:{j + 1}:", data)
+    return links
+
+
+def synthetic_commentary(sections: int, segments: int, seed: int = 0):
+    """Sections of segments, a marker spans one to four consecutive segments"""
+    rng = random.Random(seed)
+    contents = []
+    for section in range(1, sections + 1):
+        data = []
+        verse = 1
+        while len(data) < segments:
+            for _ in range(rng.randint(1, 4)):
+                data.append(f"<{section}><{verse}>ཀ་ཁ་ག་ང་ཅ་ཆ་ཇ་ཉ་ཏ་ཐ་ད་ན་")
+            verse += 1
+        contents.append(data[:segments])
+    return contents
+
+
+def bench(name: str, contents, number: int = 3):
+    assert list(iter_links("Commentary", contents, ROOT_DETAIL)) == (
+        legacy_link_mapper("Commentary", contents, ROOT_DETAIL)
+    )
+    legacy = min(
+        timeit.repeat(
+            lambda: legacy_link_mapper("Commentary", contents, ROOT_DETAIL),
+            number=number,
+        )
+    )
+    current = min(
+        timeit.repeat(
+            lambda: list(iter_links("Commentary", contents, ROOT_DETAIL)),
+            number=number,
+        )
+    )
+    print(
+        f"{name:<24} legacy {legacy / number * 1000:8.1f} ms"
+        f"   current {current / number * 1000:8.1f} ms"
+        f"   speedup {legacy / current:5.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    bench("depth 1, 120k segments", synthetic_commentary(1, 120_000)[0])
+    bench("depth 2, 400 x 300", synthetic_commentary(400, 300))
+    bench("depth 3, 40 x 10 x 300", [synthetic_commentary(10, 300)] * 40)
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of `utils.parse_annotation` against the implementation it
+replaced, on the commentary of `tests/data` and on synthetic, heavily
+annotated segments.
+
+    python benchmarks/bench_parse_annotation.py
+"""
+
+import random
+import re
+import timeit
+from pathlib import Path
+
+from pecha_uploader.utils import parse_annotation, read_json
+
+DATA_PATH = Path(__file__).parent.parent / "tests" / "data" / "commentary_text.json"
+
+PARTS = [
+    "ཀ་ཁ་ག་ང་",
+    "{ཅ་ཆ}",
+    "(ཉ་ཏ)",
+    "<sapche>ས་བཅད</sapche>",
+    "\n",
+    " ",
+    "<12>",
+    "<3><4>",
+    "ཐ་ད་ན་པ་ཕ་བ་",
+]
+
+
+def legacy_parse_annotation(value):
+    """parse_annotation before it was compiled, for comparison"""
+
+    def process_item(item):
+        if isinstance(item, list):
+            return [process_item(sub_item) for sub_item in item]
+        if not isinstance(item, str):
+            item = str(item)
+        item = item.replace("\n", "<br>")
+        if "<sapche>" in item:
+            item = item.replace("<sapche>", '<span class="text-subche-style">')
+            item = item.replace("</sapche>", "</span>")
+        if "{" in item:
+            item = item.replace("{", '<span class="text-citation-style">')
+            item = item.replace("}", "</span>")
+        if "(" in item:
+            item = item.replace("(", '<span class="text-quotation-style">')
+            item = item.replace(")", "</span>")
+        item = re.sub(r"<\d+>", "", item.strip())
+        return item
+
+    return process_item(value)
+
+
+def synthetic_content(chapters: int = 2000, segments: int = 50, seed: int = 0):
+    rng = random.Random(seed)
+    return [
+        ["".join(rng.choice(PARTS) for _ in range(8)) for _ in range(segments)]
+        for _ in range(chapters)
+    ]
+
+
+def bench(name: str, content, number: int):
+    assert parse_annotation(content) == legacy_parse_annotation(content)
+    legacy = min(timeit.repeat(lambda: legacy_parse_annotation(content), number=number))
+    current = min(timeit.repeat(lambda: parse_annotation(content), number=number))
+    print(
+        f"{name:<12} legacy {legacy / number * 1000:8.2f} ms"
+        f"   current {current / number * 1000:8.2f} ms"
+        f"   speedup {legacy / current:5.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    commentary = read_json(DATA_PATH)["target"]["books"][0]["content"]
+    bench("commentary", commentary, 50)
+    bench("synthetic", synthetic_content(), 3)
@@ -0,0 +1,48 @@
+"""
+Bytes on the wire of the text posts of `tests/data`, for the legacy
+url-encoded ascii json against the compact encodings of the client.
+
+    python benchmarks/bench_wire.py
+"""
+
+import json
+from pathlib import Path
+
+from pecha_uploader.encoding import compress, encode_form, encode_json, encode_multipart
+from pecha_uploader.pipeline import book_chapters, build_payload, generate_text_versions
+from pecha_uploader.utils import read_json
+
+DATA_PATH = Path(__file__).parent.parent / "tests" / "data"
+
+
+def text_fields(text):
+    """Form fields of every text post of a pecha json"""
+    payload = build_payload(text)
+    key = payload["bookKey"]
+    for lang, books in (("en", payload["textEn"]), ("he", payload["textHe"])):
+        for book in books:
+            for _, version in generate_text_versions(
+                book, lang, key, book_chapters(book, key)
+            ):
+                yield version
+
+
+def bench(name: str, text):
+    legacy = form = multipart = gzipped = 0
+    for version in text_fields(text):
+        legacy += len(encode_form({"json": json.dumps(version), "apikey": "k"})[0])
+        fields = {"json": encode_json(version), "apikey": "k"}
+        form += len(encode_form(fields)[0])
+        body = encode_multipart(fields)[0]
+        multipart += len(body)
+        gzipped += len(compress(body))
+    print(
+        f"{name:<24} legacy {legacy:>10}   form {form:>10}   "
+        f"multipart {multipart:>10} ({legacy / multipart:4.1f}x)   "
+        f"gzip {gzipped:>9} ({legacy / gzipped:4.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    for path in sorted(DATA_PATH.glob("*.json")):
+        bench(path.name, read_json(path))
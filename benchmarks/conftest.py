@@ -0,0 +1,61 @@
+"""
+pytest-benchmark suite of the preprocessing hot paths, run on synthetic
+pechas from `synthetic.py`.
+
+    pip install pytest-benchmark
+    # store a baseline
+    pytest benchmarks --benchmark-save=baseline
+    # after a change, fail on a median more than 20% slower than the baseline
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:20%
+
+Results are kept in `.benchmarks` of the working directory. Timings only
+compare on the same machine, so no baseline is committed: the `benchmark` job
+of `workflows/CI.yml` benchmarks the base branch of a pull request with its
+`src`, then the pull request, and fails on the same 20% threshold.
+
+The pecha sizes are the presets of `synthetic.SIZES` listed in
+`PECHA_BENCH_SIZES`, "tiny,small,medium" by default.
+"""
+
+import os
+
+import pytest
+from synthetic import SIZES, synthetic_pecha
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    # without the plugin the `benchmark` fixture is missing, skip the suite
+    collect_ignore_glob = ["test_*.py"]
+
+DEFAULT_SIZES = "tiny,small,medium"
+
+BENCH_SIZES = [
+    size.strip()
+    for size in os.environ.get("PECHA_BENCH_SIZES", DEFAULT_SIZES).split(",")
+    if size.strip()
+]
+
+_pechas = {}
+
+
+def _pecha(size: str, commentary: bool):
+    key = (size, commentary)
+    if key not in _pechas:
+        _pechas[key] = synthetic_pecha(
+            title="Synthetic commentary" if commentary else "Synthetic root",
+            commentary=commentary,
+            annotation_density=0.3,
+            **SIZES[size],
+        )
+    return _pechas[key]
+
+
+@pytest.fixture(params=BENCH_SIZES)
+def root_pecha(request):
+    return _pecha(request.param, False)
+
+
+@pytest.fixture(params=BENCH_SIZES)
+def commentary_pecha(request):
+    return _pecha(request.param, True)
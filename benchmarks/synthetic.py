@@ -0,0 +1,225 @@
+"""
+Synthetic pechas of any size, for benchmarks and load tests.
+
+The generated json has the shape of a real pecha: categories on both sides,
+one book per side, Tibetan segments with the annotations `parse_annotation`
+cleans, and `<chapter><verse>` markers for commentaries.
+
+    python benchmarks/synthetic.py out.json --depth 2 --chapters 2000 \\
+        --segments 500 --commentary
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+SYLLABLES = "ཀ ཁ ག ང ཅ ཆ ཇ ཉ ཏ ཐ ད ན པ ཕ བ མ བྱང ཆུབ སེམས དཔའ".split()
+ANNOTATIONS = [
+    "<sapche>{}</sapche>",
+    "{{{}}}",
+    "({})",
+    "{}\n",
+    "<12>{}",
+]
+
+# approximate json sizes of the presets, from a few KB to hundreds of MB
+SIZES = {
+    "tiny": {"depth": 1, "chapters": 1, "segments": 20},  # ~3 KB
+    "small": {"depth": 2, "chapters": 20, "segments": 50},  # ~100 KB
+    "medium": {"depth": 2, "chapters": 200, "segments": 100},  # ~2 MB
+    "large": {"depth": 2, "chapters": 2000, "segments": 250},  # ~50 MB
+    "huge": {"depth": 3, "chapters": 120, "segments": 200},  # ~270 MB
+}
+
+
+def _segment(rng: random.Random, words: int, annotation_density: float):
+    text = "་".join(rng.choice(SYLLABLES) for _ in range(words)) + "།"
+    if rng.random() < annotation_density:
+        text = rng.choice(ANNOTATIONS).format(text)
+    return text
+
+
+def _segments(
+    rng: random.Random,
+    count: int,
+    words: int,
+    annotation_density: float,
+    section: Optional[int],
+):
+    """`count` segments, with markers of verses of one to four segments"""
+    segments = []
+    verse = 1
+    while len(segments) < count:
+        span = rng.randint(1, 4) if section is not None else 1
+        for _ in range(span):
+            segment = _segment(rng, words, annotation_density)
+            if section is not None:
+                segment = f"<{section}><{verse}>{segment}"
+            segments.append(segment)
+        verse += 1
+    return segments[:count]
+
+
+def _content(
+    rng: random.Random,
+    depth: int,
+    chapters: int,
+    segments: int,
+    words: int,
+    annotation_density: float,
+    commentary: bool,
+    section: int = 1,
+):
+    """Nested lists of `depth`, every level below the top has `chapters` items"""
+    if depth <= 1:
+        return _segments(
+            rng, segments, words, annotation_density, section if commentary else None
+        )
+    return [
+        _content(
+            rng,
+            depth - 1,
+            chapters,
+            segments,
+            words,
+            annotation_density,
+            commentary,
+            i + 1,
+        )
+        for i in range(chapters)
+    ]
+
+
+def _categories(title: str, commentary: bool, language: str):
+    if language == "en":
+        prefix = "en"
+        names = ["Synthetic", "Commentaries" if commentary else "Root text", title]
+    else:
+        prefix = "he"
+        names = ["རྫུན་མ།", "འགྲེལ་བ།" if commentary else "རྩ་བ།", title]
+    categories = [
+        {"name": name, f"{prefix}Desc": "", f"{prefix}ShortDesc": ""} for name in names
+    ]
+    if commentary:
+        categories[-1].update(
+            {
+                "base_text_titles": ["Synthetic root"],
+                "base_text_mapping": "many_to_one",
+                "link": "Commentary",
+            }
+        )
+    return categories
+
+
+def _book(title: str, language: str, content):
+    return {
+        "title": title,
+        "language": language,
+        "versionSource": "https://example.org/synthetic",
+        "direction": "ltr",
+        "completestatus": "done",
+        "content": content,
+    }
+
+
+def synthetic_pecha(
+    title: str = "Synthetic text",
+    depth: int = 2,
+    chapters: int = 10,
+    segments: int = 100,
+    words: int = 12,
+    annotation_density: float = 0.2,
+    commentary: bool = False,
+    sections: int = 0,
+    seed: int = 0,
+) -> Dict:
+    """
+    Generate a pecha json.
+        `depth`: list depth of the content, 1 is a flat list of segments
+        `chapters`: items of every list level above the segments
+        `segments`: segments of every innermost list
+        `words`: syllables of a segment
+        `annotation_density`: share of segments with an annotation
+        `commentary`: categorize as a commentary of "Synthetic root", with
+        `<chapter><verse>` markers on the segments
+        `sections`: when above 0, the content is a dict of that many named
+        sections, each holding lists of `depth`
+        `seed`: the same arguments and seed give the same pecha
+    """
+    if depth < 1 or chapters < 1 or segments < 1:
+        raise ValueError("depth, chapters and segments must be at least 1.")
+    rng = random.Random(seed)
+
+    def content():
+        return _content(
+            rng, depth, chapters, segments, words, annotation_density, commentary
+        )
+
+    if sections:
+        en_content: Union[Dict, List] = {
+            f"Section {i + 1}": {"data": []} for i in range(sections)
+        }
+        bo_content: Union[Dict, List] = {
+            f"ས་བཅད་ {i + 1}": {"data": content()} for i in range(sections)
+        }
+    else:
+        en_content, bo_content = [], content()
+
+    return {
+        "source": {
+            "categories": _categories(title, commentary, "en"),
+            "books": [_book(title, "en", en_content)],
+        },
+        "target": {
+            "categories": _categories(title, commentary, "bo"),
+            "books": [_book(title, "bo", bo_content)],
+        },
+    }
+
+
+def write_synthetic_pecha(path: Union[str, Path], **options):
+    """Write `synthetic_pecha(**options)` to `path`, return its size in bytes"""
+    path = Path(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(synthetic_pecha(**options), f, ensure_ascii=False)
+    return path.stat().st_size
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python benchmarks/synthetic.py",
+        description="Write a synthetic pecha json file.",
+    )
+    parser.add_argument("path")
+    parser.add_argument("--size", choices=sorted(SIZES), help="preset dimensions")
+    parser.add_argument("--title", default="Synthetic text")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--chapters", type=int)
+    parser.add_argument("--segments", type=int)
+    parser.add_argument("--words", type=int)
+    parser.add_argument("--annotation-density", type=float)
+    parser.add_argument("--sections", type=int)
+    parser.add_argument("--commentary", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    options = dict(SIZES[args.size]) if args.size else {}
+    for name in ("depth", "chapters", "segments", "words", "sections"):
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    if args.annotation_density is not None:
+        options["annotation_density"] = args.annotation_density
+    size = write_synthetic_pecha(
+        args.path,
+        title=args.title,
+        commentary=args.commentary,
+        seed=args.seed,
+        **options,
+    )
+    print(f"Wrote {args.path} ({size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmarks of schema, chapter, annotation, link and payload preprocessing"""
+
+from pecha_uploader import utils
+from pecha_uploader.encoding import encode_json, encode_multipart
+from pecha_uploader.links.create_ref_json import create_links, get_range, link_mapper
+from pecha_uploader.pipeline import build_version
+
+
+def _target_book(pecha):
+    return pecha["target"]["books"][0]
+
+
+def _first_segments(content):
+    while content and isinstance(content[0], list):
+        content = content[0]
+    return content
+
+
+def test_generate_schema(benchmark, root_pecha):
+    en_book = root_pecha["source"]["books"][0]
+    bo_book = _target_book(root_pecha)
+    benchmark(utils.generate_schema, en_book, bo_book)
+
+
+def test_generate_chapters(benchmark, root_pecha):
+    content = {"Section": {"data": _target_book(root_pecha)["content"]}}
+    benchmark(utils.generate_chapters, content, "bo")
+
+
+def test_walk_text(benchmark, commentary_pecha):
+    benchmark(utils.walk_text, commentary_pecha, True, True, True)
+
+
+def test_parse_annotation(benchmark, root_pecha):
+    benchmark(utils.parse_annotation, _target_book(root_pecha)["content"])
+
+
+def test_get_list_depth(benchmark, root_pecha):
+    benchmark(utils.get_list_depth, _target_book(root_pecha)["content"])
+
+
+def test_create_links(benchmark, commentary_pecha):
+    benchmark(create_links, commentary_pecha)
+
+
+def test_link_mapper(benchmark, commentary_pecha):
+    root_detail = commentary_pecha["source"]["categories"][-1]
+    content = _target_book(commentary_pecha)["content"]
+    benchmark(link_mapper, "Synthetic commentary", content, root_detail)
+
+
+def test_get_range(benchmark, commentary_pecha):
+    segments = _first_segments(_target_book(commentary_pecha)["content"])
+    benchmark(get_range, segments)
+
+
+def test_encode_text_payload(benchmark, root_pecha):
+    book = _target_book(root_pecha)
+    version = dict(
+        build_version(book, "he"), text=utils.parse_annotation(book["content"])
+    )
+
+    def encode():
+        return encode_multipart({"json": encode_json(version), "apikey": "key"})
+
+    benchmark(encode)
@@ -0,0 +1,277 @@
+"""
+Asyncio variant of the upload pipeline.
+
+Terms, categories and the index are posted first, then every chapter of both
+languages and finally the link batches. Requests of the same stage overlap,
+with at most `max_in_flight` of them running at the same time.
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from pecha_uploader.client import get_client, track_transfer
+from pecha_uploader.config import logger
+from pecha_uploader.dry_run import check_dry_run, planning
+from pecha_uploader.journal import UploadJournal, run_step
+from pecha_uploader.links.create_ref_json import iter_text_links
+from pecha_uploader.manifest import Manifest
+from pecha_uploader.metrics import TOTAL, stage, timed, timed_iter, write_upload_metrics
+from pecha_uploader.pipeline import (
+    add_category,
+    add_index,
+    add_links,
+    add_term,
+    build_payload,
+    category_step,
+    generate_text_versions,
+    get_category_path,
+    get_index_key,
+    is_commentary,
+    post_text_version,
+    term_step,
+    trace_upload,
+)
+from pecha_uploader.registry import get_registry
+from pecha_uploader.tracing import span
+from pecha_uploader.transaction import upload_transaction
+from pecha_uploader.utils import walk_text
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class _Runner:
+    """
+    Run blocking pipeline calls on a bounded thread pool and keep track of the
+    futures, so that pending work can be cancelled when a stage fails.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.loop = asyncio.get_event_loop()
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="pecha-upload"
+        )
+        self.futures: List[asyncio.Future] = []
+
+    def run(self, fn, *args):
+        # run_in_executor does not carry context variables over to the thread
+        context = contextvars.copy_context()
+        future = self.loop.run_in_executor(
+            self.executor, functools.partial(context.run, fn, *args)
+        )
+        self.futures.append(future)
+        return future
+
+    async def drain(self):
+        """Cancel the calls that have not started and wait for the running ones"""
+        for future in self.futures:
+            future.cancel()
+        await self.loop.run_in_executor(
+            None, functools.partial(self.executor.shutdown, wait=True)
+        )
+
+    async def close(self):
+        pending = [future for future in self.futures if not future.done()]
+        for future in pending:
+            future.cancel()
+        # retrieve results so that failed futures are not reported as unhandled
+        await asyncio.gather(*self.futures, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+
+def _list_versions(
+    books: List[Dict], chapters: List[Dict], lang: str, text_index_key: str
+):
+    """Generate every `(lang, text_name, text)` post of the given books"""
+    versions = []
+    for book, book_chapters in zip(books, chapters):
+        for text_name, version in generate_text_versions(
+            book, lang, text_index_key, book_chapters
+        ):
+            versions.append((lang, text_name, version))
+    return versions
+
+
+async def _add_texts(
+    text: Dict,
+    destination_url: str,
+    runner: _Runner,
+    use_registry: bool,
+    journal: Optional[UploadJournal],
+    manifest: Optional[Manifest],
+):
+    payload = build_payload(text)
+    registry = get_registry() if use_registry else None
+    category_path = get_category_path(payload)
+    text_index_key = payload["bookKey"]
+    commentary = is_commentary(text)
+
+    # preprocessing runs while terms and categories are being posted
+    tree = runner.run(timed(walk_text, "walk_text"), text, True, True, commentary)
+
+    # what this run created is deleted again if it fails before the links
+    with upload_transaction(destination_url, journal, manifest):
+        try:
+            # terms are independent, categories need their term and their parent
+            categories = list(zip(payload["categoryEn"], payload["categoryHe"]))
+            with stage("terms_categories"):
+                await asyncio.gather(
+                    *[
+                        runner.run(
+                            run_step,
+                            journal,
+                            term_step(en[-1]["name"]),
+                            add_term,
+                            en[-1]["name"],
+                            he[-1]["name"],
+                            destination_url,
+                            registry,
+                        )
+                        for en, he in categories
+                    ]
+                )
+                for en, he in categories:
+                    await runner.run(
+                        run_step,
+                        journal,
+                        category_step(en),
+                        add_category,
+                        en,
+                        he,
+                        destination_url,
+                        registry,
+                    )
+
+            tree = await tree
+            with stage("index"):
+                await runner.run(
+                    run_step,
+                    journal,
+                    f"index:{text_index_key}",
+                    add_index,
+                    payload,
+                    destination_url,
+                    tree.schema,
+                )
+
+            en_versions = _list_versions(
+                payload["textEn"], tree.en_chapters, "en", text_index_key
+            )
+            he_versions = _list_versions(
+                payload["textHe"], tree.bo_chapters, "he", text_index_key
+            )
+            with stage("texts"):
+                await asyncio.gather(
+                    *[
+                        runner.run(
+                            post_text_version,
+                            lang,
+                            text_name,
+                            version,
+                            category_path,
+                            destination_url,
+                            text_index_key,
+                            journal,
+                            manifest,
+                        )
+                        for lang, text_name, version in en_versions + he_versions
+                    ]
+                )
+        except Exception:
+            # chapters still being posted would race with the rollback
+            await runner.drain()
+            raise
+
+    if commentary:
+        # links, and the deletes preparing them, wait for every chapter, and
+        # are generated lazily while the batches are posted
+        links = timed_iter(
+            iter_text_links(tree.link_inputs, text["source"]["categories"][-1]),
+            "link_refs",
+        )
+        # link batches are sized and parallelised by post_links itself
+        with stage("links"):
+            await runner.run(
+                add_links,
+                links,
+                destination_url,
+                journal,
+                manifest,
+                runner.max_in_flight,
+            )
+
+
+async def upload_async(
+    text: Dict,
+    destination_url: str,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    use_registry: bool = True,
+    resume: bool = False,
+    only_changed: bool = False,
+    dry_run: bool = False,
+    plan_path: Optional[Union[str, Path]] = None,
+    sync_links: bool = False,
+    input_hash: Optional[str] = None,
+    tracing: Optional[bool] = None,
+):
+    """
+    Upload text to the API with up to `max_in_flight` concurrent requests.
+        e.g. asyncio.run(upload_async(text, "https://pecha.org/", max_in_flight=16))
+        `use_registry`: skip terms and categories the local registry knows exist
+        `resume`: skip the steps an earlier upload of the same text completed
+        `only_changed`: post only chapters and links that changed since the last upload
+        `dry_run`: write the requests to the jsonl `plan_path` instead of sending them
+        `sync_links`: post and delete only the links that differ from those of
+        the destination, instead of deleting and posting them all again
+        `input_hash`: key of the journal, e.g. the `hash_file` of the file the
+        text was read from, by default a hash of `text` when resuming
+        `tracing`: write a trace of the upload to `TRACE_PATH`, by default when
+        `PECHA_UPLOADER_TRACE` is set
+    Return the `TransferStats` of the upload.
+    Metrics of the upload are written to `METRICS_PATH`, except for dry runs,
+    and at the end of the batch for the texts of `upload_many`.
+    """
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1.")
+
+    if dry_run:
+        check_dry_run(resume, only_changed)
+        with planning(destination_url, get_index_key(text), plan_path) as stats:
+            runner = _Runner(max_in_flight)
+            try:
+                await _add_texts(text, destination_url, runner, False, None, None)
+            finally:
+                await runner.close()
+        return stats
+
+    client = get_client(destination_url)
+    client.pool_size = max(client.pool_size, max_in_flight)
+
+    with track_transfer() as stats, trace_upload(
+        get_index_key(text), destination_url, "async", stats, tracing
+    ):
+        journal = UploadJournal.for_text(text, destination_url, resume, input_hash)
+        manifest = Manifest(
+            destination_url, get_index_key(text), only_changed, sync_links=sync_links
+        )
+        runner = _Runner(max_in_flight)
+        try:
+            with stage("upload", TOTAL), span("add_texts"):
+                await _add_texts(
+                    text, destination_url, runner, use_registry, journal, manifest
+                )
+        except Exception as e:
+            logger.error(f"{e}")
+            raise Exception(f"{e}")
+        finally:
+            await runner.close()
+            if journal is not None:
+                journal.close()
+            manifest.close()
+            write_upload_metrics()
+            logger.info(f"SENT: '{get_index_key(text)}' {stats}")
+    return stats
@@ -0,0 +1,319 @@
+"""
+Upload a whole corpus of pechas on a worker pool.
+
+Root texts are uploaded before the commentaries that name them in
+`base_text_titles`, independent texts run in parallel, and every text gets its
+own `UploadResult` instead of the first failure aborting the run.
+"""
+
+import contextvars
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from pecha_uploader.client import get_client, track_transfer
+from pecha_uploader.config import log_text_error, log_text_success, logger
+from pecha_uploader.journal import hash_file
+from pecha_uploader.metrics import batch_metrics
+from pecha_uploader.pipeline import get_index_key, is_commentary, upload
+from pecha_uploader.profiling import profiling_enabled
+from pecha_uploader.registry import get_registry
+from pecha_uploader.snapshot import forget_snapshot, load_snapshot
+from pecha_uploader.stream import LANGUAGES, read_categories, upload_stream
+from pecha_uploader.utils import read_json
+
+DEFAULT_WORKERS = 4
+
+SUCCESS = "success"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class UploadResult:
+    """Outcome of uploading one text of a batch"""
+
+    source: str
+    title: str
+    status: str
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    bytes_sent: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class _Task:
+    position: int
+    source: str
+    title: str
+    base_titles: List[str]
+    categories: Dict
+    text: Optional[Dict] = None
+    path: Optional[Path] = None
+
+    def load(self) -> Dict:
+        if self.text is not None:
+            return self.text
+        return read_json(self.path)
+
+
+def get_base_text_titles(text: Dict):
+    """Return the root text titles of a commentary, or an empty list for a root"""
+    if not is_commentary(text):
+        return []
+    src_last_category = text["source"]["categories"][-1]
+    tgt_last_category = text["target"]["categories"][-1]
+    return src_last_category.get(
+        "base_text_titles", tgt_last_category.get("base_text_titles", [])
+    )
+
+
+def _make_task(position: int, item: Union[str, Path, Dict]):
+    if isinstance(item, dict):
+        text, path = item, None
+    else:
+        path = Path(item)
+        # the categories are all the scheduling needs, the file is parsed
+        # whole only when it is uploaded
+        text = read_categories(path)
+    task = _Task(
+        position=position,
+        source=str(path) if path else get_index_key(text),
+        title=get_index_key(text),
+        base_titles=get_base_text_titles(text),
+        categories={
+            side: {"categories": text[side]["categories"]} for side in LANGUAGES
+        },
+        # files are read again when uploaded, so a large corpus is never
+        # held in memory all at once
+        text=None if path else text,
+        path=path,
+    )
+    return task
+
+
+def _upload_task(
+    task: _Task, destination_url: str, options: Dict, stream: bool = False
+):
+    start = time.monotonic()
+    with track_transfer() as stats:
+        try:
+            if stream and task.path is not None:
+                upload_stream(task.path, destination_url, **options)
+            elif task.path is not None:
+                upload(
+                    task.load(),
+                    destination_url,
+                    input_hash=hash_file(task.path),
+                    **options,
+                )
+            else:
+                upload(task.load(), destination_url, **options)
+        except Exception as e:
+            return UploadResult(
+                task.source,
+                task.title,
+                FAILED,
+                f"{e}",
+                time.monotonic() - start,
+                stats.bytes_sent,
+            )
+    return UploadResult(
+        task.source,
+        task.title,
+        SUCCESS,
+        None,
+        time.monotonic() - start,
+        stats.bytes_sent,
+    )
+
+
+def upload_many(
+    paths_or_dicts: Iterable[Union[str, Path, Dict]],
+    destination_url: str,
+    workers: int = DEFAULT_WORKERS,
+    use_registry: bool = True,
+    resume: bool = False,
+    only_changed: bool = False,
+    stream: bool = False,
+    dry_run: bool = False,
+    profile: Optional[bool] = None,
+    on_result: Optional[Callable[[UploadResult], None]] = None,
+    snapshot: bool = False,
+    sync_links: bool = False,
+    tracing: Optional[bool] = None,
+):
+    """
+    Upload many texts, root texts before their commentaries.
+        `paths_or_dicts`: pecha json file paths or already loaded pecha dicts
+        `workers`: number of texts uploaded at the same time
+        `use_registry`: skip terms and categories the local registry knows exist
+        `resume`: skip the steps earlier uploads of the same texts completed
+        `only_changed`: post only chapters and links that changed since the last upload
+        `stream`: parse files chapter by chapter instead of loading them whole
+        `dry_run`: write the requests of every text to its plan file under
+        `PLAN_PATH` instead of sending them
+        `profile`: write a profile of every text to `PROFILE_PATH`, by default
+        when `PECHA_UPLOADER_PROFILE` is set. Texts are then uploaded one at a
+        time, so that each profile only holds the work of its own text.
+        `on_result`: called with the `UploadResult` of every text as soon as it
+        is done, e.g. to report progress
+        `snapshot`: read what the destination has in one request first, and
+        post only the indexes, and with `use_registry` the terms and
+        categories, it lacks
+        `sync_links`: post and delete only the links that differ from those of
+        the destination, instead of deleting and posting them all again
+        `tracing`: write a trace of every text to `TRACE_PATH`, by default when
+        `PECHA_UPLOADER_TRACE` is set
+    Return a list of `UploadResult`, in the order of `paths_or_dicts`.
+    Metrics of the texts are written to `METRICS_PATH` once all of them are
+    done, except for dry runs.
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1.")
+    if snapshot and dry_run:
+        raise ValueError("dry_run cannot be combined with snapshot.")
+    profile = profiling_enabled(profile)
+    if profile and workers > 1:
+        logger.warning(f"Profile: uploading with 1 worker instead of {workers}")
+        workers = 1
+
+    options = {
+        "use_registry": use_registry,
+        "resume": resume,
+        "only_changed": only_changed,
+        "dry_run": dry_run,
+        "profile": profile,
+        "sync_links": sync_links,
+        "tracing": tracing,
+    }
+    tasks = []
+    # texts whose categories cannot be read fail on their own
+    unreadable: List[Tuple[int, UploadResult]] = []
+    for position, item in enumerate(paths_or_dicts):
+        try:
+            tasks.append(_make_task(position, item))
+        except Exception as e:
+            source = f"text {position}" if isinstance(item, dict) else str(item)
+            error = f"Unreadable text: {e}"
+            unreadable.append((position, UploadResult(source, source, FAILED, error)))
+    try:
+        if snapshot:
+            plan = load_snapshot(
+                destination_url, get_registry() if use_registry else None
+            ).plan(task.categories for task in tasks)
+            logger.info(f"PLAN: {plan}")
+        unfinished_by_title: Dict[str, int] = defaultdict(int)
+        for task in tasks:
+            unfinished_by_title[task.title] += 1
+
+        # a commentary waits only for root texts that are part of this batch
+        blockers = {}
+        dependents = defaultdict(list)
+        ready = deque()
+        for task in tasks:
+            blockers[task.position] = {
+                title for title in task.base_titles if title in unfinished_by_title
+            }
+            for title in blockers[task.position]:
+                dependents[title].append(task)
+            if not blockers[task.position]:
+                ready.append(task)
+
+        results: List[Optional[UploadResult]] = [None] * (len(tasks) + len(unreadable))
+        failed_titles = set()
+        for position, result in unreadable:
+            results[position] = result
+            log_text_error(result.source, result.error)
+            logger.error(f"{result.status.upper()}: '{result.source}' {result.error}")
+            if on_result is not None:
+                on_result(result)
+
+        client = get_client(destination_url)
+        client.pool_size = max(client.pool_size, workers)
+
+        def finish(task: _Task, result: UploadResult):
+            results[task.position] = result
+            if result.status == SUCCESS:
+                log_text_success(task.title)
+            else:
+                failed_titles.add(task.title)
+                log_text_error(task.title, result.error)
+                logger.error(f"{result.status.upper()}: '{task.title}' {result.error}")
+            if on_result is not None:
+                on_result(result)
+
+            unfinished_by_title[task.title] -= 1
+            if unfinished_by_title[task.title]:
+                return
+            for dependent in dependents.pop(task.title, []):
+                if results[dependent.position] is not None:
+                    continue
+                if task.title in failed_titles:
+                    error = f"root text '{task.title}' was not uploaded"
+                    finish(
+                        dependent,
+                        UploadResult(dependent.source, dependent.title, SKIPPED, error),
+                    )
+                    continue
+                blockers[dependent.position].discard(task.title)
+                if not blockers[dependent.position]:
+                    ready.append(dependent)
+
+        # the uploads of the batch write their metrics once, when all are done
+        metrics = nullcontext() if dry_run else batch_metrics()
+        with metrics, ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            while True:
+                while ready:
+                    task = ready.popleft()
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        _upload_task,
+                        task,
+                        destination_url,
+                        options,
+                        stream,
+                    )
+                    running[future] = task
+
+                if not running:
+                    unfinished = [
+                        task
+                        for task in tasks
+                        if results[task.position] is None and blockers[task.position]
+                    ]
+                    if not unfinished:
+                        break
+                    # only possible with circular base_text_titles, upload the rest
+                    for task in unfinished:
+                        blockers[task.position].clear()
+                        ready.append(task)
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(running.pop(future), future.result())
+    finally:
+        # a later batch reads the destination again
+        if snapshot:
+            forget_snapshot(destination_url)
+
+    if use_registry:
+        get_registry().flush()
+    return results
+
+
+def summarize(results: List[UploadResult]):
+    """Count results per status"""
+    summary = {SUCCESS: 0, FAILED: 0, SKIPPED: 0}
+    for result in results:
+        summary[result.status] += 1
+    return summary
@@ -0,0 +1,298 @@
+"""
+Read-through cache of the extract APIs (`get_text`, `get_index`,
+`get_category`, `get_term` and `get_link`).
+
+Responses are kept per destination url, kind and ref for `ttl` seconds, with
+at most `max_entries` of them, the least recently used being evicted first.
+An expired entry whose response had an `ETag` or a `Last-Modified` header is
+revalidated with a conditional GET, and reused as is when the server answers
+304. Error responses, e.g. of a term that does not exist yet, are not cached.
+
+The upload and delete functions invalidate what they change, so reads that
+follow a write in the same process never see the old value. Writes of other
+processes are seen once the entries expire. With a `path`, the cache is saved
+there when the process exits and loaded again by the next one.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from pecha_uploader.client import get_client
+from pecha_uploader.config import CACHE_PATH, logger
+from pecha_uploader.metrics import get_metrics
+
+DEFAULT_TTL = 300.0  # seconds
+DEFAULT_MAX_ENTRIES = 1024
+
+TEXT = "text"
+INDEX = "index"
+CATEGORY = "category"
+TERM = "term"
+LINK = "link"
+
+NOT_MODIFIED = 304
+
+_bypassed: contextvars.ContextVar = contextvars.ContextVar(
+    "pecha_cache_bypassed", default=False
+)
+
+
+def _is_error(body: str):
+    return body.lstrip().startswith('{"error"')
+
+
+def _ref_key(ref: str):
+    # the API reads "_" and " " in refs alike
+    return ref.replace(" ", "_")
+
+
+class CacheEntry:
+    """Body of a response and the validators to revalidate it"""
+
+    __slots__ = ("body", "fetched_at", "etag", "last_modified")
+
+    def __init__(
+        self,
+        body: str,
+        fetched_at: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        self.body = body
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def validators(self) -> Dict[str, str]:
+        """Headers of a conditional GET for this entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_list(self):
+        return [self.body, self.fetched_at, self.etag, self.last_modified]
+
+
+class ReadCache:
+    """
+    Thread safe LRU cache of GET responses.
+        `ttl`: seconds an entry is used without asking the server
+        `max_entries`: entries kept, the least recently used are evicted
+        `path`: json file the cache is saved to at exit, None to keep it in memory
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        path: Optional[Union[str, Path]] = None,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        # "<destination url>\n<kind>\n<ref>\n<variant>" -> CacheEntry
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._loaded = self.path is None
+        self._lock = threading.Lock()
+        if self.path is not None:
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(destination_url: str, kind: str, ref: str, variant: str = ""):
+        return f"{destination_url}\n{kind}\n{_ref_key(ref)}\n{variant}"
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning(f"Cache: ignoring unreadable {self.path}")
+            return
+        for key, value in data.items():
+            self._entries[key] = CacheEntry(*value)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, key: str):
+        """Return `(entry, fresh)`, the entry being None when nothing is cached"""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            self._entries.move_to_end(key)
+        return entry, time.time() - entry.fetched_at < self.ttl
+
+    def put(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._load()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def refresh(self, key: str):
+        """Keep an entry the server confirmed unchanged for another `ttl`"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.fetched_at = time.time()
+
+    def invalidate(
+        self,
+        destination_url: str,
+        kind: str,
+        ref: Optional[str] = None,
+        prefix: bool = False,
+    ):
+        """
+        Forget the entries of `ref`, of every ref starting with `ref` when
+        `prefix`, or of every ref of `kind` when `ref` is None.
+        """
+        start = f"{destination_url}\n{kind}\n"
+        if ref is not None:
+            start += _ref_key(ref) if prefix else f"{_ref_key(ref)}\n"
+        with self._lock:
+            self._load()
+            for key in [key for key in self._entries if key.startswith(start)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._loaded = True
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def save(self):
+        """Write the cache to `path`, if any"""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._loaded:
+                return
+            data = {key: entry.to_list() for key, entry in self._entries.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+_cache: Optional[ReadCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ReadCache:
+    """Return the shared cache, an in-memory one unless `configure_cache` was called"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReadCache()
+        return _cache
+
+
+def configure_cache(persist: bool = False, **options) -> ReadCache:
+    """
+    Replace the shared cache, e.g. `configure_cache(ttl=60, max_entries=4096)`.
+        `persist`: save the cache to `CACHE_PATH`, unless a `path` is given
+    """
+    global _cache
+    if persist:
+        options.setdefault("path", CACHE_PATH)
+    with _cache_lock:
+        if _cache is not None:
+            _cache.save()
+        _cache = ReadCache(**options)
+        return _cache
+
+
+def invalidate(
+    destination_url: str, kind: str, ref: Optional[str] = None, prefix: bool = False
+):
+    """Forget cached reads a write made out of date, see `ReadCache.invalidate`"""
+    if _cache is not None:
+        _cache.invalidate(destination_url, kind, ref, prefix)
+
+
+@contextmanager
+def bypass_cache():
+    """
+    Neither read nor fill the cache in this block, including on executor threads
+    started with a copy of the current context, e.g. while planning a dry run.
+    """
+    token = _bypassed.set(True)
+    try:
+        yield
+    finally:
+        _bypassed.reset(token)
+
+
+def cached_get(
+    destination_url: str,
+    kind: str,
+    ref: str,
+    url: str,
+    operation: str,
+    variant: str = "",
+) -> str:
+    """
+    GET `url` through the cache and return the decoded body.
+        `kind`, `ref`: what the url reads, used to invalidate it after writes
+        `variant`: query options that change the response, e.g. "with_text=1"
+    """
+    client = get_client(destination_url)
+    if _bypassed.get():
+        return client.request("GET", url, operation=operation).read().decode("utf-8")
+
+    cache = get_cache()
+    key = cache.key(destination_url, kind, ref, variant)
+    entry, fresh = cache.lookup(key)
+    metrics = get_metrics()
+    if entry is not None and fresh:
+        metrics.inc("pecha_cache_requests_total", kind=kind, result="hit")
+        return entry.body
+
+    headers = entry.validators() if entry is not None else {}
+    response = client.request("GET", url, headers=headers, operation=operation)
+    if response.status == NOT_MODIFIED and entry is not None:
+        metrics.inc("pecha_cache_requests_total", kind=kind, result="revalidated")
+        cache.refresh(key)
+        return entry.body
+
+    metrics.inc("pecha_cache_requests_total", kind=kind, result="miss")
+    body = response.read().decode("utf-8")
+    if not _is_error(body):
+        cache.put(
+            key,
+            CacheEntry(
+                body,
+                time.time(),
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            ),
+        )
+    return body
@@ -1,23 +1,28 @@
-import urllib
+import urllib.parse
+from typing import List
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, headers, logger
+from pecha_uploader.cache import CATEGORY, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key, logger
+from pecha_uploader.registry import get_registry
 
 
-def remove_category(category_list: str, destination_url: str):
+def remove_category(category_list: List[str], destination_url: str):
     """
     category_path > list of category path. e.g ["Liturgy", "Prayer"]
     """
     category_path = "/".join(category_list)
     url = destination_url + f"api/category/{urllib.parse.quote(category_path)}"
-    values = {"apikey": PECHA_API_KEY}
-    data = urllib.parse.urlencode(values)
-    binary_key = data.encode("ascii")
-    req = urllib.request.Request(url, binary_key, method="DELETE", headers=headers)
+    values = {"apikey": get_api_key()}
+    client = get_client(destination_url)
     try:
-        urllib.request.urlopen(req)
-        response = urllib.request.urlopen(req)
+        response = client.request(
+            "DELETE", url, fields=values, operation="remove_category"
+        )
+        invalidate(destination_url, CATEGORY)
         res_data = response.read().decode("utf-8")
+        get_registry().forget_category(destination_url, list(category_list))
         return res_data
     except HTTPError as e:
         error_message = (
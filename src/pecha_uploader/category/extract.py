@@ -1,7 +1,7 @@
-import urllib
+import urllib.parse
 from urllib.error import HTTPError
 
-from pecha_uploader.config import Destination_url, headers
+from pecha_uploader.cache import CATEGORY, cached_get
 
 
 def get_category(category_name: str, destination_url: str):
@@ -10,12 +10,9 @@ def get_category(category_name: str, destination_url: str):
         `category_name`: str, example: "Indian Treatises/Madyamika/The way of the bodhisattvas"
     """
     url = destination_url + "api/category/" + urllib.parse.quote(category_name)
-    req = urllib.request.Request(url, method="GET", headers=headers)
 
     try:
-        response = urllib.request.urlopen(req)
-        res = response.read().decode("utf-8")
-        return res
+        return cached_get(destination_url, CATEGORY, category_name, url, "get_category")
     except HTTPError as e:
         error_message = f"Category extract: HTTP Error {e.code} occurred: {e.read().decode('utf-8')}"
         raise HTTPError(e.url, e.code, error_message, e.headers, e.fp)
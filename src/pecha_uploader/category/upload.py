@@ -1,11 +1,10 @@
-import json
 from typing import List
 from urllib.error import HTTPError
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
 
-from pecha_uploader.clear_unfinished_text import remove_texts_meta
-from pecha_uploader.config import PECHA_API_KEY, headers, logger
+from pecha_uploader.cache import CATEGORY, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key, logger
+from pecha_uploader.encoding import encode_json
 from pecha_uploader.exceptions import APIError
 
 
@@ -22,6 +21,7 @@ def post_category(
         => post_category(["Indian Treatises"])
         => post_category(["Indian Treatises", "Madyamika"])
         => post_category(["Indian Treatises", "Madyamika", "The way of the bodhisattvas"])
+    Return True if the category was created, False if it already existed.
     """
     url = destination_url + "api/category"
     category_path = list(map(lambda x: x["name"], en_category_list))
@@ -39,22 +39,25 @@ def post_category(
     if category_path[-1] == "Commentaries":
         category["order"] = 2
 
-    input_json = json.dumps(category)
-    values = {"json": input_json, "apikey": PECHA_API_KEY}
+    input_json = encode_json(category)
+    values = {"json": input_json, "apikey": get_api_key()}
 
-    data = urlencode(values)
-    binary_data = data.encode("ascii")
-    req = Request(url, binary_data, headers=headers)
     category_name = category_path[-1]
 
     try:
-        response = urlopen(req)
+        # a category posted twice only answers "already exists"
+        response = get_client(destination_url).request(
+            "POST", url, fields=values, idempotent=True, operation="post_category"
+        )
+        # a new category shows up in the listing of its parents
+        invalidate(destination_url, CATEGORY)
         res = response.read().decode("utf-8")
         if "error" not in res:
             logger.info(f"UPLOADED: Category '{category_name}'")
+            return True
         elif "already exists" not in res and "error" in res:
-            remove_texts_meta({"term": category_name}, destination_url)
             raise APIError(f"Category: {res}")
+        return False
 
     except HTTPError as e:
         error_message = (
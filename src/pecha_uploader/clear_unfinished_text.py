@@ -1,24 +1,24 @@
-from pecha_uploader.category.delete import remove_category
-from pecha_uploader.index.delete import remove_index
-from pecha_uploader.preprocess.delete import remove_term
+from pecha_uploader.transaction import UploadTransaction
 
 
 def remove_texts_meta(meta_list: dict, destination_url: str):
-
-    if "term" in meta_list and "category" not in meta_list:
-        remove_term(meta_list["term"], destination_url)
+    """
+    Delete the index, every category of the category path and their terms, or
+    only the term when no category is given, e.g. to clean up after an upload
+    that was killed. Uploads roll back what they created by themselves, see
+    `pecha_uploader.transaction`.
+        `meta_list`: {"term": str, "category": List[str], "index": str}
+    """
+    transaction = UploadTransaction(destination_url)
     if "index" in meta_list:
-        remove_index(meta_list["index"], destination_url)
+        transaction.add_index(meta_list["index"])
     if "category" in meta_list:
         for cat in transform_category_list(meta_list["category"]):
-            res_cat = remove_category(cat, destination_url)
-
-            # if category doesn't exist, remove term
-            if "error" in res_cat and "doesn't exist" in res_cat:
-                remove_term(cat[-1], destination_url)
-            # if category is removed, remove term
-            elif "status" in res_cat:
-                remove_term(cat[-1], destination_url)
+            transaction.add_category(cat)
+            transaction.add_term(cat[-1])
+    elif "term" in meta_list:
+        transaction.add_term(meta_list["term"])
+    return transaction.rollback()
 
 
 def transform_category_list(categories):
@@ -0,0 +1,373 @@
+"""
+The `pecha-upload` command: upload pecha json files, directories or globs.
+
+    pecha-upload corpus/ extra/*.json --destination https://staging.pecha.org/ \\
+        --workers 8 --resume --summary summary.json
+
+Texts are uploaded with `upload_many`, root texts before their commentaries.
+While running, the throughput (texts per minute, chapters and megabytes per
+second) and an ETA are written to stderr. The run ends with a json summary of
+every text on stdout, or in the `--summary` file, and exits with status 1 when
+a text failed or was skipped.
+
+With `--plan`, nothing is uploaded: the terms, categories and indexes the texts
+need are printed instead, with a failed result for every file whose categories
+cannot be read.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, TextIO
+
+from pecha_uploader.batch import (
+    DEFAULT_WORKERS,
+    FAILED,
+    SKIPPED,
+    SUCCESS,
+    UploadResult,
+    summarize,
+    upload_many,
+)
+from pecha_uploader.config import (
+    API_KEY_ENV,
+    DESTINATION_URL_ENV,
+    get_api_key,
+    get_destination_url,
+    logger,
+    setup_logging,
+)
+from pecha_uploader.dry_run import check_dry_run
+from pecha_uploader.metrics import get_metrics
+from pecha_uploader.pipeline import get_index_key
+from pecha_uploader.snapshot import load_snapshot
+from pecha_uploader.stream import LANGUAGES, read_categories
+
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+
+def expand_paths(patterns: Iterable[str]) -> List[Path]:
+    """
+    Return the pecha json files of `patterns`, in order and without duplicates.
+    A pattern is a file, a directory whose `*.json` files are taken
+    recursively, or a glob, `**` included.
+    """
+    paths: Dict[Path, None] = {}
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = sorted(path.rglob("*.json"))
+        elif path.is_file():
+            matches = [path]
+        else:
+            matches = sorted(
+                Path(match)
+                for match in glob.glob(pattern, recursive=True)
+                if Path(match).is_file()
+            )
+            if not matches:
+                raise FileNotFoundError(f"No pecha json file matches '{pattern}'.")
+        for match in matches:
+            paths.setdefault(match, None)
+    return list(paths)
+
+
+def _format_duration(seconds: float):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """
+    Throughput and ETA of a batch upload, written to `stream` every `interval`
+    seconds. Chapters and bytes are read from the metrics registry, so they
+    include the uploads still running; dry runs record no metrics and only
+    count texts.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        interval: float = DEFAULT_PROGRESS_INTERVAL,
+        stream: TextIO = sys.stderr,
+    ):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.counts = {SUCCESS: 0, FAILED: 0, SKIPPED: 0}
+        self._start = time.monotonic()
+        self._chapters = self._posted_chapters()
+        self._bytes = self._bytes_sent()
+        self._tty = stream.isatty()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _posted_chapters():
+        return get_metrics().total("pecha_api_calls_total", operation="post_text")
+
+    @staticmethod
+    def _bytes_sent():
+        return get_metrics().total("pecha_api_bytes_sent_total")
+
+    @property
+    def done(self):
+        return sum(self.counts.values())
+
+    def snapshot(self):
+        """Counts and rates of the run so far"""
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        chapters = self._posted_chapters() - self._chapters
+        bytes_sent = self._bytes_sent() - self._bytes
+        done = self.done
+        eta = (self.total - done) * elapsed / done if done else None
+        return {
+            "texts": dict(self.counts, total=self.total),
+            "chapters": int(chapters),
+            "bytes_sent": int(bytes_sent),
+            "elapsed": elapsed,
+            "eta": eta,
+            "texts_per_minute": done * 60 / elapsed,
+            "chapters_per_second": chapters / elapsed,
+            "megabytes_per_second": bytes_sent / 1e6 / elapsed,
+        }
+
+    def format(self):
+        snapshot = self.snapshot()
+        eta = snapshot["eta"]
+        line = (
+            f"[{self.done}/{self.total} texts] "
+            f"{snapshot['texts_per_minute']:.1f} texts/min, "
+            f"{snapshot['chapters_per_second']:.1f} chapters/s, "
+            f"{snapshot['megabytes_per_second']:.2f} MB/s, "
+            f"elapsed {_format_duration(snapshot['elapsed'])}, "
+            f"ETA {_format_duration(eta) if eta is not None else '?'}"
+        )
+        if self.counts[FAILED]:
+            line += f", {self.counts[FAILED]} failed"
+        if self.counts[SKIPPED]:
+            line += f", {self.counts[SKIPPED]} skipped"
+        return line
+
+    def write(self, final: bool = False):
+        with self._lock:
+            if self._tty:
+                self.stream.write(f"\r\033[K{self.format()}" + ("\n" if final else ""))
+            else:
+                self.stream.write(f"{self.format()}\n")
+            self.stream.flush()
+
+    def add(self, result: UploadResult):
+        """`on_result` callback of `upload_many`"""
+        with self._lock:
+            self.counts[result.status] += 1
+        if self._tty and self._thread is not None:
+            self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write(final=True)
+
+
+def read_plan_categories(paths: List[Path]):
+    """
+    Return the categories of the texts of `paths`, and a failed `UploadResult`
+    for every file whose categories cannot be read, as `upload_many` does.
+    """
+    texts = []
+    unreadable = []
+    for path in paths:
+        try:
+            text = read_categories(path)
+            # the plan needs the categories of both sides, and the index title
+            get_index_key(text)
+            texts.append(
+                {side: {"categories": text[side]["categories"]} for side in LANGUAGES}
+            )
+        except Exception as e:
+            logger.error(f"PLAN: {path} is unreadable: {e}")
+            unreadable.append(
+                UploadResult(str(path), str(path), FAILED, f"Unreadable text: {e}")
+            )
+    return texts, unreadable
+
+
+def build_summary(
+    results: List[UploadResult], progress: Progress, destination_url: str
+):
+    """Machine readable summary of a run"""
+    snapshot = progress.snapshot()
+    return {
+        "destination_url": destination_url,
+        "texts": summarize(results),
+        "chapters": snapshot["chapters"],
+        "bytes_sent": snapshot["bytes_sent"],
+        "elapsed": snapshot["elapsed"],
+        "texts_per_minute": snapshot["texts_per_minute"],
+        "chapters_per_second": snapshot["chapters_per_second"],
+        "megabytes_per_second": snapshot["megabytes_per_second"],
+        "results": [result.to_dict() for result in results],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="pecha-upload",
+        description="Upload pecha json files to pecha.org, root texts before "
+        "their commentaries.",
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="pecha json files, directories or globs"
+    )
+    parser.add_argument(
+        "--destination",
+        "-d",
+        help=f"destination url, ${DESTINATION_URL_ENV} by default",
+    )
+    parser.add_argument("--workers", "-w", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the steps earlier uploads of the same texts completed",
+    )
+    parser.add_argument(
+        "--only-changed",
+        action="store_true",
+        help="post only chapters and links that changed since the last upload",
+    )
+    parser.add_argument(
+        "--sync-links",
+        action="store_true",
+        help="post and delete only the links that differ from the destination's",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="write the requests of every text to a plan file instead of sending them",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse files chapter by chapter instead of loading them whole",
+    )
+    parser.add_argument(
+        "--no-registry",
+        action="store_true",
+        help="post terms and categories even if the local registry knows them",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="read what the destination has first, and post only what it lacks",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="print the terms, categories and indexes the texts need, upload nothing",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="profile every text, one at a time"
+    )
+    parser.add_argument(
+        "--trace", action="store_true", help="write a trace of every text"
+    )
+    parser.add_argument(
+        "--summary", help="write the json summary to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=DEFAULT_PROGRESS_INTERVAL,
+        help="seconds between progress lines",
+    )
+    parser.add_argument(
+        "--quiet", "-q", action="store_true", help="write no progress lines"
+    )
+    parser.add_argument("--verbose", "-v", action="store_true", help="log every step")
+    args = parser.parse_args(argv)
+
+    setup_logging(logging.INFO if args.verbose else logging.WARNING)
+    try:
+        destination_url = get_destination_url(args.destination)
+        paths = expand_paths(args.paths)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(f"{e}")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if args.plan:
+        texts, unreadable = read_plan_categories(paths)
+        plan = load_snapshot(destination_url).plan(texts).to_dict()
+        plan["results"] = [result.to_dict() for result in unreadable]
+        print(json.dumps(plan, indent=2, ensure_ascii=False))
+        return 1 if unreadable else 0
+    if args.dry_run:
+        try:
+            check_dry_run(args.resume, args.only_changed)
+        except ValueError as e:
+            parser.error(f"{e}")
+        if args.snapshot:
+            parser.error("--dry-run cannot be combined with --snapshot.")
+    elif not get_api_key():
+        parser.error(f"${API_KEY_ENV} is not set.")
+
+    progress = Progress(len(paths), args.progress_interval)
+    if not args.quiet:
+        progress.start()
+    try:
+        results = upload_many(
+            paths,
+            destination_url,
+            workers=args.workers,
+            use_registry=not args.no_registry,
+            resume=args.resume,
+            only_changed=args.only_changed,
+            stream=args.stream,
+            dry_run=args.dry_run,
+            profile=args.profile or None,
+            on_result=progress.add,
+            snapshot=args.snapshot,
+            sync_links=args.sync_links,
+            tracing=args.trace or None,
+        )
+    finally:
+        if not args.quiet:
+            progress.stop()
+
+    summary = json.dumps(
+        build_summary(results, progress, destination_url),
+        indent=2,
+        ensure_ascii=False,
+    )
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(summary + "\n")
+    else:
+        print(summary)
+    return 0 if all(result.status == SUCCESS for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
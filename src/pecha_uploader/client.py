@@ -0,0 +1,513 @@
+"""
+Pooled keep-alive HTTP client shared by every API module.
+
+One client is kept per destination url, and each client keeps a small pool of
+open connections per host, so an upload reuses a handful of connections instead
+of doing a new TCP+TLS handshake for every term, chapter and link batch.
+Transient failures are retried, and a circuit breaker suspends requests to a
+destination that keeps failing, see `pecha_uploader.resilience`.
+Form fields are sent as UTF-8 multipart bodies, see `pecha_uploader.encoding`,
+and the bytes sent are counted per client and per `track_transfer` block.
+Calls, latencies and bytes are also recorded per operation in the metrics
+registry, see `pecha_uploader.metrics`, and every call is a span of the
+current trace, see `pecha_uploader.tracing`.
+"""
+
+import contextvars
+import gzip
+import http.client
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Callable, Dict, List, NamedTuple, Optional
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+from pecha_uploader.config import headers, logger
+from pecha_uploader.encoding import (
+    BODY_ENCODINGS,
+    COMPRESS_MIN_BYTES,
+    FORM,
+    MULTIPART,
+    compress,
+    encode_fields,
+    field_size,
+)
+from pecha_uploader.metrics import get_metrics
+from pecha_uploader.resilience import IDEMPOTENT_METHODS, CircuitBreaker, RetryPolicy
+from pecha_uploader.tracing import KIND_CLIENT, current_span, span
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 120
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+UNSUPPORTED_MEDIA_TYPE = 415
+BAD_REQUEST = 400
+
+# metrics operation of requests that are not named by their caller
+DEFAULT_OPERATION = "other"
+
+
+class TransferStats:
+    """Requests and bytes exchanged with the API, also added to `parent`"""
+
+    def __init__(self, parent: Optional["TransferStats"] = None):
+        self.parent = parent
+        self.requests = 0
+        self.bytes_sent = 0  # request bodies as sent on the wire
+        self.bytes_received = 0  # response bodies as received on the wire
+        self.field_bytes = 0  # UTF-8 size of the posted form fields
+        self._lock = threading.Lock()
+
+    def add(self, sent: int, received: int, fields: int):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.field_bytes += fields
+        if self.parent is not None:
+            self.parent.add(sent, received, fields)
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "field_bytes": self.field_bytes,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.requests} requests, {self.bytes_sent} bytes sent "
+            f"for {self.field_bytes} bytes of fields, "
+            f"{self.bytes_received} bytes received"
+        )
+
+
+_transfer: contextvars.ContextVar = contextvars.ContextVar(
+    "pecha_transfer", default=None
+)
+
+
+@contextmanager
+def track_transfer():
+    """
+    Count the requests made in this block, including those made on executor
+    threads started with a copy of the current context. Blocks can be nested,
+    the outer stats then include the requests of the inner ones.
+        with track_transfer() as stats:
+            upload(text, destination_url)
+        logger.info(f"SENT: {stats}")
+    """
+    stats = TransferStats(_transfer.get())
+    token = _transfer.set(stats)
+    try:
+        yield stats
+    finally:
+        _transfer.reset(token)
+
+
+class RequestEvent(NamedTuple):
+    """One attempt of a request, as passed to the listeners of a client"""
+
+    method: str
+    url: str
+    status: Optional[int]  # None when no response was received
+    elapsed: float  # seconds
+    attempt: int
+    error: Optional[Exception]
+
+
+class Response:
+    """HTTP response whose body has already been read off the connection."""
+
+    def __init__(self, url: str, status: int, headers, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def read(self) -> bytes:
+        return self.body
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to a single `scheme://host:port`.
+    At most `size` idle connections are kept; extra connections opened under
+    heavier concurrency are closed after use.
+    """
+
+    def __init__(
+        self, scheme: str, host: str, port: Optional[int], size: int, timeout: float
+    ):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host,
+                self.port,
+                timeout=self.timeout,
+                context=ssl.create_default_context(),
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """Return `(connection, reused)`."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool = True):
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class PechaClient:
+    """
+    HTTP client for one destination url (e.g. "https://pecha.org/").
+    Requests raise `urllib.error.HTTPError` for 4xx/5xx responses, just like
+    `urllib.request.urlopen`, so callers keep their existing error handling.
+        `retry`: RetryPolicy, when to send a failed request again
+        `breaker`: CircuitBreaker, shared by every request of this client
+        `encoding`: "multipart" to post raw UTF-8 fields, "form" to url-encode them
+        `compress`: gzip request bodies, opt-in as only some servers decode
+        them. The client sends plain bodies for good once a gzip body is
+        answered 415, or 400 from a server that did not decode it
+    """
+
+    def __init__(
+        self,
+        destination_url: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        default_headers: Optional[Dict[str, str]] = None,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        encoding: str = MULTIPART,
+        compress: bool = False,
+    ):
+        if encoding not in BODY_ENCODINGS:
+            raise ValueError(f"encoding must be one of {BODY_ENCODINGS}.")
+        self.destination_url = destination_url
+        self.encoding = encoding
+        self.compress = compress
+        self.stats = TransferStats()
+        self.listeners: List[Callable[[RequestEvent], None]] = []
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.headers = dict(headers if default_headers is None else default_headers)
+        self._pools: Dict[tuple, ConnectionPool] = {}
+        self._lock = threading.Lock()
+
+    def _pool_for(self, scheme: str, host: str, port: Optional[int]) -> ConnectionPool:
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(scheme, host, port, self.pool_size, self.timeout)
+                self._pools[key] = pool
+            pool.size = self.pool_size
+            return pool
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        fields: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: Optional[bool] = None,
+        operation: Optional[str] = None,
+    ) -> Response:
+        """
+        Send a request and return the fully read `Response`.
+            `fields`: dict, form fields sent as the request body
+            `headers`: dict, extra headers for this request only
+            `idempotent`: bool, whether sending the request twice is harmless,
+            by default only for methods like GET and DELETE. Requests that are
+            not idempotent are retried only when the server refused them.
+            `operation`: str, name of the call in the metrics, e.g. "post_text"
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        operation = operation or DEFAULT_OPERATION
+        with span(
+            operation,
+            KIND_CLIENT,
+            **{"http.request.method": method, "url.full": url},
+        ):
+            return self._request(method, url, fields, headers, idempotent, operation)
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        fields: Optional[Dict],
+        headers: Optional[Dict[str, str]],
+        idempotent: bool,
+        operation: str,
+    ) -> Response:
+        call_start = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                self.breaker.before_request()
+            except Exception as e:
+                self._record_call(operation, call_start, attempt - 1, e)
+                raise
+            start = time.monotonic()
+            try:
+                response = self._request_once(method, url, fields, headers, operation)
+            except Exception as e:
+                self._notify(method, url, start, attempt, e)
+                self.breaker.record(e)
+                delay = self.retry.retry_delay(attempt, e, idempotent)
+                if delay is None:
+                    self._record_call(operation, call_start, attempt, e)
+                    raise
+                logger.warning(
+                    f"Retrying {method} {url} in {delay:.1f}s "
+                    f"(attempt {attempt + 1}/{self.retry.max_attempts}): {e}"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._notify(method, url, start, attempt, None, response.status)
+            self.breaker.record(None)
+            self._record_call(operation, call_start, attempt, None, response.status)
+            return response
+
+    def _record_call(
+        self,
+        operation: str,
+        start: float,
+        attempts: int,
+        error: Optional[Exception],
+        status: Optional[int] = None,
+    ):
+        if isinstance(error, HTTPError):
+            status = error.code
+        call_span = current_span()
+        call_span.set_attribute("pecha.attempts", attempts)
+        if status is not None:
+            call_span.set_attribute("http.response.status_code", status)
+        get_metrics().record_call(
+            operation,
+            "error" if status is None else f"{status}",
+            time.monotonic() - start,
+            attempts,
+        )
+
+    def add_listener(self, listener: Callable[[RequestEvent], None]):
+        """Call `listener` with a `RequestEvent` after every request attempt"""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[RequestEvent], None]):
+        self.listeners.remove(listener)
+
+    def _notify(
+        self,
+        method: str,
+        url: str,
+        start: float,
+        attempt: int,
+        error: Optional[Exception],
+        status: Optional[int] = None,
+    ):
+        if not self.listeners:
+            return
+        if isinstance(error, HTTPError):
+            status = error.code
+        event = RequestEvent(
+            method, url, status, time.monotonic() - start, attempt, error
+        )
+        for listener in list(self.listeners):
+            listener(event)
+
+    def _request_once(
+        self,
+        method: str,
+        url: str,
+        fields: Optional[Dict],
+        headers: Optional[Dict[str, str]],
+        operation: Optional[str] = None,
+    ) -> Response:
+        request_headers = dict(self.headers)
+        request_headers["Accept-Encoding"] = "gzip"
+        if headers:
+            request_headers.update(headers)
+        body = None
+        encoding = self.encoding if method == "POST" else FORM
+        compressed = False
+        if fields is not None:
+            body, request_headers["Content-Type"] = encode_fields(fields, encoding)
+            if self.compress and len(body) >= COMPRESS_MIN_BYTES:
+                body = compress(body)
+                request_headers["Content-Encoding"] = "gzip"
+                compressed = True
+
+        for _ in range(MAX_REDIRECTS + 1):
+            status, reason, res_headers, data = self._send(
+                method, url, body, request_headers
+            )
+            self._count(body, data, fields, operation)
+            rejected = status == UNSUPPORTED_MEDIA_TYPE or (
+                compressed and status == BAD_REQUEST
+            )
+            if rejected and (compressed or encoding != FORM):
+                # fall back for good, first to plain bodies, then to url-encoding
+                if compressed:
+                    logger.warning(f"{self.destination_url} rejects gzip bodies")
+                    self.compress = False
+                else:
+                    logger.warning(f"{self.destination_url} rejects {encoding} bodies")
+                    self.encoding = FORM
+                return self._request_once(method, url, fields, headers, operation)
+            location = res_headers.get("Location")
+            if status not in REDIRECT_CODES or not location:
+                break
+            # follow redirects the way urllib.request does
+            if method == "POST" and status in (301, 302, 303):
+                method, body = "GET", None
+                request_headers.pop("Content-Type", None)
+            elif method not in ("GET", "HEAD"):
+                break
+            url = urljoin(url, location)
+
+        if res_headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        if status >= 400:
+            raise HTTPError(url, status, reason, res_headers, BytesIO(data))
+        return Response(url, status, res_headers, data)
+
+    def _count(
+        self,
+        body: Optional[bytes],
+        data: bytes,
+        fields: Optional[Dict],
+        operation: Optional[str] = None,
+    ):
+        sent = len(body) if body else 0
+        size = field_size(fields) if body else 0
+        self.stats.add(sent, len(data), size)
+        stats = _transfer.get()
+        if stats is not None:
+            stats.add(sent, len(data), size)
+        if operation is not None:
+            get_metrics().record_bytes(operation, sent, len(data))
+            call_span = current_span()
+            call_span.add("pecha.bytes_sent", sent)
+            call_span.add("pecha.bytes_received", len(data))
+
+    def _send(
+        self, method: str, url: str, body: Optional[bytes], request_headers: Dict
+    ):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        pool = self._pool_for(parts.scheme, parts.hostname, parts.port)
+
+        while True:
+            conn, reused = pool.acquire()
+            try:
+                conn.request(method, path, body=body, headers=request_headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # the server may have dropped an idle keep-alive connection
+                if reused:
+                    logger.debug(f"Retrying {method} {url} on a fresh connection")
+                    continue
+                raise
+            pool.release(conn, reusable=not response.will_close)
+            return response.status, response.reason, response.headers, data
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+
+_clients: Dict[str, PechaClient] = {}
+_clients_lock = threading.Lock()
+
+_override: contextvars.ContextVar = contextvars.ContextVar(
+    "pecha_client_override", default=None
+)
+
+
+@contextmanager
+def use_client(client: PechaClient):
+    """
+    Make `get_client` return `client` for its destination url in this block,
+    including on executor threads started with a copy of the current context.
+    """
+    token = _override.set(client)
+    try:
+        yield client
+    finally:
+        _override.reset(token)
+
+
+def get_client(destination_url: str) -> PechaClient:
+    """Return the shared client for `destination_url`, creating it on first use."""
+    override = _override.get()
+    if override is not None and override.destination_url == destination_url:
+        return override
+    with _clients_lock:
+        client = _clients.get(destination_url)
+        if client is None:
+            client = PechaClient(destination_url)
+            _clients[destination_url] = client
+        return client
+
+
+def configure_client(destination_url: str, **options) -> PechaClient:
+    """
+    Replace the shared client for `destination_url` with one built from `options`.
+        e.g. configure_client("https://pecha.org/", pool_size=8, timeout=300)
+             configure_client("https://pecha.org/", retry=RetryPolicy(max_attempts=1))
+    """
+    client = PechaClient(destination_url, **options)
+    with _clients_lock:
+        old = _clients.get(destination_url)
+        _clients[destination_url] = client
+    if old is not None:
+        old.close()
+    return client
+
+
+def close_clients():
+    """Close every pooled connection of every shared client."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
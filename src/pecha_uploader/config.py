@@ -1,9 +1,23 @@
+"""
+Paths, logging and credentials of the package.
+
+Importing this module has no side effects: directories are created by the
+code that first writes to them, logging is left to the application (see
+`setup_logging`), and the API key and default destination are read from the
+environment every time they are needed, so `set_api_key` applies to every
+module, including those imported before it was called.
+"""
+
 import logging
 import os
-from enum import Enum
+import threading
 from pathlib import Path
+from typing import Optional
+
+API_KEY_ENV = "PECHA_API_KEY"
+DESTINATION_URL_ENV = "PECHA_DESTINATION_URL"
 
-PECHA_API_KEY = os.environ.get("PECHA_API_KEY")
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 
 
 def _mkdir_if_not(path: Path):
@@ -12,11 +26,11 @@ def _mkdir_if_not(path: Path):
     return path
 
 
-# Paths
-BASE_PATH = _mkdir_if_not(Path.home() / ".pecha_uploader")
-TEXT_PATH = _mkdir_if_not(BASE_PATH / "texts")
-LINK_PATH = _mkdir_if_not(BASE_PATH / "links")
-LINK_JSON_PATH = _mkdir_if_not(LINK_PATH / "jsons")
+# Paths, created on first write
+BASE_PATH = Path.home() / ".pecha_uploader"
+TEXT_PATH = BASE_PATH / "texts"
+LINK_PATH = BASE_PATH / "links"
+LINK_JSON_PATH = LINK_PATH / "jsons"
 
 TEXT_ERROR_LOG = TEXT_PATH / "errors.txt"
 TEXT_ERROR_ID_LOG = TEXT_PATH / "errors_text_id.txt"
@@ -28,14 +42,26 @@ LINK_ERROR_ID_LOG = LINK_PATH / "errors_link_id.txt"
 LINK_SUCCESS_LOG = LINK_PATH / "success.txt"
 LINK_INFO_LOG = LINK_PATH / "info.txt"  # <--- New Info Log
 
+REGISTRY_PATH = BASE_PATH / "registry.json"
+JOURNAL_PATH = BASE_PATH / "journal.sqlite3"
+MANIFEST_PATH = BASE_PATH / "manifest.sqlite3"
+PLAN_PATH = BASE_PATH / "plans"
+METRICS_PATH = BASE_PATH / "metrics"
+TRACE_PATH = BASE_PATH / "traces"
+PROFILE_PATH = BASE_PATH / "profiles"
+CACHE_PATH = BASE_PATH / "cache.json"
+
+
+# the package logs through this logger, silent until the application sets up
+# logging, e.g. with `setup_logging`
+logger = logging.getLogger("pecha_uploader")
+logger.addHandler(logging.NullHandler())
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
 
-# Create a logger instance
-logger = logging.getLogger(__name__)
+def setup_logging(level: int = logging.INFO):
+    """Log to stderr, as command line entry points of the package do"""
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
 
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"  # noqa
@@ -50,13 +76,74 @@ BASEPATH = os.path.dirname(os.path.abspath(__file__))  # Path to `Pecha.org/tool
 # FODIAN_STAGING = "https://staging.fodian.org/"
 
 
-
 def log_link_success(text_name: str):
+    _mkdir_if_not(LINK_PATH)
     with open(LINK_SUCCESS_LOG, "w") as f:
         f.write(text_name + "\n")
 
 
+_log_lock = threading.Lock()
+
+
+def log_text_success(text_name: str):
+    with _log_lock:
+        _mkdir_if_not(TEXT_PATH)
+        with open(TEXT_SUCCESS_LOG, "a", encoding="utf-8") as f:
+            f.write(text_name + "\n")
+
+
+def log_text_error(text_name: str, error: str):
+    with _log_lock:
+        _mkdir_if_not(TEXT_PATH)
+        with open(TEXT_ERROR_LOG, "a", encoding="utf-8") as f:
+            f.write(f"{text_name} : {error}\n")
+        with open(TEXT_ERROR_ID_LOG, "a", encoding="utf-8") as f:
+            f.write(text_name + "\n")
+
+
+def log_link_error(link_refs: str, error: str):
+    with _log_lock:
+        _mkdir_if_not(LINK_PATH)
+        with open(LINK_ERROR_LOG, "a", encoding="utf-8") as f:
+            f.write(f"{link_refs} : {error}\n")
+        with open(LINK_ERROR_ID_LOG, "a", encoding="utf-8") as f:
+            f.write(link_refs + "\n")
+
+
+def get_api_key():
+    """Return the API key of `set_api_key`, or of the PECHA_API_KEY variable"""
+    return os.environ.get(API_KEY_ENV)
+
+
 def set_api_key(api_key: str):
     if not api_key:
         raise ValueError("PECHA API KEY is not given properly.")
-    os.environ["PECHA_API_KEY"] = api_key
+    os.environ[API_KEY_ENV] = api_key
+
+
+def get_destination_url(destination_url: Optional[str] = None):
+    """
+    Return `destination_url` if given, else the PECHA_DESTINATION_URL variable.
+    Raise ValueError if neither is set.
+    """
+    destination_url = destination_url or os.environ.get(DESTINATION_URL_ENV)
+    if not destination_url:
+        raise ValueError(
+            f"No destination url given, and {DESTINATION_URL_ENV} is not set."
+        )
+    if not destination_url.endswith("/"):
+        destination_url += "/"
+    return destination_url
+
+
+def set_destination_url(destination_url: str):
+    if not destination_url:
+        raise ValueError("Destination url is not given properly.")
+    os.environ[DESTINATION_URL_ENV] = destination_url
+
+
+def __getattr__(name: str):
+    # `config.PECHA_API_KEY` keeps working, read at access time
+    if name == "PECHA_API_KEY":
+        return get_api_key()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
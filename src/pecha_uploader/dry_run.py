@@ -0,0 +1,155 @@
+"""
+Offline dry runs of the upload pipeline.
+
+In a dry run every API request is written to a JSONL plan file instead of
+being sent, while the text is preprocessed exactly as for a real upload. Each
+line holds the method, url and form fields of one request, with the api key
+redacted, and the size of its body. `replay_plan` sends a plan later, from any
+machine and optionally to another destination.
+"""
+
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Union
+from urllib.parse import quote
+
+from pecha_uploader.cache import bypass_cache
+from pecha_uploader.client import (
+    PechaClient,
+    Response,
+    get_client,
+    track_transfer,
+    use_client,
+)
+from pecha_uploader.config import PLAN_PATH, get_api_key, logger
+from pecha_uploader.encoding import FORM, encode_fields
+from pecha_uploader.metrics import suspend_metrics
+from pecha_uploader.resilience import IDEMPOTENT_METHODS
+
+API_KEY_FIELD = "apikey"
+REDACTED = "<redacted>"
+
+# answer of every planned request, without "error" so that wrappers carry on
+_PLANNED_BODY = b"{}"
+
+
+def default_plan_path(index_key: str):
+    """Plan file of a text under `PLAN_PATH`"""
+    return PLAN_PATH / f"{quote(index_key, safe=' ')}.jsonl"
+
+
+def check_dry_run(resume: bool, only_changed: bool):
+    """A dry run plans a full upload, without reading local upload state"""
+    if resume or only_changed:
+        raise ValueError("dry_run cannot be combined with resume or only_changed.")
+
+
+class PlanClient(PechaClient):
+    """
+    Client that writes requests to a plan file instead of sending them.
+    Body sizes are those of the client `destination_url` would really use.
+    """
+
+    def __init__(self, destination_url: str, fp):
+        client = get_client(destination_url)
+        super().__init__(destination_url, encoding=client.encoding)
+        self._fp = fp
+        self._write_lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        fields: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: Optional[bool] = None,
+        operation: Optional[str] = None,
+    ) -> Response:
+        body = b""
+        planned_fields = None
+        if fields is not None:
+            encoding = self.encoding if method == "POST" else FORM
+            body = encode_fields(fields, encoding)[0]
+            planned_fields = {
+                name: REDACTED if name == API_KEY_FIELD else value
+                for name, value in fields.items()
+            }
+        line = {
+            "method": method,
+            "destination_url": self.destination_url,
+            "path": url[len(self.destination_url) :],  # noqa
+            "fields": planned_fields,
+            "idempotent": method in IDEMPOTENT_METHODS
+            if idempotent is None
+            else idempotent,
+            "operation": operation,
+            "bytes": len(body),
+        }
+        data = json.dumps(line, ensure_ascii=False)
+        with self._write_lock:
+            self._fp.write(data + "\n")
+        self._count(body, b"", fields)
+        return Response(url, 200, {}, _PLANNED_BODY)
+
+
+@contextmanager
+def planning(
+    destination_url: str, index_key: str, plan_path: Optional[Union[str, Path]] = None
+):
+    """
+    Record the requests to `destination_url` made in this block, including
+    those of executor threads started with a copy of the current context.
+    Yield the `TransferStats` of the planned requests. Nothing is recorded in
+    the metrics, which are about requests really sent.
+    """
+    path = Path(plan_path) if plan_path else default_plan_path(index_key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        with use_client(PlanClient(destination_url, f)), track_transfer() as stats:
+            with suspend_metrics(), bypass_cache():
+                yield stats
+    logger.info(f"PLANNED: '{index_key}' {stats}, see {path}")
+
+
+def read_plan(plan_path: Union[str, Path]) -> Iterator[Dict]:
+    """Yield the planned requests of a plan file"""
+    with open(plan_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay_plan(
+    plan_path: Union[str, Path],
+    destination_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+):
+    """
+    Send the requests of a plan file in order.
+        `destination_url`: send to this destination instead of the planned one
+        `api_key`: key put in place of the redacted one, `get_api_key()` by default
+    Answers reporting an error are logged, HTTP errors are raised.
+    Return the `TransferStats` of the replay.
+    """
+    api_key = api_key or get_api_key()
+    with track_transfer() as stats:
+        for planned in read_plan(plan_path):
+            destination = destination_url or planned["destination_url"]
+            fields = planned["fields"]
+            if fields is not None and API_KEY_FIELD in fields:
+                fields = dict(fields, **{API_KEY_FIELD: api_key})
+            url = destination + planned["path"]
+            response = get_client(destination).request(
+                planned["method"],
+                url,
+                fields=fields,
+                idempotent=planned["idempotent"],
+                operation=planned.get("operation"),
+            )
+            res = response.read().decode("utf-8")
+            if "error" in res:
+                logger.warning(f"Replay: {planned['method']} {url} answered {res}")
+    logger.info(f"REPLAYED: {plan_path} {stats}")
+    return stats
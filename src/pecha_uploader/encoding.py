@@ -0,0 +1,96 @@
+"""
+Wire encoding of API payloads.
+
+The Sefaria API takes a `json` form field. Posted as
+`application/x-www-form-urlencoded` with ascii-escaped json, a Tibetan
+character costs 18 bytes (`\\u0f40` percent-encoded), against 3 bytes in
+UTF-8. `multipart/form-data` sends the compact UTF-8 json as it is. Url-encoded
+bodies remain the fallback, with the json ascii-escaped as the API always
+received it. Gzip-compressing bodies on top is opt-in, for servers known to
+decode them.
+"""
+
+import gzip
+import json
+import re
+import uuid
+from typing import Dict, Tuple
+from urllib.parse import urlencode
+
+FORM = "form"
+MULTIPART = "multipart"
+BODY_ENCODINGS = (FORM, MULTIPART)
+
+COMPRESS_MIN_BYTES = 1024  # smaller bodies are not worth a gzip header
+COMPRESS_LEVEL = 6
+
+JSON_FIELD = "json"  # the field holding the json payload of a request
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def encode_json(value) -> str:
+    """Serialize `value` without ascii escapes or whitespace"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _escape(match) -> str:
+    code = ord(match.group())
+    if code < 0x10000:
+        return f"\\u{code:04x}"
+    code -= 0x10000
+    return f"\\u{0xD800 | code >> 10:04x}\\u{0xDC00 | code & 0x3FF:04x}"
+
+
+def ascii_json(text: str) -> str:
+    """
+    Escape the non-ascii characters of the json `text` as
+    `json.dumps(..., ensure_ascii=True)` does, without parsing it again.
+    Outside of strings json has no non-ascii characters to escape.
+    """
+    return _NON_ASCII.sub(_escape, text)
+
+
+def _field_value(value) -> str:
+    return value if isinstance(value, str) else str(value)
+
+
+def encode_form(fields: Dict) -> Tuple[bytes, str]:
+    """Return `(body, content_type)` of url-encoded `fields`, json ascii-escaped"""
+    if isinstance(fields.get(JSON_FIELD), str):
+        fields = dict(fields, **{JSON_FIELD: ascii_json(fields[JSON_FIELD])})
+    return urlencode(fields).encode("ascii"), "application/x-www-form-urlencoded"
+
+
+def encode_multipart(fields: Dict) -> Tuple[bytes, str]:
+    """Return `(body, content_type)` of `fields` as UTF-8 multipart form data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{_field_value(value)}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return (
+        "".join(parts).encode("utf-8"),
+        f"multipart/form-data; boundary={boundary}",
+    )
+
+
+def encode_fields(fields: Dict, encoding: str) -> Tuple[bytes, str]:
+    """Return `(body, content_type)` of `fields` in one of `BODY_ENCODINGS`"""
+    if encoding == MULTIPART:
+        return encode_multipart(fields)
+    if encoding == FORM:
+        return encode_form(fields)
+    raise ValueError(f"Unknown body encoding '{encoding}', use one of {BODY_ENCODINGS}")
+
+
+def field_size(fields: Dict) -> int:
+    """UTF-8 size of the field values, the least any encoding has to send"""
+    return sum(len(_field_value(value).encode("utf-8")) for value in fields.values())
+
+
+def compress(body: bytes) -> bytes:
+    return gzip.compress(body, COMPRESS_LEVEL)
@@ -18,3 +18,9 @@ class TextParseError(Exception):
     """Custom exception for parsing errors."""
 
     pass
+
+
+class CircuitOpenError(APIError):
+    """Raised when requests to a destination are suspended after repeated failures."""
+
+    pass
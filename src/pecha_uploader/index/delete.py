@@ -1,23 +1,31 @@
-import urllib
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, headers
+from pecha_uploader.cache import INDEX, LINK, TEXT, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key
+from pecha_uploader.snapshot import forget_index
 
 
 def remove_index(index_key: str, destination_url: str):
     """
     index_key > index title
     """
-    index_key = index_key.replace(" ", "_")
-    url = destination_url + f"api/index/{index_key}"
-    values = {"apikey": PECHA_API_KEY}
-    data = urllib.parse.urlencode(values)
-    binary_key = data.encode("ascii")
-    headers["apiKey"] = PECHA_API_KEY
-    req = urllib.request.Request(url, binary_key, method="DELETE", headers=headers)
+    url = destination_url + f"api/index/{index_key.replace(' ', '_')}"
+    api_key = get_api_key()
+    values = {"apikey": api_key}
     try:
-        urllib.request.urlopen(req)
-        # res = urllib.request.urlopen(req)
+        get_client(destination_url).request(
+            "DELETE",
+            url,
+            fields=values,
+            headers={"apiKey": api_key},
+            operation="remove_index",
+        )
+        # the texts and links of the index are deleted with it
+        invalidate(destination_url, INDEX, index_key)
+        invalidate(destination_url, TEXT, index_key, prefix=True)
+        invalidate(destination_url, LINK)
+        forget_index(destination_url, index_key)
 
     except HTTPError as e:
         error_message = (
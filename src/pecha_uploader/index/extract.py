@@ -1,7 +1,6 @@
-import urllib
 from urllib.error import HTTPError
 
-from pecha_uploader.config import headers
+from pecha_uploader.cache import INDEX, cached_get
 
 
 def get_index(index: str, destination_url: str):
@@ -12,11 +11,10 @@ def get_index(index: str, destination_url: str):
     index_url = destination_url + "api/v2/raw/index"
     prepare_index_str = index.replace(" ", "_")
     url = f"{index_url}/{prepare_index_str}?with_content_counts=1"
-    req = urllib.request.Request(url, method="GET", headers=headers)
     try:
-        response = urllib.request.urlopen(req)  # noqa
-        res = response.read().decode("utf-8")
-        return res
+        return cached_get(
+            destination_url, INDEX, index, url, "get_index", "with_content_counts=1"
+        )
     except HTTPError as e:
         error_message = (
             f"Index extract: HTTP Error {e.code} occurred: {e.read().decode('utf-8')}"
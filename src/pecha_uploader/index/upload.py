@@ -1,10 +1,11 @@
-import json
-import urllib
+import urllib.parse
 from typing import Dict, List
 from urllib.error import HTTPError
 
-from pecha_uploader.clear_unfinished_text import remove_texts_meta
-from pecha_uploader.config import PECHA_API_KEY, headers
+from pecha_uploader.cache import INDEX, TEXT, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key
+from pecha_uploader.encoding import encode_json
 from pecha_uploader.exceptions import APIError  # Import the custom exception
 
 
@@ -51,23 +52,22 @@ def post_index(
         index["collective_title"] = index_str
         index["dependence"] = category_list[-1]["link"]
 
-    input_json = json.dumps(index, indent=4, ensure_ascii=False)
+    input_json = encode_json(index)
 
     values = {
         "json": input_json,
-        "apikey": PECHA_API_KEY,
+        "apikey": get_api_key(),
     }
-    data = urllib.parse.urlencode(values)
-    binary_data = data.encode("ascii")
-    req = urllib.request.Request(url, binary_data, headers=headers)
     try:
-        response = urllib.request.urlopen(req)
+        # posting an index again updates it
+        response = get_client(destination_url).request(
+            "POST", url, fields=values, idempotent=True, operation="post_index"
+        )
+        invalidate(destination_url, INDEX, index_str)
+        invalidate(destination_url, TEXT, index_str, prefix=True)
         res = response.read().decode("utf-8")
         if "error" in res:
             if "already exists." not in res:
-                remove_texts_meta(
-                    {"term": index_str, "category": category_path}, destination_url
-                )
                 raise APIError(f"Index ({index_str}):  {res}")
 
     except HTTPError as e:
@@ -0,0 +1,134 @@
+"""
+Durable journal of completed upload steps.
+
+Every finished operation of an upload (term, category, index, each chapter,
+each link batch) is recorded in a SQLite database under `BASE_PATH`, keyed by
+destination url and a hash of the input text. An upload started again with
+`resume=True` skips the steps that already completed.
+
+Texts read from a file are keyed by the hash of its bytes. A text passed as a
+dict is hashed only by uploads that resume, so it is journaled from the first
+run only when that run also passes `resume=True`.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from pecha_uploader.config import JOURNAL_PATH
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS steps (
+    destination TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    step TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (destination, input_hash, step)
+)
+"""
+
+
+def hash_text(text: Dict):
+    """Return a stable hash of a pecha json"""
+    data = json.dumps(text, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: Path):
+    """Return the hash of a pecha json file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadJournal:
+    """
+    Completed steps of uploading one text to one destination.
+        `resume`: keep the steps recorded by earlier runs, otherwise start over
+    """
+
+    def __init__(
+        self,
+        destination_url: str,
+        input_hash: str,
+        resume: bool = False,
+        path: Path = JOURNAL_PATH,
+    ):
+        self.destination_url = destination_url
+        self.input_hash = input_hash
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        if not resume:
+            self.clear()
+        rows = self._conn.execute(
+            "SELECT step FROM steps WHERE destination = ? AND input_hash = ?",
+            (destination_url, input_hash),
+        )
+        self._done = {step for (step,) in rows}
+
+    @classmethod
+    def for_text(
+        cls,
+        text: Dict,
+        destination_url: str,
+        resume: bool = False,
+        input_hash: Optional[str] = None,
+    ):
+        """
+        Journal of uploading `text`, or None when there is none to keep.
+            `input_hash`: hash to key the journal by, e.g. the `hash_file` of the
+            file `text` was read from. Without it, `text` is serialized and
+            hashed only when resuming, and an upload that does not resume is
+            not journaled.
+        """
+        if input_hash is None:
+            if not resume:
+                return None
+            input_hash = hash_text(text)
+        return cls(destination_url, input_hash, resume)
+
+    def is_done(self, step: str):
+        return step in self._done
+
+    def mark_done(self, step: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?)",
+                (self.destination_url, self.input_hash, step, time.time()),
+            )
+            self._conn.commit()
+            self._done.add(step)
+
+    def clear(self):
+        """Forget every step recorded for this text and destination"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM steps WHERE destination = ? AND input_hash = ?",
+                (self.destination_url, self.input_hash),
+            )
+            self._conn.commit()
+            self._done = set()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def run_step(journal: Optional[UploadJournal], step: str, fn, *args):
+    """Call `fn(*args)` unless `journal` has `step` completed, then record it."""
+    if journal is not None and journal.is_done(step):
+        return
+    fn(*args)
+    if journal is not None:
+        journal.mark_done(step)
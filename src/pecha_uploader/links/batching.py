@@ -0,0 +1,247 @@
+"""
+Adaptive, parallel posting of commentary links.
+
+Links are grouped into batches by the size of their serialized json rather
+than by count. The byte budget of a batch grows while the server answers
+quickly and shrinks when it slows down or a batch fails. Several batches are
+in flight at once, and a failed batch is split in halves that are retried, so
+one bad link does not abort the whole link stage. Splitting stops after
+`max_split_depth` halvings, and nothing more is posted once the circuit of the
+destination is open: the links left are reported as failed instead.
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
+from typing import Dict, Iterable, List, Optional
+from urllib.error import HTTPError
+
+from pecha_uploader.client import get_client
+from pecha_uploader.config import LINK_ERROR_LOG, log_link_error, logger
+from pecha_uploader.encoding import encode_json
+from pecha_uploader.exceptions import CircuitOpenError
+from pecha_uploader.links.upload import post_link
+from pecha_uploader.manifest import Manifest
+from pecha_uploader.tracing import span
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_BATCH_BYTES = 16 * 1024  # about the 150 links posted per batch before
+MIN_BATCH_BYTES = 1024
+MAX_BATCH_BYTES = 512 * 1024
+DEFAULT_TARGET_LATENCY = 2.0  # seconds
+# a failing batch costs at most 2 ** (depth + 1) - 1 requests, not 2 per link
+DEFAULT_MAX_SPLIT_DEPTH = 4
+
+# errors every other batch would run into as well
+_FATAL_STATUS = (401, 403)
+
+
+def payload_size(links: List[Dict]):
+    """Size in bytes of the serialized links"""
+    return len(encode_json(links).encode("utf-8"))
+
+
+class BatchSizer:
+    """
+    Byte budget of a link batch, adapted to the observed server latency.
+        `target_latency`: seconds a batch should take, the budget grows while
+        batches are faster than half of it and shrinks when they are slower
+    """
+
+    def __init__(
+        self,
+        initial_bytes: int = DEFAULT_BATCH_BYTES,
+        min_bytes: int = MIN_BATCH_BYTES,
+        max_bytes: int = MAX_BATCH_BYTES,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+    ):
+        if not 0 < min_bytes <= initial_bytes <= max_bytes:
+            raise ValueError("batch sizes must satisfy 0 < min <= initial <= max.")
+        self.budget = initial_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def observe(self, batch_bytes: int, elapsed: float):
+        """Adapt the budget to a batch of `batch_bytes` that took `elapsed` seconds"""
+        with self._lock:
+            if elapsed > self.target_latency:
+                scaled = int(self.budget * self.target_latency / elapsed)
+                self.budget = max(self.min_bytes, scaled)
+            elif elapsed < self.target_latency / 2 and batch_bytes >= self.budget / 2:
+                # only full batches tell whether a larger one would be fast
+                self.budget = min(self.max_bytes, int(self.budget * 1.5))
+
+    def shrink(self):
+        """Halve the budget after a failed batch"""
+        with self._lock:
+            self.budget = max(self.min_bytes, self.budget // 2)
+
+
+class _Batch:
+    def __init__(self, links: List[Dict], size: int, depth: int = 0):
+        self.links = links
+        self.size = size
+        self.depth = depth  # number of halvings that produced the batch
+
+
+def _post_batch(links: List[Dict], destination_url: str):
+    with span(
+        "link_batch",
+        **{"pecha.links": len(links), "pecha.first_ref": links[0]["refs"][0]},
+    ):
+        start = time.monotonic()
+        post_link(links, destination_url)
+        return time.monotonic() - start
+
+
+def post_links(
+    links: Iterable[Dict],
+    destination_url: str,
+    manifest: Optional[Manifest] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    sizer: Optional[BatchSizer] = None,
+    max_split_depth: int = DEFAULT_MAX_SPLIT_DEPTH,
+):
+    """
+    Post links in batches sized by `sizer`, with up to `max_in_flight` batches
+    at the same time. Posted links are recorded in `manifest`.
+        `max_split_depth`: times a failed batch is halved, a part that still
+        fails after that is given up as a whole
+    Links that fail even when posted alone, or in a part that cannot be split
+    anymore, are written to `LINK_ERROR_LOG`, and an exception is raised once
+    every other link is posted. When the circuit of the destination opens, the
+    batches in flight are finished, every link left is written to
+    `LINK_ERROR_LOG` and `CircuitOpenError` is raised.
+    """
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1.")
+    sizer = sizer or BatchSizer()
+    client = get_client(destination_url)
+    client.pool_size = max(client.pool_size, max_in_flight)
+
+    links = iter(links)
+    pending: List[Dict] = []  # a link that did not fit into the previous batch
+    retries: deque = deque()
+    posted = batches = 0
+    failed = 0
+    circuit_open: Optional[CircuitOpenError] = None
+
+    def next_batch():
+        if retries:
+            return retries.popleft()
+        batch: List[Dict] = []
+        size = 2  # brackets of the json list
+        budget = sizer.budget
+        while True:
+            link = pending.pop() if pending else next(links, None)
+            if link is None:
+                break
+            link_size = payload_size([link])  # brackets stand in for the separator
+            if batch and size + link_size > budget:
+                pending.append(link)
+                break
+            batch.append(link)
+            size += link_size
+        return _Batch(batch, size) if batch else None
+
+    with ThreadPoolExecutor(
+        max_workers=max_in_flight, thread_name_prefix="pecha-links"
+    ) as executor:
+        running = {}
+        while True:
+            while circuit_open is None and len(running) < max_in_flight:
+                batch = next_batch()
+                if batch is None:
+                    break
+                # keep context variables such as `track_transfer` stats
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    _post_batch,
+                    batch.links,
+                    destination_url,
+                )
+                running[future] = batch
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = running.pop(future)
+                if future.cancelled():
+                    failed += _give_up(batch.links, circuit_open)
+                    continue
+                try:
+                    elapsed = future.result()
+                except CircuitOpenError as e:
+                    # the server is failing, splitting the batch would not help
+                    for other in running:
+                        other.cancel()
+                    circuit_open = circuit_open or e
+                    failed += _give_up(batch.links, e)
+                    continue
+                except HTTPError as e:
+                    if e.code in _FATAL_STATUS:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    failed += _retry_split(batch, e, retries, sizer, max_split_depth)
+                    continue
+                except Exception as e:
+                    failed += _retry_split(batch, e, retries, sizer, max_split_depth)
+                    continue
+
+                sizer.observe(batch.size, elapsed)
+                posted += len(batch.links)
+                batches += 1
+                if manifest is not None:
+                    manifest.add_links(batch.links)
+
+    logger.info(f"UPLOADED: {posted} links in {batches} batches")
+    if circuit_open is not None:
+        for batch in retries:
+            failed += _give_up(batch.links, circuit_open)
+        failed += _give_up(chain(pending, links), circuit_open)
+        raise CircuitOpenError(
+            f"Link: {failed} links could not be posted, see {LINK_ERROR_LOG}: "
+            f"{circuit_open}"
+        ) from circuit_open
+    if failed:
+        raise Exception(
+            f"Link: {failed} links could not be posted, see {LINK_ERROR_LOG}"
+        )
+
+
+def _give_up(links: Iterable[Dict], error: Exception):
+    """Write `links` to `LINK_ERROR_LOG`, return their number"""
+    count = 0
+    for link in links:
+        log_link_error(" | ".join(link["refs"]), f"{error}")
+        count += 1
+    if count:
+        logger.error(f"Link: {count} links failed: {error}")
+    return count
+
+
+def _retry_split(
+    batch: _Batch,
+    error: Exception,
+    retries: deque,
+    sizer: BatchSizer,
+    max_split_depth: int = DEFAULT_MAX_SPLIT_DEPTH,
+):
+    """Queue the halves of a failed batch, return the number of given up links"""
+    sizer.shrink()
+    if len(batch.links) == 1 or batch.depth >= max_split_depth:
+        return _give_up(batch.links, error)
+    middle = len(batch.links) // 2
+    for half in (batch.links[:middle], batch.links[middle:]):
+        retries.append(_Batch(half, payload_size(half), batch.depth + 1))
+    logger.warning(
+        f"Link: batch of {len(batch.links)} links failed, retrying in halves: {error}"
+    )
+    return 0
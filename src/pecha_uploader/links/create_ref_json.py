@@ -1,109 +1,98 @@
 import re
-from collections import defaultdict
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from pecha_uploader.utils import ContentWalker, walk_text
+
+# first "<section><segment>" marker of a commentary segment
+_MARKER = re.compile(r"<(\d+)><(\d+)>")
 
 
 def link_mapper(title: str, contents: List, root_detail: Dict):
     """'buld refs json file"""
-    links = []
-    refs = {}
+    return list(iter_links(title, contents, root_detail))
+
+
+def iter_links(title: str, contents: List, root_detail: Dict) -> Iterator[Dict]:
+    """
+    Yield the links of one commentary chapter to its root text, in a single
+    pass over the segments of every section.
+    """
     root_title = root_detail["base_text_titles"][0]
-    if get_list_depth(contents) == 1:
+    if not isinstance(contents, list):
+        return
+    if not _has_sublists(contents):
         # for dept 1
-        constent_range = get_range(contents)
-        for value in constent_range.values():
-            ref = []
-            ref.append(f"{root_title} {value[1][0]}:{value[1][1]}")  # noqa
-            ref.append(f"{title} {value[0]}")
-            refs["refs"] = ref
-            refs["type"] = "commentary"
-            links.append(refs)
-            refs = {}
-    else:
-        for i, content in enumerate(contents):
-            if isinstance(content, list):
-                if get_list_depth(content) == 1:
-                    # for dept 2
-                    constent_range = get_range(content)
-                    for value in constent_range.values():
-                        ref = []
-                        ref.append(f"{root_title} {value[1][0]}:{value[1][1]}")  # noqa
-                        ref.append(f"{title} {i+1}:{value[0]}")  # noqa
-                        refs["refs"] = ref
-                        refs["type"] = "commentary"
-                        links.append(refs)
-                        refs = {}
-                else:
-                    for j, data in enumerate(content):
-                        if isinstance(data, list):
-                            # for dept 3
-                            constent_range = get_range(data)
-                            for value in constent_range.values():
-                                ref = []
-                                ref.append(
-                                    f"{root_title} {value[1][0]}:{value[1][1]}"  # noqa
-                                )
-                                ref.append(f"{title} {i+1}:{j+1}:{value[0]}")  # noqa
-                                refs["refs"] = ref
-                                refs["type"] = "commentary"
-                                links.append(refs)
-                                refs = {}
-    return links
-    # if links:
-    #     commentary_title = title.strip()
-    #     with open(
-    #         LINK_JSON_PATH / f"{commentary_title[-30:]}.json", "w", encoding="utf-8"
-    #     ) as file:
-    #         json.dump(links, file, indent=4, ensure_ascii=False)
+        yield from _section_links(root_title, f"{title} ", contents)
+        return
+    for i, content in enumerate(contents, 1):
+        if not isinstance(content, list):
+            continue
+        if not _has_sublists(content):
+            # for dept 2
+            yield from _section_links(root_title, f"{title} {i}:", content)
+            continue
+        for j, data in enumerate(content, 1):
+            if isinstance(data, list):
+                # for dept 3
+                yield from _section_links(root_title, f"{title} {i}:{j}:", data)
+
+
+def _has_sublists(contents: List):
+    return any(isinstance(item, list) for item in contents)
+
+
+def _section_links(root_title: str, prefix: str, segments: List):
+    for key, (first, last, numbers) in _marker_spans(segments).items():
+        if first == last:
+            position = str(first + 1)
+        else:
+            position = f"{first + 1}-{last + 1}"
+        yield {
+            "refs": [f"{root_title} {numbers[0]}:{numbers[1]}", prefix + position],
+            "type": "commentary",
+        }
+
+
+def _marker_spans(segments: List):
+    """Map every marker to its first and last segment index and its numbers"""
+    spans: Dict[str, list] = {}
+    for i, segment in enumerate(segments):
+        match = _MARKER.search(segment)
+        if match is None:
+            continue
+        span = spans.get(match.group())
+        if span is None:
+            numbers = [int(match.group(1)), int(match.group(2))]
+            spans[match.group()] = [i, i, numbers]
+        else:
+            span[1] = i
+    return spans
 
 
 def get_range(data: List):
     """build json data"""
-    indices = defaultdict(list)
-
-    for i, elem in enumerate(data):
-        matches = re.search(r"<\d+><\d+>", elem)
-        if matches:
-            unique_elem = matches.group()
-            indices[unique_elem].append(i)
-
     output = {}
-    for key, value in indices.items():
-        output[key] = []
-        initial_index = value[0]
-        final_index = value[-1]
-        if initial_index == final_index:
-            output[key].append(str(initial_index + 1))
-            match = re.findall(r"\d+", key)
-            output[key].append(list(map(int, match)))
+    for key, (first, last, numbers) in _marker_spans(data).items():
+        if first == last:
+            output[key] = [str(first + 1), numbers]
         else:
-            output[key].append(f"{initial_index + 1}-{final_index + 1}")
-            match = re.findall(r"\d+", key)
-            output[key].append(list(map(int, match)))
-
+            output[key] = [f"{first + 1}-{last + 1}", numbers]
     return output
 
 
 def create_links(json_text: Dict):
     """map link for echa language"""
-    book_last_category = json_text["source"]["categories"][-1]
-    index_key = book_last_category["name"]
+    tree = walk_text(json_text, schema=False, chapters=False, links=True)
+    root_detail = json_text["source"]["categories"][-1]
+    return list(iter_text_links(tree.link_inputs, root_detail))
 
-    # English version
-    for enbook in json_text["source"]["books"]:
-        chapters = generate_chapters({}, enbook, enbook["language"], index_key)
-        for key, value in chapters.items():
-            links = link_mapper(key, value, book_last_category)
 
-    # Tibetan version
-    for bobook in json_text["target"]["books"]:
-        chapters = generate_chapters(
-            bobook, json_text["source"]["books"][0], bobook["language"], index_key
-        )
-        for key, value in chapters.items():
-            links = link_mapper(key, value, book_last_category)
-
-    return links
+def iter_text_links(
+    link_inputs: Iterable[Tuple[str, List]], root_detail: Dict
+) -> Iterator[Dict]:
+    """Yield the links of every `(chapter ref, raw data)` of a commentary"""
+    for title, contents in link_inputs:
+        yield from iter_links(title, contents, root_detail)
 
 
 def generate_chapters(
@@ -115,75 +104,9 @@ def generate_chapters(
     parent_keys: Any = [],
 ):
     """get chapter from json"""
-    result = {}
-    enbook = []
-    bobook = []
-    if "content" in entext:
-        enbook = entext["content"]
-        if botext:
-            bobook = botext["content"]
-
-    else:
-        if botext:
-            bobook = botext
-        enbook = entext
-
-    if isinstance(enbook, dict):
-        if not botext:
-            for key, value in enbook.items():
-                full_key = key if current_key else key
-                new_parent_keys = parent_keys + [key.strip()]
-
-                if isinstance(value, dict):
-                    # Check if the dictionary has any children other than data
-                    has_children = any(sub_key != "data" for sub_key in value.keys())
-                    child_data = generate_chapters(
-                        value, language, full_key, new_parent_keys
-                    )
-                    result.update(child_data)  # Merge results from children
-
-                    # If there are other children, include data in the key, else exclude it
-                    if has_children:
-                        if language == "bo":
-                            data_key = (
-                                ", ".join(new_parent_keys)
-                                + ", གོང་གི་ས་བཅད་ཀྱི་ནང་དོན།"
-                            )
-                        else:
-                            data_key = ", ".join(new_parent_keys) + ", data"
-                    else:
-                        data_key = ", ".join(
-                            new_parent_keys
-                        )  # Exclude data from the key if no other children
-                    result[data_key] = value["data"]
-        else:
-            for (enkey, envalue), (bokey, bovalue) in zip(
-                enbook.items(), bobook.items()
-            ):
-                full_key = enkey if current_key else enkey
-                new_parent_keys = parent_keys + [enkey.strip()]
-                if isinstance(envalue, dict):
-                    # Check if the dictionary has any children other than data
-                    has_children = any(sub_key != "data" for sub_key in envalue.keys())
-                    child_data = generate_chapters(
-                        bovalue, envalue, language, full_key, new_parent_keys
-                    )
-                    result.update(child_data)  # Merge results from children
-                    if has_children:
-                        data_key = ", ".join(new_parent_keys) + ", data"
-                    else:
-                        data_key = ", ".join(new_parent_keys)
-                    if language == "bo":
-                        result[data_key] = bovalue["data"]
-                    else:
-                        result[data_key] = envalue["data"]
-
-    if isinstance(enbook, list):
-        if len(enbook) > 0:
-            result[index_key] = enbook
-        if len(bobook) > 0:
-            result[index_key] = bobook
-    return result
+    walker = ContentWalker(link_side="bo" if botext and language == "bo" else "en")
+    walker.walk_books(entext, botext or None, index_key=index_key)
+    return dict(walker.link_inputs)
 
 
 def get_list_depth(lst: List):
@@ -1,27 +1,56 @@
 import re
-import urllib
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, headers
+from pecha_uploader.cache import LINK, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key
 
 
-def remove_links(text_title: str, destination_url: str):
+def get_text_title(ref: str):
     """
-    text_title > Reference link of text. e.g Prayer 1:1 or Prayer 1:1-2
+    ref > Reference link of text. e.g Prayer 1:1 or Prayer 1:1-2
     """
     # remove section range number from text title. e.g Prayer 1:1, Prayer 1:1-2
     pattern = r"\s\d+:\d+(-\d+)?"
-    clean_title = re.sub(pattern, "", text_title)
+    return re.sub(pattern, "", ref)
+
 
-    ref = clean_title.replace(" ", "_")
+def remove_links(text_title: str, destination_url: str):
+    """
+    text_title > Reference link of text. e.g Prayer 1:1 or Prayer 1:1-2
+    """
+    ref = get_text_title(text_title).replace(" ", "_")
     url = destination_url + f"api/links/{ref}"
-    values = {"apikey": PECHA_API_KEY}
-    data = urllib.parse.urlencode(values)
-    binary_key = data.encode("ascii")
-    req = urllib.request.Request(url, binary_key, method="DELETE", headers=headers)
+    values = {"apikey": get_api_key()}
+    try:
+        get_client(destination_url).request(
+            "DELETE", url, fields=values, operation="remove_links"
+        )
+        invalidate(destination_url, LINK)
+
+    except HTTPError as e:
+        error_message = (
+            f"Link delete: HTTP Error {e.code} occurred: {e.read().decode('utf-8')}"
+        )
+        raise HTTPError(e.url, e.code, error_message, e.headers, e.fp)
+
+    except Exception as e:
+        error_message = f"Link delete: {e}"
+        raise Exception(error_message)
+
+
+def remove_link(link_id: str, destination_url: str):
+    """
+    link_id > `_id` of one link, as read with `get_link`
+    """
+    url = destination_url + f"api/links/{link_id}"
+    values = {"apikey": get_api_key()}
     try:
-        urllib.request.urlopen(req)
-        # response = urllib.request.urlopen(req)
+        response = get_client(destination_url).request(
+            "DELETE", url, fields=values, operation="remove_link"
+        )
+        invalidate(destination_url, LINK)
+        return response.read().decode("utf-8")
 
     except HTTPError as e:
         error_message = (
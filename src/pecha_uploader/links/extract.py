@@ -1,7 +1,7 @@
-import urllib
+import urllib.parse
 from urllib.error import HTTPError
 
-from pecha_uploader.config import headers
+from pecha_uploader.cache import LINK, cached_get
 
 
 def get_link(link_name: str, destination_url: str, with_text=1):
@@ -22,11 +22,10 @@ def get_link(link_name: str, destination_url: str, with_text=1):
         else:
             link_url += c
     url = destination_url + f"api/links/{link_url}?with_text={with_text}"
-    req = urllib.request.Request(url, method="GET", headers=headers)
     try:
-        response = urllib.request.urlopen(req)  # noqa
-        res = response.read().decode("utf-8")
-        return res
+        return cached_get(
+            destination_url, LINK, link_name, url, "get_link", f"with_text={with_text}"
+        )
 
     except HTTPError as e:
         error_message = (
@@ -0,0 +1,137 @@
+"""
+Delta sync of the links of a commentary.
+
+Instead of deleting every link of the commentary and posting them all again,
+the links the destination has are read once per node with `get_link`, only the
+generated links it lacks are posted, and only the links that are not generated
+anymore are deleted, one `DELETE api/links/<_id>` each. Links are matched by
+their refs, in whichever order the server reports them.
+"""
+
+import contextvars
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from pecha_uploader.cache import bypass_cache
+from pecha_uploader.config import logger
+from pecha_uploader.links.delete import remove_link
+from pecha_uploader.links.extract import get_link
+from pecha_uploader.manifest import Manifest
+from pecha_uploader.tracing import span
+
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+def link_refs_key(refs: Iterable[str]):
+    """Identify a link by its refs, whatever their order and spelling"""
+    return "|".join(sorted(ref.replace("_", " ") for ref in refs))
+
+
+def get_node_title(ref: str):
+    """
+    Remove the section and segment numbers from a ref, e.g. Prayer 1:1-2 or
+    Commentary, Part 1 2
+    """
+    return re.sub(r"(\s\d+(:\d+)*(-\d+(:\d+)*)?)$", "", ref)
+
+
+def get_existing_links(text_title: str, destination_url: str) -> Dict[str, str]:
+    """
+    Return the `_id` of every link of the text on the destination, by
+    `link_refs_key`. The links are read from the destination, not the cache.
+    """
+    with bypass_cache():
+        links = json.loads(get_link(text_title, destination_url, with_text=0))
+    if isinstance(links, dict):
+        if "error" in links:
+            raise Exception(f"Link sync: {links['error']}")
+        # nothing is read during a dry run
+        return {}
+    existing = {}
+    for link in links:
+        refs = link.get("refs") or [link["anchorRef"], link["ref"]]
+        existing[link_refs_key(refs)] = link["_id"]
+    return existing
+
+
+def remove_stale_links(
+    link_ids: List[str],
+    destination_url: str,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+):
+    """Delete links by `_id`, up to `max_in_flight` at the same time"""
+
+    def run(link_id):
+        result = remove_link(link_id, destination_url)
+        if "error" in result and "doesn't exist" not in result:
+            raise Exception(f"Link sync: {link_id} was not removed: {result}")
+
+    if not link_ids:
+        return
+    with span("remove_stale_links", **{"pecha.links": len(link_ids)}):
+        with ThreadPoolExecutor(
+            max_workers=min(max_in_flight, len(link_ids)),
+            thread_name_prefix="pecha-links",
+        ) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, run, link_id)
+                for link_id in link_ids
+            ]
+            errors = [future.exception() for future in futures]
+    errors = [error for error in errors if error is not None]
+    for error in errors:
+        logger.error(f"{error}")
+    if errors:
+        raise Exception(f"Link sync: {len(errors)} stale links could not be removed")
+
+
+def iter_link_changes(
+    links: Iterable[Dict],
+    destination_url: str,
+    manifest: Optional[Manifest] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> Iterator[Dict]:
+    """
+    Yield the generated links the destination lacks, then delete the links of
+    the commentary that were not generated. The existing links are read for
+    each node of the commentary the generated links point to. Links that exist
+    already are recorded in `manifest` as posted, and stale ones are forgotten.
+    """
+    links = iter(links)
+    first_link = next(links, None)
+    if first_link is None:
+        return
+    if manifest is not None:
+        manifest.clear_links()
+
+    existing: Dict[str, str] = {}
+    nodes = set()
+    kept: List[Dict] = []
+    seen = set()
+    posted = 0
+    for link in chain([first_link], links):
+        node = get_node_title(link["refs"][1])
+        if node not in nodes:
+            nodes.add(node)
+            existing.update(get_existing_links(node, destination_url))
+        key = link_refs_key(link["refs"])
+        if key in seen:
+            continue
+        seen.add(key)
+        if key in existing:
+            kept.append(link)
+        else:
+            posted += 1
+            yield link
+
+    stale = [link_id for key, link_id in existing.items() if key not in seen]
+    logger.info(
+        f"Link sync: {posted} links to post, {len(kept)} unchanged, "
+        f"{len(stale)} to remove"
+    )
+    if manifest is not None:
+        manifest.add_links(kept)
+    remove_stale_links(stale, destination_url, max_in_flight)
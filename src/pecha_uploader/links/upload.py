@@ -1,11 +1,11 @@
-import json
-import urllib.error
-import urllib.parse
-import urllib.request
 from typing import Dict, List, Union
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, headers
+from pecha_uploader.cache import LINK, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key
+from pecha_uploader.encoding import encode_json
+from pecha_uploader.exceptions import CircuitOpenError
 
 
 def post_link(ref_list: Union[List, Dict], destination_url: str):
@@ -26,15 +26,17 @@ def post_link(ref_list: Union[List, Dict], destination_url: str):
                 - related
     """
     url = destination_url + "api/links/"
-    input_json_link = json.dumps(ref_list)
+    input_json_link = encode_json(ref_list)
 
-    values = {"json": input_json_link, "apikey": PECHA_API_KEY}
-    data = urllib.parse.urlencode(values)
-    binary_data = data.encode("ascii")
-    req = urllib.request.Request(url, binary_data, headers=headers)
+    values = {"json": input_json_link, "apikey": get_api_key()}
 
     try:
-        response = urllib.request.urlopen(req)
+        # existing links are not created again
+        response = get_client(destination_url).request(
+            "POST", url, fields=values, idempotent=True, operation="post_link"
+        )
+        # links are read back through either of their refs
+        invalidate(destination_url, LINK)
         response.read().decode("utf-8")
 
     except HTTPError as e:
@@ -43,6 +45,9 @@ def post_link(ref_list: Union[List, Dict], destination_url: str):
         )
         raise HTTPError(e.url, e.code, error_message, e.headers, e.fp)
 
+    except CircuitOpenError:
+        raise
+
     except Exception as e:
         error_message = f"Link: {e}"
 
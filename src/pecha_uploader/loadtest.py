@@ -0,0 +1,174 @@
+"""
+Load test of the upload pipeline against a local `MockSefariaServer`.
+
+Every concurrency level uploads the given texts one after the other with
+`upload_async`, to a fresh server, and reports the requests per second, the
+p50/p99 latency of the request attempts and the time taken by every text.
+
+    python -m pecha_uploader.loadtest tests/data/*.json --concurrency 1 4 16 \\
+        --latency 0.05 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pecha_uploader.async_pipeline import upload_async
+from pecha_uploader.client import RequestEvent, configure_client
+from pecha_uploader.config import logger, setup_logging
+from pecha_uploader.mock_server import MockSefariaServer
+from pecha_uploader.pipeline import get_index_key
+from pecha_uploader.utils import read_json
+
+DEFAULT_LEVELS = (1, 4, 16)
+
+
+@dataclass
+class TextTiming:
+    """Upload time of one text"""
+
+    title: str
+    elapsed: float
+    error: Optional[str] = None
+
+
+@dataclass
+class LevelReport:
+    """Outcome of uploading every text at one concurrency level"""
+
+    concurrency: int
+    requests: int
+    errors: int
+    elapsed: float
+    requests_per_second: float
+    p50: float  # seconds
+    p99: float
+    texts: List[TextTiming] = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def percentile(values: Sequence[float], q: float):
+    """Nearest-rank percentile of `values`, `q` between 0 and 100"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))  # ceiling
+    return ordered[int(rank) - 1]
+
+
+def run_level(
+    texts: List[Tuple[str, Dict]], concurrency: int, server_options: Dict
+) -> LevelReport:
+    """Upload `texts`, `(title, text)` pairs, with `concurrency` requests in flight"""
+    events: List[RequestEvent] = []
+    timings = []
+    with MockSefariaServer(**server_options) as server:
+        client = configure_client(server.url, pool_size=concurrency)
+        client.add_listener(events.append)
+        start = time.monotonic()
+        for title, text in texts:
+            text_start = time.monotonic()
+            error = None
+            try:
+                asyncio.run(
+                    upload_async(
+                        text, server.url, max_in_flight=concurrency, use_registry=False
+                    )
+                )
+            except Exception as e:
+                error = f"{e}"
+            timings.append(TextTiming(title, time.monotonic() - text_start, error))
+        elapsed = time.monotonic() - start
+        client.close()
+
+    latencies = [event.elapsed for event in events]
+    errors = sum(1 for event in events if event.status is None or event.status >= 400)
+    return LevelReport(
+        concurrency=concurrency,
+        requests=len(events),
+        errors=errors,
+        elapsed=elapsed,
+        requests_per_second=len(events) / elapsed if elapsed else 0.0,
+        p50=percentile(latencies, 50),
+        p99=percentile(latencies, 99),
+        texts=timings,
+    )
+
+
+def run_loadtest(
+    texts: List[Tuple[str, Dict]],
+    levels: Sequence[int] = DEFAULT_LEVELS,
+    **server_options,
+) -> List[LevelReport]:
+    """
+    Run `run_level` for every concurrency level.
+        `server_options`: keyword arguments of `MockSefariaServer`,
+        e.g. latency=0.05, error_rate=0.01, rate_limit=200
+    """
+    return [run_level(texts, level, server_options) for level in levels]
+
+
+def format_report(reports: List[LevelReport]):
+    lines = [
+        f"{'concurrency':>11} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'total s':>8}"
+    ]
+    for report in reports:
+        lines.append(
+            f"{report.concurrency:>11} {report.requests:>9} {report.errors:>7} "
+            f"{report.requests_per_second:>9.1f} {report.p50 * 1000:>8.1f} "
+            f"{report.p99 * 1000:>8.1f} {report.elapsed:>8.2f}"
+        )
+        for timing in report.texts:
+            status = f"  FAILED: {timing.error}" if timing.error else ""
+            lines.append(f"{'':>11} {timing.elapsed:>8.2f}s  {timing.title}{status}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pecha_uploader.loadtest",
+        description="Upload pecha json files to a local mock server and report "
+        "throughput and latency per concurrency level.",
+    )
+    parser.add_argument("paths", nargs="+", help="pecha json files")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=list(DEFAULT_LEVELS)
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--json", action="store_true", help="print a json report")
+    parser.add_argument("--verbose", action="store_true", help="keep upload logs")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    if not args.verbose:
+        logger.setLevel(logging.ERROR)
+    texts = []
+    for path in args.paths:
+        text = read_json(path)
+        texts.append((get_index_key(text), text))
+    reports = run_loadtest(
+        texts,
+        args.concurrency,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+    )
+    if args.json:
+        print(json.dumps([report.to_dict() for report in reports], indent=2))
+    else:
+        print(format_report(reports))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Manifest of the content hashes of uploaded chapters and links.
+
+For every (destination, index key, version title, chapter key) the hash of the
+last posted text payload is kept in a SQLite database under `BASE_PATH`,
+together with the refs of every posted link. With `only_changed=True` an
+upload then sends only the chapters whose payload changed and the links that
+were not posted before.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from pecha_uploader.config import MANIFEST_PATH, logger
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chapters (
+    destination TEXT NOT NULL,
+    index_key TEXT NOT NULL,
+    version_title TEXT NOT NULL,
+    chapter_key TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (destination, index_key, version_title, chapter_key)
+);
+CREATE TABLE IF NOT EXISTS links (
+    destination TEXT NOT NULL,
+    index_key TEXT NOT NULL,
+    link_key TEXT NOT NULL,
+    PRIMARY KEY (destination, index_key, link_key)
+);
+"""
+
+
+def hash_payload(payload: Dict):
+    """Return a stable hash of a json payload"""
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def link_key(link: Dict):
+    """Identify a link by its refs"""
+    return "|".join(link["refs"])
+
+
+class Manifest:
+    """
+    Content hashes of one index on one destination.
+        `only_changed`: report unchanged chapters so that they are not posted again
+        `sync_links`: diff the links against those of the destination
+    """
+
+    def __init__(
+        self,
+        destination_url: str,
+        index_key: str,
+        only_changed: bool = False,
+        path: Path = MANIFEST_PATH,
+        sync_links: bool = False,
+    ):
+        self.destination_url = destination_url
+        self.index_key = index_key
+        self.only_changed = only_changed
+        self.sync_links = sync_links
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        rows = self._conn.execute(
+            "SELECT version_title, chapter_key, hash FROM chapters"
+            " WHERE destination = ? AND index_key = ?",
+            (destination_url, index_key),
+        )
+        self._hashes = {(version, key): digest for version, key, digest in rows}
+
+    def is_unchanged(self, version_title: str, chapter_key: str, digest: str):
+        return (
+            self.only_changed
+            and self._hashes.get((version_title, chapter_key)) == digest
+        )
+
+    def record(self, version_title: str, chapter_key: str, digest: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.destination_url,
+                    self.index_key,
+                    version_title,
+                    chapter_key,
+                    digest,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+            self._hashes[(version_title, chapter_key)] = digest
+
+    def link_keys(self):
+        """Keys of the links posted for this index"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT link_key FROM links WHERE destination = ? AND index_key = ?",
+                (self.destination_url, self.index_key),
+            )
+            return {key for (key,) in rows}
+
+    def add_links(self, links: Iterable[Dict]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO links VALUES (?, ?, ?)",
+                [
+                    (self.destination_url, self.index_key, link_key(link))
+                    for link in links
+                ],
+            )
+            self._conn.commit()
+
+    def clear_links(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM links WHERE destination = ? AND index_key = ?",
+                (self.destination_url, self.index_key),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """Forget the chapters and links of the index, e.g. once it was deleted"""
+        with self._lock:
+            for table in ("chapters", "links"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE destination = ? AND index_key = ?",
+                    (self.destination_url, self.index_key),
+                )
+            self._conn.commit()
+            self._hashes = {}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def post_if_changed(
+    manifest: Optional[Manifest],
+    version_title: str,
+    chapter_key: str,
+    payload: Dict,
+    fn,
+    *args,
+):
+    """
+    Call `fn(*args)` unless `manifest` reports `payload` as unchanged, then
+    record its hash.
+    """
+    if manifest is None:
+        fn(*args)
+        return
+    digest = hash_payload(payload)
+    if manifest.is_unchanged(version_title, chapter_key, digest):
+        return
+    fn(*args)
+    manifest.record(version_title, chapter_key, digest)
+
+
+def iter_new_links(manifest: Manifest, links: Iterable[Dict]):
+    """
+    Yield the links that were never posted, then warn about the posted links
+    that are not generated anymore.
+    """
+    known = manifest.link_keys()
+    keys = set()
+    for link in links:
+        key = link_key(link)
+        keys.add(key)
+        if key not in known:
+            yield link
+    stale_count = len(known - keys)
+    if stale_count:
+        logger.warning(
+            f"Link: {stale_count} posted links are not generated anymore, "
+            "upload without only_changed to remove them"
+        )
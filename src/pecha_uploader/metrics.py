@@ -0,0 +1,414 @@
+"""
+Metrics of uploads: API calls, bytes and time per pipeline stage.
+
+Every API wrapper names its requests with an `operation` (e.g. "post_text"),
+and the client records, per operation, the calls by status, the latency of
+the calls including retries, the attempts and the bytes sent and received.
+Pipeline stages are timed with `stage` and are either preprocessing (walking
+the books, generating links) or network, and are spans of the current trace.
+
+Metrics add up over the whole process. `write_metrics` dumps them to
+`METRICS_PATH` as json and as a Prometheus textfile, which the textfile
+collector of node exporter can scrape after a batch run. Uploads write them
+when they end, and the uploads of a `batch_metrics` block, e.g. the texts of
+`upload_many`, only once when the block ends.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from pecha_uploader.config import METRICS_PATH
+from pecha_uploader.profiling import stage_memory
+from pecha_uploader.tracing import span
+
+PREPROCESS = "preprocess"
+NETWORK = "network"
+TOTAL = "total"
+
+# seconds, from a cached GET to a large chapter or a whole upload
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRICS_JSON = "metrics.json"
+METRICS_TEXTFILE = "pecha_uploader.prom"
+
+_HELP = {
+    "pecha_api_calls_total": "API calls by operation and final status",
+    "pecha_api_attempts_total": "API request attempts, retries included",
+    "pecha_api_bytes_sent_total": "Request body bytes sent on the wire",
+    "pecha_api_bytes_received_total": "Response body bytes received on the wire",
+    "pecha_api_call_seconds": "Duration of API calls, retries included",
+    "pecha_stage_seconds": "Duration of pipeline stages",
+    "pecha_cache_requests_total": "Reads of the extract APIs by cache result",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_suspended: contextvars.ContextVar = contextvars.ContextVar(
+    "pecha_metrics_suspended", default=False
+)
+_batched: contextvars.ContextVar = contextvars.ContextVar(
+    "pecha_metrics_batched", default=False
+)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket holding the `q` quantile, `q` from 0 to 1"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                f"{bound:g}": count for bound, count in zip(self.buckets, self.counts)
+            },
+        }
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float):
+    return "+Inf" if value == float("inf") else f"{value:g}"
+
+
+class MetricsRegistry:
+    """Thread safe counters and histograms, keyed by name and labels"""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if _suspended.get():
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if _suspended.get():
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def total(self, name: str, **labels):
+        """Sum of counter `name` over the series that have all of `labels`"""
+        wanted = set(_labels(labels))
+        with self._lock:
+            return sum(
+                value
+                for key, value in self.counters.get(name, {}).items()
+                if wanted.issubset(key)
+            )
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def record_call(
+        self,
+        operation: str,
+        status: str,
+        elapsed: float,
+        attempts: int,
+    ):
+        """Record an API call, once its last attempt is done"""
+        self.inc("pecha_api_calls_total", operation=operation, status=status)
+        self.inc("pecha_api_attempts_total", attempts, operation=operation)
+        self.observe("pecha_api_call_seconds", elapsed, operation=operation)
+
+    def record_bytes(self, operation: str, sent: int, received: int):
+        self.inc("pecha_api_bytes_sent_total", sent, operation=operation)
+        self.inc("pecha_api_bytes_received_total", received, operation=operation)
+
+    def summary(self):
+        """
+        Per operation calls, errors, bytes and latency, per stage time, and the
+        time spent preprocessing versus waiting on the API. Calls overlap in
+        concurrent uploads, so the network time can exceed the wall time.
+        """
+        with self._lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {
+                name: dict(series) for name, series in self.histograms.items()
+            }
+
+        operations: Dict[str, Dict] = {}
+
+        def entry(labels: Labels):
+            name = dict(labels)["operation"]
+            return operations.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "attempts": 0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                },
+            )
+
+        for labels, value in counters.get("pecha_api_calls_total", {}).items():
+            entry(labels)["calls"] += int(value)
+            if not dict(labels)["status"].startswith("2"):
+                entry(labels)["errors"] += int(value)
+        for name, field in (
+            ("pecha_api_attempts_total", "attempts"),
+            ("pecha_api_bytes_sent_total", "bytes_sent"),
+            ("pecha_api_bytes_received_total", "bytes_received"),
+        ):
+            for labels, value in counters.get(name, {}).items():
+                entry(labels)[field] += int(value)
+        network = 0.0
+        for labels, histogram in histograms.get("pecha_api_call_seconds", {}).items():
+            entry(labels).update(
+                seconds=histogram.sum,
+                p50=histogram.quantile(0.5),
+                p99=histogram.quantile(0.99),
+            )
+            network += histogram.sum
+
+        stages = {}
+        preprocess = 0.0
+        for labels, histogram in histograms.get("pecha_stage_seconds", {}).items():
+            labels_dict = dict(labels)
+            stages[labels_dict["stage"]] = {
+                "kind": labels_dict["kind"],
+                "count": histogram.count,
+                "seconds": histogram.sum,
+            }
+            if labels_dict["kind"] == PREPROCESS:
+                preprocess += histogram.sum
+
+        return {
+            "operations": operations,
+            "stages": stages,
+            "seconds": {PREPROCESS: preprocess, NETWORK: network},
+        }
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "counters": {
+                    name: [
+                        {"labels": dict(labels), "value": value}
+                        for labels, value in series.items()
+                    ]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [
+                        dict(histogram.to_dict(), labels=dict(labels))
+                        for labels, histogram in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    bounds = histogram.buckets + (float("inf"),)
+                    counts = histogram.counts + [histogram.count]
+                    for bound, count in zip(bounds, counts):
+                        le = ("le", _format_value(bound))
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels, le)} {count}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {histogram.sum:g}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        name = "pecha_metrics_written_timestamp_seconds"
+        lines.append(f"# HELP {name} Time the metrics were written")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {time.time():.3f}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the metrics registry of the process"""
+    return _metrics
+
+
+@contextmanager
+def suspend_metrics():
+    """
+    Record nothing in this block, including on executor threads started with a
+    copy of the current context, e.g. while planning a dry run.
+    """
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+@contextmanager
+def stage(name: str, kind: str = NETWORK):
+    """
+    Time the block as pipeline stage `name`, also a span of the current trace
+    unless it is the TOTAL stage, whose span is the trace itself. The memory of
+    a profiled upload is sampled when the stage starts and ends.
+        `kind`: PREPROCESS for local work, NETWORK for stages posting to the API
+    """
+    start = time.monotonic()
+    try:
+        with stage_memory(name):
+            if kind == TOTAL:
+                yield
+            else:
+                with span(name, **{"pecha.stage_kind": kind}):
+                    yield
+    finally:
+        _metrics.observe(
+            "pecha_stage_seconds", time.monotonic() - start, stage=name, kind=kind
+        )
+
+
+def timed(fn, name: str, kind: str = PREPROCESS):
+    """Return `fn` timed as stage `name` on every call"""
+
+    def wrapper(*args, **kwargs):
+        with stage(name, kind):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def timed_iter(iterable: Iterable, name: str, kind: str = PREPROCESS) -> Iterator:
+    """
+    Yield from `iterable`, timing only the time spent producing the items,
+    which is recorded once as stage `name` when the iteration ends.
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.monotonic() - start
+            yield item
+    finally:
+        _metrics.observe("pecha_stage_seconds", elapsed, stage=name, kind=kind)
+
+
+_write_lock = threading.Lock()
+
+
+def _write_atomic(path: Path, data: str):
+    # scrapers must never read a half written file
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_metrics(directory: Optional[Union[str, Path]] = None):
+    """
+    Write the metrics to `directory`, `METRICS_PATH` by default, as
+    `metrics.json` (summary and raw series) and `pecha_uploader.prom`.
+    Return the path of the json file.
+    """
+    directory = Path(directory) if directory else METRICS_PATH
+    directory.mkdir(parents=True, exist_ok=True)
+    data = {
+        "written_at": time.time(),
+        "summary": _metrics.summary(),
+        "metrics": _metrics.to_dict(),
+    }
+    with _write_lock:
+        _write_atomic(directory / METRICS_JSON, json.dumps(data, indent=2))
+        _write_atomic(directory / METRICS_TEXTFILE, _metrics.to_prometheus())
+    return directory / METRICS_JSON
+
+
+def write_upload_metrics():
+    """Write the metrics at the end of an upload, unless a batch writes them"""
+    if not _batched.get():
+        write_metrics()
+
+
+@contextmanager
+def batch_metrics():
+    """
+    Write the metrics once when the block ends, instead of at the end of every
+    upload in it, including uploads on executor threads started with a copy of
+    the current context.
+    """
+    if _batched.get():
+        yield
+        return
+    token = _batched.set(True)
+    try:
+        yield
+    finally:
+        _batched.reset(token)
+        write_metrics()
@@ -0,0 +1,530 @@
+"""
+Local stand-in for the Sefaria API of pecha.org.
+
+`MockSefariaServer` answers the endpoints this package uses (terms,
+categories, raw indexes, texts and links, with their get and delete
+variants) from an in-memory store, so uploads can be run and measured
+without a network. Latency, injected errors and a rate limit make it behave
+like a loaded server.
+
+    with MockSefariaServer(latency=0.05, error_rate=0.01) as server:
+        upload(text, server.url)
+
+    python -m pecha_uploader.mock_server --port 8000 --latency 0.05
+"""
+
+import argparse
+import email.parser
+import email.policy
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+DEFAULT_ERROR_STATUS = (500, 502, 503)
+DEFAULT_RETRY_AFTER = 1
+
+_SECTION = re.compile(r"\.(?=\d)")
+_ADDRESS = re.compile(r"\d")
+
+
+def normalize_ref(ref: str):
+    """'Title_1.2' and 'Title.1:2' style refs to 'Title 1:2' style"""
+    return _SECTION.sub(" ", ref.replace("_", " ")).strip()
+
+
+def node_titles(node: Dict):
+    """Titles of a schema node in every language, and its key"""
+    titles = [title["text"] for title in node.get("titles", [])]
+    if node.get("key"):
+        titles.append(node["key"])
+    return titles
+
+
+def _is_address(rest: str):
+    """True for what may follow a title in a ref: nothing or a section address"""
+    return not rest or (rest.startswith(" ") and bool(_ADDRESS.match(rest[1:])))
+
+
+def resolves_in(nodes: List[Dict], rest: str):
+    """True if `rest`, e.g. "Chapter 1, Part 2 3:4", names a node of `nodes`"""
+    for node in nodes:
+        for title in node_titles(node):
+            if not rest.startswith(title):
+                continue
+            after = rest[len(title) :]  # noqa
+            if _is_address(after):
+                return True
+            if after.startswith(", ") and resolves_in(node.get("nodes", []), after[2:]):
+                return True
+    return False
+
+
+def parse_fields(headers, body: bytes) -> Dict[str, str]:
+    """Form fields of a url-encoded or multipart request body"""
+    content_type = headers.get("Content-Type") or ""
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("ascii") + body
+        )
+        # parts carry no charset, the browser convention is the page's, UTF-8
+        return {
+            part.get_param("name", header="content-disposition"): part.get_payload(
+                decode=True
+            ).decode("utf-8")
+            for part in message.iter_parts()
+        }
+    return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token, return False when the bucket is empty"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class SefariaStore:
+    """In-memory terms, categories, indexes, text versions and links"""
+
+    def __init__(self):
+        self.terms: Dict[str, Dict] = {}
+        self.categories: Dict[str, Dict] = {}
+        self.indexes: Dict[str, Dict] = {}
+        # title of an index or of the root of its schema -> index title
+        self.titles: Dict[str, str] = {}
+        # ref -> {(language, version title): version}
+        self.texts: Dict[str, Dict[Tuple[str, str], Dict]] = {}
+        self.links: List[Dict] = []
+        self.link_count = 0
+        self.lock = threading.Lock()
+
+    def post_term(self, name: str, term: Dict, update: bool):
+        if name in self.terms and not update:
+            return {"error": f"Term already exists: {name}"}
+        self.terms[name] = term
+        return term
+
+    def post_category(self, category: Dict):
+        path = "/".join(category["path"])
+        if path in self.categories:
+            return {"error": f"Category {path} already exists."}
+        parent = "/".join(category["path"][:-1])
+        if parent and parent not in self.categories:
+            return {"error": f"Parent category {parent} doesn't exist."}
+        self.categories[path] = category
+        return category
+
+    def post_index(self, title: str, index: Dict):
+        if "/".join(index["categories"]) not in self.categories:
+            return {"error": f"Category {'/'.join(index['categories'])} doesn't exist."}
+        self.indexes[title] = index
+        self.titles[title] = title
+        # the root node of the schema names the index too
+        for alias in node_titles(index.get("schema") or {}):
+            self.titles[normalize_ref(alias)] = title
+        return index
+
+    def post_text(self, ref: str, version: Dict):
+        title = self.index_of(ref)
+        if title is None:
+            return {"error": f"Failed to parse sections for ref {ref}"}
+        versions = self.texts.setdefault(ref, {})
+        versions[(version.get("language"), version.get("versionTitle"))] = version
+        return {"status": "ok"}
+
+    def post_links(self, links):
+        if isinstance(links, dict):
+            links = [links]
+        existing = {tuple(link["refs"]) for link in self.links}
+        results = []
+        for link in links:
+            refs = tuple(normalize_ref(ref) for ref in link["refs"])
+            if refs in existing:
+                results.append({"error": f"A link already exists: {list(refs)}"})
+                continue
+            existing.add(refs)
+            self.link_count += 1
+            self.links.append(
+                dict(link, refs=list(refs), _id=f"{self.link_count:024x}")
+            )
+            results.append({"status": "ok"})
+        return results
+
+    def toc(self):
+        """Table of contents: the category tree with the indexes as leaves"""
+        nodes = {(): {"contents": []}}
+        for path in sorted(self.categories, key=lambda path: path.count("/")):
+            names = tuple(path.split("/"))
+            titles = self.terms.get(names[-1], {}).get("titles", [])
+            node = {
+                "category": names[-1],
+                "heCategory": next(
+                    (title["text"] for title in titles if title["lang"] == "he"), None
+                ),
+                "contents": [],
+            }
+            nodes[names] = node
+            nodes.get(names[:-1], nodes[()])["contents"].append(node)
+        for title, index in self.indexes.items():
+            parent = nodes.get(tuple(index["categories"]), nodes[()])
+            parent["contents"].append(
+                {"title": title, "categories": index["categories"]}
+            )
+        return nodes[()]["contents"]
+
+    def index_of(self, ref: str):
+        """
+        Title of the index a ref belongs to. The longest index title the ref
+        starts with wins, followed by a section address or by the names of
+        nodes of its schema, e.g. "Title, Chapter 1, Part 2 3:4".
+        """
+        ref = normalize_ref(ref)
+        for title in sorted(self.titles, key=len, reverse=True):
+            if not ref.startswith(title):
+                continue
+            rest = ref[len(title) :]  # noqa
+            index_title = self.titles[title]
+            if _is_address(rest):
+                return index_title
+            schema = self.indexes[index_title].get("schema") or {}
+            if rest.startswith(", ") and resolves_in(schema.get("nodes", []), rest[2:]):
+                return index_title
+        return None
+
+    def get_text(self, ref: str):
+        ref = normalize_ref(ref)
+        if self.index_of(ref) is None:
+            return {"error": f"Failed to parse sections for ref {ref}"}
+        versions = [
+            {"language": language, "versionTitle": title}
+            for stored_ref, stored in self.texts.items()
+            if stored_ref == ref or stored_ref.startswith(ref + " ")
+            for language, title in stored
+        ]
+        return {"ref": ref, "versions": versions}
+
+    def links_of(self, ref: str):
+        ref = normalize_ref(ref)
+        return [
+            link
+            for link in self.links
+            if any(r == ref or r.startswith(ref + " ") for r in link["refs"])
+        ]
+
+    def get_links(self, ref: str):
+        """Links of a ref as the API answers them, from the side of `ref`"""
+        ref = normalize_ref(ref)
+        answer = []
+        for link in self.links_of(ref):
+            anchor = 0 if link["refs"][0].startswith(ref) else 1
+            answer.append(
+                {
+                    "_id": link["_id"],
+                    "type": link.get("type", ""),
+                    "anchorRef": link["refs"][anchor],
+                    "ref": link["refs"][1 - anchor],
+                }
+            )
+        return answer
+
+    def delete_links(self, ref: str):
+        by_id = [link for link in self.links if link["_id"] == ref]
+        if by_id:
+            self.links.remove(by_id[0])
+            return {"status": "ok", "deleted": 1}
+        removed = self.links_of(ref)
+        ids = {id(link) for link in removed}
+        self.links = [link for link in self.links if id(link) not in ids]
+        return {"status": "ok", "deleted": len(removed)}
+
+    def delete_texts(self, ref: str):
+        ref = normalize_ref(ref)
+        for stored_ref in [r for r in self.texts if self.index_of(r) == ref]:
+            del self.texts[stored_ref]
+        return {"status": "ok"}
+
+    def delete_index(self, title: str):
+        title = normalize_ref(title)
+        if title not in self.indexes:
+            return {"error": f"Index {title} doesn't exist."}
+        self.delete_texts(title)
+        del self.indexes[title]
+        for alias in [alias for alias, of in self.titles.items() if of == title]:
+            del self.titles[alias]
+        return {"status": "ok"}
+
+    def delete_category(self, path: str):
+        if self.categories.pop(path, None) is None:
+            return {"error": f"Category {path} doesn't exist."}
+        return {"status": "ok"}
+
+    def delete_term(self, name: str):
+        if self.terms.pop(name, None) is None:
+            return {"error": f"Term {name} doesn't exist."}
+        return {"status": "ok"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "MockSefariaServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, data, extra_headers: Optional[Dict] = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        if self.command == "GET" and status == 200:
+            # reads can be revalidated with If-None-Match, like on a real server
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            extra_headers = dict(extra_headers or {}, ETag=etag)
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _handle(self):
+        server = self.server
+        body = self._read_body()
+        server.count_request()
+        if server.bucket is not None and not server.bucket.take():
+            return self._send(
+                429, {"error": "Too many requests"}, {"Retry-After": server.retry_after}
+            )
+        if server.latency or server.latency_jitter:
+            time.sleep(server.latency + random.uniform(0, server.latency_jitter))
+        if server.error_rate and random.random() < server.error_rate:
+            status = random.choice(server.error_status)
+            extra = {"Retry-After": server.retry_after} if status == 503 else None
+            return self._send(status, {"error": "Injected failure"}, extra)
+
+        if self.headers.get("Content-Encoding") == "gzip":
+            if not server.accept_gzip:
+                return self._send(415, {"error": "Unsupported Content-Encoding"})
+            body = gzip.decompress(body)
+        if (self.headers.get("Content-Type") or "").startswith("multipart/") and (
+            not server.accept_multipart
+        ):
+            return self._send(415, {"error": "Unsupported Content-Type"})
+        fields = parse_fields(self.headers, body) if body else {}
+
+        if self.command != "GET" and server.api_key is not None:
+            if fields.get("apikey") != server.api_key:
+                return self._send(403, {"error": "Unrecognized API key."})
+
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        with server.store.lock:
+            status, data = route(server.store, self.command, path, fields, query)
+        self._send(status, data)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+def route(
+    store: SefariaStore,
+    method: str,
+    path: str,
+    fields: Dict[str, str],
+    query: Optional[Dict[str, str]] = None,
+):
+    """Return `(status, data)` of an API request"""
+    query = query or {}
+    payload = json.loads(fields["json"]) if "json" in fields else None
+    for prefix, resource in (
+        ("/api/terms/", "terms"),
+        ("/api/category/", "category"),
+        ("/api/category", "category"),
+        ("/api/v2/raw/index/", "index"),
+        ("/api/index/", "index"),
+        ("/api/index", "toc"),
+        ("/api/texts/", "texts"),
+        ("/api/links/", "links"),
+    ):
+        if path.startswith(prefix):
+            name = path[len(prefix) :]  # noqa
+            break
+    else:
+        return 404, {"error": f"No endpoint for {path}"}
+
+    if method == "POST" and payload is None:
+        return 400, {"error": "Missing json field"}
+    if resource == "terms":
+        if method == "POST":
+            # like Sefaria, `update` is read from the query string only
+            return 200, store.post_term(name, payload, "update" in query)
+        if method == "DELETE":
+            return 200, store.delete_term(name)
+        return 200, store.terms.get(name) or {"error": f"Term {name} doesn't exist."}
+    if resource == "category":
+        if method == "POST":
+            return 200, store.post_category(payload)
+        if method == "DELETE":
+            return 200, store.delete_category(name)
+        category = store.categories.get(name)
+        return 200, category or {"error": f"Category {name} doesn't exist."}
+    if resource == "toc":
+        return 200, store.toc()
+    if resource == "index":
+        title = normalize_ref(name)
+        if method == "POST":
+            return 200, store.post_index(payload.get("title") or title, payload)
+        if method == "DELETE":
+            return 200, store.delete_index(title)
+        index = store.indexes.get(title)
+        return 200, index or {"error": f"Index {title} doesn't exist."}
+    if resource == "texts":
+        if method == "POST":
+            return 200, store.post_text(normalize_ref(name), payload)
+        if method == "DELETE":
+            return 200, store.delete_texts(name)
+        return 200, store.get_text(name)
+    if method == "POST":
+        return 200, store.post_links(payload)
+    if method == "DELETE":
+        return 200, store.delete_links(name)
+    return 200, store.get_links(name)
+
+
+class MockSefariaServer(ThreadingHTTPServer):
+    """
+    Threaded in-memory Sefaria API on `host:port`, port 0 picks a free one.
+        `latency`: float, seconds added to every answer
+        `latency_jitter`: float, up to this many random seconds more
+        `error_rate`: float, share of requests failed with one of `error_status`
+        `rate_limit`: float, requests per second, more are answered 429
+        `retry_after`: int, seconds of the `Retry-After` header of 429 and 503
+        `api_key`: str, required from writes when given
+        `accept_gzip`, `accept_multipart`: otherwise such bodies are answered 415
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: Sequence[int] = DEFAULT_ERROR_STATUS,
+        rate_limit: Optional[float] = None,
+        burst: Optional[int] = None,
+        retry_after: int = DEFAULT_RETRY_AFTER,
+        api_key: Optional[str] = None,
+        accept_gzip: bool = True,
+        accept_multipart: bool = True,
+    ):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = tuple(error_status)
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.retry_after = retry_after
+        self.api_key = api_key
+        self.accept_gzip = accept_gzip
+        self.accept_multipart = accept_multipart
+        self.store = SefariaStore()
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    def start(self):
+        """Serve on a background thread"""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="mock-sefaria", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pecha_uploader.mock_server",
+        description="Serve an in-memory Sefaria API for local uploads.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--api-key", default=None)
+    args = parser.parse_args(argv)
+
+    server = MockSefariaServer(
+        args.host,
+        args.port,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        api_key=args.api_key,
+    )
+    print(f"Serving a mock Sefaria API on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,41 @@ This module processes text files, parses JSON content,
 and uploads structured data to various APIs for further processing.
 """
 
-from typing import Dict, List
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
 
 from pecha_uploader.category.upload import post_category
+from pecha_uploader.client import TransferStats, track_transfer
 from pecha_uploader.config import logger
+from pecha_uploader.dry_run import check_dry_run, planning
+from pecha_uploader.index.extract import get_index
 from pecha_uploader.index.upload import post_index
-from pecha_uploader.links.create_ref_json import create_links
+from pecha_uploader.journal import UploadJournal, run_step
+from pecha_uploader.links.batching import DEFAULT_MAX_IN_FLIGHT, post_links
+from pecha_uploader.links.create_ref_json import iter_text_links
 from pecha_uploader.links.delete import remove_links
-from pecha_uploader.links.upload import post_link
+from pecha_uploader.links.sync import iter_link_changes
+from pecha_uploader.manifest import Manifest, iter_new_links, post_if_changed
+from pecha_uploader.metrics import (
+    PREPROCESS,
+    TOTAL,
+    stage,
+    timed_iter,
+    write_upload_metrics,
+)
 from pecha_uploader.preprocess.upload import post_term
+from pecha_uploader.profiling import profiled
+from pecha_uploader.registry import Registry, get_registry
+from pecha_uploader.snapshot import get_snapshot
 from pecha_uploader.text.upload import post_text
-from pecha_uploader.utils import generate_chapters, generate_schema, parse_annotation
+from pecha_uploader.tracing import span, trace, tracing_enabled
+from pecha_uploader.transaction import current_transaction, upload_transaction
+from pecha_uploader.utils import ContentWalker, generate_schema, walk_text
+
+LINK_BATCHES_IN_FLIGHT = DEFAULT_MAX_IN_FLIGHT
+LINKS_REMOVE_STEP = "links:remove"
 
 
 def get_book_title(text: Dict):
@@ -31,9 +55,14 @@ def get_book_title(text: Dict):
     return tgt_book_title
 
 
-def add_texts(text: Dict, destination_url: str):
+def get_index_key(text: Dict):
+    """Return the index title of a text, i.e. the name of its last category"""
+    return text["source"]["categories"][-1]["name"]
+
+
+def build_payload(text: Dict):
     """
-    Read a text file and add.
+    Collect category prefixes and books of both languages from a pecha json.
     """
     payload = {
         "bookKey": "",
@@ -55,61 +84,222 @@ def add_texts(text: Dict, destination_url: str):
                 payload["categoryHe"].append(text[lang]["categories"][: i + 1])
             for book in text[lang]["books"]:
                 payload["textHe"].append(book)
+    return payload
 
-    try:
-        # print("===========================( post_term )===========================")
-        category_path = list(map(lambda x: x["name"], payload["categoryEn"][i]))
-        for i in range(len(payload["categoryEn"])):
-            post_term(
-                payload["categoryEn"][i][-1]["name"],
-                payload["categoryHe"][i][-1]["name"],
-                destination_url,
-            )
-            # print("===========================( post_category )===========================")
-            post_category(
-                payload["categoryEn"][i], payload["categoryHe"][i], destination_url
-            )
 
-        # print(
-        #     "============================( post_index )================================"
-        # )
-        schema = generate_schema(payload["textEn"][0], payload["textHe"][0])
+def get_category_path(payload: Dict):
+    """Return the full english category path of the text"""
+    return list(map(lambda x: x["name"], payload["categoryEn"][-1]))
+
 
-        post_index(
-            payload["bookKey"], payload["categoryEn"][-1], schema[0], destination_url
+def add_terms_and_categories(
+    payload: Dict,
+    destination_url: str,
+    registry: Optional[Registry] = None,
+    journal: Optional[UploadJournal] = None,
+):
+    """
+    Post the term and the category for every category prefix, parent first.
+    Terms and categories the `registry` knows to exist are not posted again.
+    """
+    for en_category, bo_category in zip(payload["categoryEn"], payload["categoryHe"]):
+        term_en, term_bo = en_category[-1]["name"], bo_category[-1]["name"]
+        run_step(
+            journal,
+            term_step(term_en),
+            add_term,
+            term_en,
+            term_bo,
+            destination_url,
+            registry,
+        )
+        run_step(
+            journal,
+            category_step(en_category),
+            add_category,
+            en_category,
+            bo_category,
+            destination_url,
+            registry,
         )
 
-        # print(
-        #     "===============================( post_text )=================================="
-        # )
-        text_index_key = payload["bookKey"]
 
-        for book in payload["textEn"]:
-            process_text(book, "en", text_index_key, category_path, destination_url)
+def term_step(term_en: str):
+    return f"term:{term_en}"
 
-        for book in payload["textHe"]:
-            process_text(book, "he", text_index_key, category_path, destination_url)
 
-        if is_commentary(text):
-            links_data = create_links(text)
-            add_links(links_data, destination_url)
+def category_step(en_category_list: List[Dict]):
+    return "category:" + "/".join(category["name"] for category in en_category_list)
 
-    except Exception as e:
-        logger.error(f"{e}")
-        raise Exception(f"{e}")
 
+def text_step(lang: str, text_name: str, text: Dict):
+    return f"text:{lang}:{text['versionTitle']}:{text_name}"
 
-def process_text(
-    book: dict,
-    lang: str,
-    text_index_key: str,
-    category_path: List,
+
+def add_term(
+    term_en: str,
+    term_bo: str,
     destination_url: str,
+    registry: Optional[Registry] = None,
 ):
     """
-    Process text for a given language and post it.
+    Post a term unless the `registry` knows it exists. A term that did not
+    exist is recorded in the transaction of the upload, which claims it either
+    way.
+    """
+    transaction = current_transaction()
+    if transaction is not None:
+        transaction.claim_term(term_en)
+    with span("term", **{"pecha.term": term_en}) as term_span:
+        if registry is not None and registry.has_term(
+            destination_url, term_en, term_bo
+        ):
+            term_span.set_attribute("pecha.registry_hit", True)
+            return
+        created = post_term(term_en, term_bo, destination_url)
+        if created and transaction is not None:
+            transaction.add_term(term_en)
+    if registry is not None:
+        registry.add_term(destination_url, term_en, term_bo)
+
+
+def add_category(
+    en_category_list: List[Dict],
+    bo_category_list: List[Dict],
+    destination_url: str,
+    registry: Optional[Registry] = None,
+):
+    """
+    Post a category unless the `registry` knows it exists. A category that did
+    not exist is recorded in the transaction of the upload, which claims it
+    either way.
+    """
+    category_path = [category["name"] for category in en_category_list]
+    transaction = current_transaction()
+    if transaction is not None:
+        transaction.claim_category(category_path)
+    with span("category", **{"pecha.category": "/".join(category_path)}) as cat_span:
+        if registry is not None and registry.has_category(
+            destination_url, category_path
+        ):
+            cat_span.set_attribute("pecha.registry_hit", True)
+            return
+        created = post_category(en_category_list, bo_category_list, destination_url)
+        if created and transaction is not None:
+            transaction.add_category(category_path)
+    if registry is not None:
+        registry.add_category(destination_url, category_path)
+
+
+def add_index(payload: Dict, destination_url: str, schema: Optional[List] = None):
+    """
+    Generate the schema from both books, unless given, and post the index.
+    An index that did not exist, according to the snapshot of the destination
+    if one was loaded, is recorded in the transaction of the upload.
     """
-    text = {
+    if schema is None:
+        schema = generate_schema(payload["textEn"][0], payload["textHe"][0])
+    index_key = payload["bookKey"]
+    transaction = current_transaction()
+    snapshot = get_snapshot(destination_url)
+    created = False
+    if transaction is not None:
+        # an index cannot exist in a category the upload just created
+        if transaction.has_category(get_category_path(payload)):
+            created = True
+        elif snapshot is not None:
+            created = not snapshot.has_index(index_key)
+        else:
+            created = "error" in get_index(index_key, destination_url)
+    post_index(index_key, payload["categoryEn"][-1], schema[0], destination_url)
+    if created:
+        transaction.add_index(index_key)
+    if snapshot is not None:
+        snapshot.add_index(index_key)
+
+
+def add_texts(
+    text: Dict,
+    destination_url: str,
+    use_registry: bool = True,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+):
+    """
+    Read a text file and add.
+    Steps already completed in `journal` are skipped, and so are chapters and
+    links `manifest` reports as unchanged.
+    """
+    payload = build_payload(text)
+    registry = get_registry() if use_registry else None
+    commentary = is_commentary(text)
+
+    try:
+        with span("add_texts", **{"pecha.commentary": commentary}):
+            # schema, chapters and link inputs come from a single walk of the books
+            with stage("walk_text", PREPROCESS):
+                tree = walk_text(text, links=commentary)
+            category_path = get_category_path(payload)
+            # what this run created is deleted again if it fails before the links
+            with upload_transaction(destination_url, journal, manifest):
+                with stage("terms_categories"):
+                    add_terms_and_categories(
+                        payload, destination_url, registry, journal
+                    )
+
+                text_index_key = payload["bookKey"]
+                with stage("index"):
+                    run_step(
+                        journal,
+                        f"index:{text_index_key}",
+                        add_index,
+                        payload,
+                        destination_url,
+                        tree.schema,
+                    )
+
+                with stage("texts"):
+                    for book, chapters in zip(payload["textEn"], tree.en_chapters):
+                        process_text(
+                            book,
+                            "en",
+                            text_index_key,
+                            category_path,
+                            destination_url,
+                            journal,
+                            manifest,
+                            chapters,
+                        )
+
+                    for book, chapters in zip(payload["textHe"], tree.bo_chapters):
+                        process_text(
+                            book,
+                            "he",
+                            text_index_key,
+                            category_path,
+                            destination_url,
+                            journal,
+                            manifest,
+                            chapters,
+                        )
+
+            if commentary:
+                # links are generated lazily while the batches are posted
+                links_data = timed_iter(
+                    iter_text_links(tree.link_inputs, text["source"]["categories"][-1]),
+                    "link_refs",
+                )
+                with stage("links"):
+                    add_links(links_data, destination_url, journal, manifest)
+
+    except Exception as e:
+        logger.error(f"{e}")
+        raise Exception(f"{e}")
+
+
+def build_version(book: Dict, lang: str):
+    """Return the version fields of a text post for a book, without text"""
+    return {
         "versionTitle": book["title"],
         "versionSource": book["versionSource"],
         "language": lang,
@@ -121,34 +311,150 @@ def process_text(
         "text": [],
     }
 
-    if "content" in book:
-        # Complex text
-        if isinstance(book["content"], dict):
-            result = generate_chapters(book["content"], book["language"])
 
-            for key, value in result.items():
-                text["text"] = value
-                post_text(key, text, category_path, destination_url, text_index_key)
+def generate_text_versions(
+    book: Dict, lang: str, text_index_key: str, chapters: Optional[Dict] = None
+):
+    """
+    Yield `(text_name, text)` for every text post of a book, one per chapter
+    for complex texts and a single one for simple texts.
+        `chapters`: cleaned chapters of the book, if already walked
+    """
+    version = build_version(book, lang)
 
-        # Simple text
-        elif isinstance(book["content"], list):
-            text["text"] = parse_annotation(book["content"])
-            post_text(
-                text_index_key, text, category_path, destination_url, text_index_key
-            )
+    if chapters is None:
+        chapters = book_chapters(book, text_index_key)
+    for key, value in chapters.items():
+        yield key, dict(version, text=value)
 
 
-def add_links(links: List[Dict], destination_url: str):
+def book_chapters(book: Dict, text_index_key: str):
+    """Return the cleaned chapters of one book, keyed by chapter ref"""
+    if "content" not in book or not isinstance(book["content"], (dict, list)):
+        return {}
+    walker = ContentWalker(en_language=book["language"], en_chapters=True)
+    walker.walk_books(book, None, index_key=text_index_key)
+    return walker.en_chapters
+
+
+def process_text(
+    book: dict,
+    lang: str,
+    text_index_key: str,
+    category_path: List,
+    destination_url: str,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+    chapters: Optional[Dict] = None,
+):
     """
-    Post root and commentary links
+    Process text for a given language and post it.
     """
-    # remove is links is available
-    remove_links(links[0]["refs"][1], destination_url)
+    for text_name, text in generate_text_versions(book, lang, text_index_key, chapters):
+        post_text_version(
+            lang,
+            text_name,
+            text,
+            category_path,
+            destination_url,
+            text_index_key,
+            journal,
+            manifest,
+        )
 
-    batch_size = 150
-    for i in range(0, len(links), batch_size):
-        batch = links[i : i + batch_size]  # noqa
-        post_link(batch, destination_url)
+
+def post_text_version(
+    lang: str,
+    text_name: str,
+    text: Dict,
+    category_path: List,
+    destination_url: str,
+    text_index_key: str,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+):
+    """
+    Post one chapter of a version, unless `journal` has it completed or
+    `manifest` reports it unchanged. Either way, the transaction of the upload
+    records that the chapter is on the destination.
+    """
+    with span(
+        "chapter",
+        **{
+            "pecha.ref": text_name,
+            "pecha.lang": lang,
+            "pecha.version": text["versionTitle"],
+        },
+    ):
+        run_step(
+            journal,
+            text_step(lang, text_name, text),
+            post_if_changed,
+            manifest,
+            f"{lang}:{text['versionTitle']}",
+            text_name,
+            text,
+            post_text,
+            text_name,
+            text,
+            category_path,
+            destination_url,
+            text_index_key,
+        )
+    transaction = current_transaction()
+    if transaction is not None:
+        transaction.add_chapter()
+
+
+def add_links(
+    links: Iterable[Dict],
+    destination_url: str,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+    max_in_flight: int = LINK_BATCHES_IN_FLIGHT,
+):
+    """
+    Post root and commentary links, in adaptive batches with up to
+    `max_in_flight` batches posted at the same time.
+    """
+    links = prepare_links(links, destination_url, journal, manifest)
+    post_links(links, destination_url, manifest, max_in_flight)
+
+
+def prepare_links(
+    links: Iterable[Dict],
+    destination_url: str,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+):
+    """
+    Remove the existing links of the commentary and return the links to post.
+    With a `sync_links` manifest, only the links the destination lacks are
+    returned, and its links that are not generated anymore are removed once the
+    links are consumed. With an `only_changed` manifest, existing links are kept
+    and only links that were never posted are returned, and so are they when
+    resuming an upload whose links were already removed.
+    """
+    if manifest is not None and manifest.sync_links:
+        return iter_link_changes(links, destination_url, manifest)
+    if manifest is not None and (
+        manifest.only_changed
+        or (journal is not None and journal.is_done(LINKS_REMOVE_STEP))
+    ):
+        return iter_new_links(manifest, links)
+
+    links = iter(links)
+    first_link = next(links, None)
+    if first_link is None:
+        return iter(())
+
+    # remove is links is available
+    run_step(
+        journal, LINKS_REMOVE_STEP, remove_links, first_link["refs"][1], destination_url
+    )
+    if manifest is not None:
+        manifest.clear_links()
+    return chain([first_link], links)
 
 
 def is_commentary(text: Dict):
@@ -170,8 +476,92 @@ def is_commentary(text: Dict):
         return False
 
 
-def upload(text: Dict, destination_url: str):
+def upload(
+    text: Dict,
+    destination_url: str,
+    use_registry: bool = True,
+    resume: bool = False,
+    only_changed: bool = False,
+    dry_run: bool = False,
+    plan_path: Optional[Union[str, Path]] = None,
+    profile: Optional[bool] = None,
+    sync_links: bool = False,
+    input_hash: Optional[str] = None,
+    tracing: Optional[bool] = None,
+):
     """
     Upload text to the API.
+        `use_registry`: skip terms and categories the local registry knows exist
+        `resume`: skip the steps an earlier upload of the same text completed
+        `only_changed`: post only chapters and links that changed since the last upload
+        `dry_run`: write the requests to the jsonl `plan_path` instead of sending them
+        `profile`: write a cProfile and tracemalloc profile to `PROFILE_PATH`,
+        by default when `PECHA_UPLOADER_PROFILE` is set
+        `sync_links`: post and delete only the links that differ from those of
+        the destination, instead of deleting and posting them all again
+        `input_hash`: key of the journal, e.g. the `hash_file` of the file the
+        text was read from, by default a hash of `text` when resuming
+        `tracing`: write a trace of the upload to `TRACE_PATH`, by default when
+        `PECHA_UPLOADER_TRACE` is set
+    Return the `TransferStats` of the upload.
+    Metrics of the upload are written to `METRICS_PATH`, except for dry runs,
+    and at the end of the batch for the texts of `upload_many`.
     """
-    add_texts(text, destination_url)
+    with profiled(get_index_key(text), profile):
+        if dry_run:
+            check_dry_run(resume, only_changed)
+            with planning(destination_url, get_index_key(text), plan_path) as stats:
+                add_texts(text, destination_url, use_registry=False)
+            return stats
+
+        journal = UploadJournal.for_text(text, destination_url, resume, input_hash)
+        manifest = Manifest(
+            destination_url, get_index_key(text), only_changed, sync_links=sync_links
+        )
+        with track_transfer() as stats, trace_upload(
+            get_index_key(text), destination_url, "sync", stats, tracing
+        ):
+            try:
+                with stage("upload", TOTAL):
+                    add_texts(text, destination_url, use_registry, journal, manifest)
+            finally:
+                if journal is not None:
+                    journal.close()
+                manifest.close()
+                write_upload_metrics()
+                logger.info(f"SENT: '{get_index_key(text)}' {stats}")
+        return stats
+
+
+@contextmanager
+def trace_upload(
+    index_key: str,
+    destination_url: str,
+    mode: str,
+    stats: TransferStats,
+    tracing: Optional[bool] = None,
+):
+    """
+    Trace an upload when `tracing_enabled(tracing)`, its root span gets the
+    bytes exchanged in `stats`. Yield the `Trace`, or None when not tracing.
+        `mode`: "sync", "stream" or "async"
+    """
+    if not tracing_enabled(tracing):
+        yield None
+        return
+    with trace(
+        "upload",
+        **{
+            "pecha.index_key": index_key,
+            "pecha.destination_url": destination_url,
+            "pecha.mode": mode,
+        },
+    ) as upload_trace:
+        try:
+            yield upload_trace
+        finally:
+            upload_trace.root.set_attribute("pecha.requests", stats.requests)
+            upload_trace.root.set_attribute("pecha.bytes_sent", stats.bytes_sent)
+            upload_trace.root.set_attribute(
+                "pecha.bytes_received", stats.bytes_received
+            )
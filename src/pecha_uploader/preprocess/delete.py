@@ -1,8 +1,10 @@
 import urllib.parse
-import urllib.request
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, headers
+from pecha_uploader.cache import TERM, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key
+from pecha_uploader.registry import get_registry
 
 
 def remove_term(term_title: str, destination_url: str):
@@ -13,15 +15,19 @@ def remove_term(term_title: str, destination_url: str):
     encode_title = urllib.parse.quote(term_title)
     url = destination_url + f"api/terms/{encode_title}"
 
-    values = {"apikey": PECHA_API_KEY}  # Must be sent as form data
-    data = urllib.parse.urlencode(values).encode(
-        "ascii"
-    )  # Convert to form-encoded bytes
-    headers["apiKey"] = PECHA_API_KEY
-    req = urllib.request.Request(url, data=data, method="DELETE", headers=headers)
+    api_key = get_api_key()
+    values = {"apikey": api_key}  # Must be sent as form data
     try:
-        response = urllib.request.urlopen(req)
+        response = get_client(destination_url).request(
+            "DELETE",
+            url,
+            fields=values,
+            headers={"apiKey": api_key},
+            operation="remove_term",
+        )
+        invalidate(destination_url, TERM, term_title)
         response.read().decode("utf-8")
+        get_registry().forget_term(destination_url, term_title)
     except HTTPError as e:
         error_message = (
             f"Term delete: HTTP Error {e.code} occurred: {e.read().decode('utf-8')}"
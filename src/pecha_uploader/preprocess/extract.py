@@ -1,20 +1,19 @@
 import json
-import urllib
+import urllib.parse
 from urllib.error import HTTPError
 
-from pecha_uploader.config import Destination_url, headers, logger
+from pecha_uploader.cache import TERM, cached_get
+from pecha_uploader.config import logger
 
 
-def get_term(term: str, destination_url: Destination_url):
+def get_term(term: str, destination_url: str):
     """
     Get term values for variable `term_str`.
         `term`: str, term name
     """
-    url = destination_url.value + "api/terms/" + urllib.parse.quote(term)
-    req = urllib.request.Request(url, headers=headers)
+    url = destination_url + "api/terms/" + urllib.parse.quote(term)
     try:
-        response = urllib.request.urlopen(req)  # noqa
-        res = response.read().decode("utf-8")
+        res = cached_get(destination_url, TERM, term, url, "get_term")
         return json.loads(res)
 
     except HTTPError as e:
@@ -1,8 +1,10 @@
-import json
-import urllib
+import urllib.parse
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, headers
+from pecha_uploader.cache import TERM, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key
+from pecha_uploader.encoding import encode_json
 from pecha_uploader.exceptions import APIError
 
 
@@ -12,6 +14,7 @@ def post_term(term_en: str, term_bo: str, destination_url: str):
     You MUST post term before posting any category.
         `term_en`: str, primary `en` term (chinese),
         `term_bo`: str, primary `he` term (བོད་ཡིག)
+    Return True if the term was created, False if it already existed.
     """
     url = destination_url + "api/terms/" + urllib.parse.quote(term_en)
     payload = {
@@ -21,17 +24,19 @@ def post_term(term_en: str, term_bo: str, destination_url: str):
             {"text": term_bo, "lang": "he", "primary": True},
         ],
     }
-    input_json = json.dumps(payload)
+    input_json = encode_json(payload)
     values = {
         "json": input_json,
-        "apikey": PECHA_API_KEY,
+        "apikey": get_api_key(),
         "update": True,
     }
-    data = urllib.parse.urlencode(values)
-    binary_data = data.encode("ascii")
-    req = urllib.request.Request(url, binary_data, method="POST", headers=headers)
     try:
-        response = urllib.request.urlopen(req)
+        # a term posted twice only answers "already exists": the API reads
+        # `update` from the query string, not from these fields
+        response = get_client(destination_url).request(
+            "POST", url, fields=values, idempotent=True, operation="post_term"
+        )
+        invalidate(destination_url, TERM, term_en)
         res = response.read().decode("utf-8")
         # term conflict
         if "error" in res:
@@ -39,6 +44,8 @@ def post_term(term_en: str, term_bo: str, destination_url: str):
                 raise APIError(
                     f"Failed to create category terms:English term: '{term_en}', Tibetan term: '{term_bo}' because {res}"  # noqa
                 )
+            return False
+        return True
 
     except HTTPError as e:
         error_message = (
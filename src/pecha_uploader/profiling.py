@@ -0,0 +1,238 @@
+"""
+Opt-in profiling of upload runs with cProfile and tracemalloc.
+
+Profiling is turned on with `profile=True` of `upload`, `upload_stream` and
+`upload_many`, or for every run with the environment variable
+`PECHA_UPLOADER_PROFILE=1`. Every profiled text writes to `PROFILE_PATH`:
+
+    <time>-<title>.prof   cProfile stats, e.g. for `python -m pstats` or snakeviz
+    <time>-<title>.txt    peak memory per pipeline stage, the top allocations
+                          when memory was highest, and the top functions by time
+
+Memory is sampled at the boundaries of the `pecha_uploader.metrics` stages,
+so the allocations of a chapter walk are reported even though they are freed
+before the upload ends.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from pecha_uploader.config import PROFILE_PATH, logger
+
+PROFILE_ENV = "PECHA_UPLOADER_PROFILE"
+DEFAULT_TOP = 25
+
+# a new snapshot is taken only when memory grew by this much since the last one
+SNAPSHOT_GROWTH = 1.05
+
+_TRUE = ("1", "true", "yes", "on")
+
+# allocations of the profiler itself are left out of the report
+_IGNORED_FILES = (tracemalloc.__file__, cProfile.__file__, __file__, "<frozen *>")
+
+
+def profiling_enabled(profile: Optional[bool] = None):
+    """`profile` if given, else whether `PECHA_UPLOADER_PROFILE` is set to true"""
+    if profile is not None:
+        return profile
+    return os.environ.get(PROFILE_ENV, "").strip().lower() in _TRUE
+
+
+def _megabytes(size: int):
+    return f"{size / 1e6:.1f} MB"
+
+
+class ProfileSession:
+    """CPU and memory profile of one text, see `profiled`"""
+
+    def __init__(self, tag: str, top: int = DEFAULT_TOP):
+        self.tag = tag
+        self.top = top
+        self.profiler: Optional[cProfile.Profile] = None
+        self.peak = 0
+        self.stage_peaks: Dict[str, int] = {}
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.snapshot_stage = ""
+        self.snapshot_size = 0
+        self._stages: List[str] = []
+        self._started_tracing = False
+        self._start = 0.0
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._start = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # another profiler is active, e.g. the run is under `python -m cProfile`
+            logger.warning(f"Profile: CPU profiling of '{self.tag}' is off: {e}")
+            self.profiler = None
+
+    def _fold_peak(self, stage: Optional[str] = None):
+        """Count the peak since the last boundary for every open stage"""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        for name in self._stages:
+            self.stage_peaks[name] = max(self.stage_peaks.get(name, 0), peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        if stage is not None and current > self.snapshot_size * SNAPSHOT_GROWTH:
+            # the data of the stage is still alive at its end
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_stage = stage
+            self.snapshot_size = current
+
+    def enter_stage(self, name: str):
+        with self._lock:
+            self._fold_peak()
+            self._stages.append(name)
+
+    def exit_stage(self, name: str):
+        with self._lock:
+            self._fold_peak(name)
+            if name in self._stages:
+                self._stages.remove(name)
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        with self._lock:
+            self._fold_peak("end of upload")
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def _allocation_lines(self):
+        if self.snapshot is None:
+            return ["(no snapshot)"]
+        snapshot = self.snapshot.filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in _IGNORED_FILES]
+        )
+        lines = []
+        for stat in snapshot.statistics("lineno")[: self.top]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{_megabytes(stat.size):>10} {stat.count:>9} blocks  "
+                f"{frame.filename}:{frame.lineno}"
+            )
+        return lines
+
+    def _cpu_lines(self):
+        if self.profiler is None:
+            return ["(CPU profiling was off)"]
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats("tottime").print_stats(self.top)
+        return out.getvalue().strip().splitlines()
+
+    def report(self, elapsed: float):
+        lines = [
+            f"Profile of '{self.tag}', {elapsed:.2f}s, "
+            f"peak memory {_megabytes(self.peak)}",
+            "",
+            "Peak memory by stage",
+        ]
+        for name, peak in sorted(
+            self.stage_peaks.items(), key=lambda item: item[1], reverse=True
+        ):
+            lines.append(f"{_megabytes(peak):>10}  {name}")
+        lines += [
+            "",
+            f"Top {self.top} allocations at the end of '{self.snapshot_stage}', "
+            f"{_megabytes(self.snapshot_size)} traced",
+        ]
+        lines += self._allocation_lines()
+        lines += ["", f"Top {self.top} functions by own time"]
+        lines += self._cpu_lines()
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: Optional[Union[str, Path]] = None) -> Tuple[Path, Path]:
+        """Write the `.prof` file and the text report, return their paths"""
+        elapsed = time.monotonic() - self._start
+        directory = Path(directory) if directory else PROFILE_PATH
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{quote(self.tag, safe=' ')}"
+        prof_path = directory / f"{stem}.prof"
+        report_path = directory / f"{stem}.txt"
+        run = 1
+        while report_path.exists():
+            # the same text profiled again within the same second
+            run += 1
+            prof_path = directory / f"{stem}-{run}.prof"
+            report_path = directory / f"{stem}-{run}.txt"
+        if self.profiler is not None:
+            self.profiler.dump_stats(str(prof_path))
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(self.report(elapsed))
+        return prof_path, report_path
+
+
+_session: Optional[ProfileSession] = None
+_session_lock = threading.Lock()
+
+
+@contextmanager
+def profiled(
+    tag: str,
+    profile: Optional[bool] = None,
+    top: int = DEFAULT_TOP,
+    directory: Optional[Union[str, Path]] = None,
+):
+    """
+    Profile the block when `profiling_enabled(profile)`, and write the profile
+    of `tag`, the text title, to `directory`, `PROFILE_PATH` by default.
+    Memory is traced for the whole process, so a single text is profiled at a
+    time; a block entered while another one is profiled is not profiled.
+    Yield the `ProfileSession`, or None when not profiling.
+    """
+    global _session
+    if not profiling_enabled(profile):
+        yield None
+        return
+    with _session_lock:
+        if _session is not None:
+            logger.warning(f"Profile: '{_session.tag}' is profiled, not '{tag}'")
+            session = None
+        else:
+            session = _session = ProfileSession(tag, top)
+    if session is None:
+        yield None
+        return
+
+    session.start()
+    try:
+        yield session
+    finally:
+        session.stop()
+        with _session_lock:
+            _session = None
+        prof_path, report_path = session.write(directory)
+        logger.info(f"PROFILED: '{tag}', see {report_path} and {prof_path}")
+
+
+@contextmanager
+def stage_memory(name: str):
+    """Sample the memory of the profiled text at the boundaries of stage `name`"""
+    session = _session
+    if session is None:
+        yield
+        return
+    session.enter_stage(name)
+    try:
+        yield
+    finally:
+        session.exit_stage(name)
@@ -0,0 +1,265 @@
+"""
+Local registry of terms and category paths known to exist on a destination.
+
+`add_texts` consults it so that texts sharing a category tree do not post the
+same `post_term`/`post_category` requests again and again. Entries are keyed
+by destination url, expire after an optional TTL, and are forgotten whenever
+the uploader removes the term or category again. Changes are written at most
+every `save_interval` seconds, on `flush` and when the process exits, merged
+with the entries other processes wrote in the meantime.
+
+Invalidate it from the command line with:
+    python -m pecha_uploader.registry invalidate [--destination URL]
+"""
+
+import argparse
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pecha_uploader.config import REGISTRY_PATH, logger, setup_logging
+
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+DEFAULT_SAVE_INTERVAL = 5.0  # seconds
+
+
+def _category_key(category_path: List[str]):
+    return "/".join(category_path)
+
+
+def _write_json(path: Path, data: Dict):
+    """Replace `path` atomically, through a temporary file of this writer only"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        dir=path.parent,
+        prefix=f".{path.name}.",
+        suffix=".tmp",
+        delete=False,
+    ) as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(f.name, path)
+
+
+class Registry:
+    """
+    Persistent record of terms and categories per destination url.
+        `path`: json file the registry is stored in
+        `ttl`: seconds an entry stays valid, `None` for entries that never expire
+        `save_interval`: seconds between two writes of the file, 0 to write
+        every change at once
+    """
+
+    def __init__(
+        self,
+        path: Path = REGISTRY_PATH,
+        ttl: Optional[float] = DEFAULT_TTL,
+        save_interval: float = DEFAULT_SAVE_INTERVAL,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.save_interval = save_interval
+        self._data: Optional[Dict] = None
+        # (destination url, kind, key) -> entry, None for a forgotten entry
+        self._changes: Dict[Tuple[str, str, str], Optional[object]] = {}
+        self._saved_at = time.monotonic()
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"Registry: ignoring unreadable {self.path}")
+            return {}
+
+    def _change(self, destination_url: str, kind: str, key: str, entry=None):
+        self._changes[(destination_url, kind, key)] = entry
+
+    def _save(self):
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the changes not saved yet, merged with entries of other processes"""
+        with self._lock:
+            if not self._changes:
+                return
+            data = self._read()
+            for (destination_url, kind, key), entry in self._changes.items():
+                stored = data.setdefault(
+                    destination_url, {"terms": {}, "categories": {}}
+                )[kind]
+                if entry is None:
+                    stored.pop(key, None)
+                else:
+                    stored[key] = entry
+            self._data = data
+            self._changes = {}
+            self._saved_at = time.monotonic()
+            _write_json(self.path, data)
+
+    def _entries(self, destination_url: str, kind: str):
+        destination = self._load().setdefault(
+            destination_url, {"terms": {}, "categories": {}}
+        )
+        return destination[kind]
+
+    def _is_fresh(self, timestamp: float):
+        return self.ttl is None or time.time() - timestamp < self.ttl
+
+    def has_term(self, destination_url: str, term_en: str, term_bo: str):
+        """True if the term is known to exist with the same tibetan title"""
+        with self._lock:
+            entry = self._entries(destination_url, "terms").get(term_en)
+        return entry is not None and entry[0] == term_bo and self._is_fresh(entry[1])
+
+    def add_term(self, destination_url: str, term_en: str, term_bo: str):
+        with self._lock:
+            entry = [term_bo, time.time()]
+            self._entries(destination_url, "terms")[term_en] = entry
+            self._change(destination_url, "terms", term_en, entry)
+            self._save()
+
+    def forget_term(self, destination_url: str, term_en: str):
+        with self._lock:
+            self._entries(destination_url, "terms").pop(term_en, None)
+            self._change(destination_url, "terms", term_en)
+            self._save()
+
+    def has_category(self, destination_url: str, category_path: List[str]):
+        """True if the category path is known to exist"""
+        with self._lock:
+            timestamp = self._entries(destination_url, "categories").get(
+                _category_key(category_path)
+            )
+        return timestamp is not None and self._is_fresh(timestamp)
+
+    def add_category(self, destination_url: str, category_path: List[str]):
+        key = _category_key(category_path)
+        with self._lock:
+            timestamp = time.time()
+            self._entries(destination_url, "categories")[key] = timestamp
+            self._change(destination_url, "categories", key, timestamp)
+            self._save()
+
+    def update(
+        self,
+        destination_url: str,
+        terms: Dict[str, str],
+        categories: Iterable[List[str]],
+    ):
+        """Record many terms, english to tibetan title, and categories at once"""
+        now = time.time()
+        with self._lock:
+            stored_terms = self._entries(destination_url, "terms")
+            for term_en, term_bo in terms.items():
+                stored_terms[term_en] = [term_bo, now]
+                self._change(destination_url, "terms", term_en, stored_terms[term_en])
+            stored_categories = self._entries(destination_url, "categories")
+            for category_path in categories:
+                key = _category_key(category_path)
+                stored_categories[key] = now
+                self._change(destination_url, "categories", key, now)
+            self._save()
+
+    def retain(
+        self,
+        destination_url: str,
+        terms: Iterable[str],
+        categories: Iterable[List[str]],
+    ):
+        """Forget the terms and categories of a destination that are not listed"""
+        terms = set(terms)
+        keys = {_category_key(category_path) for category_path in categories}
+        with self._lock:
+            for kind, listed in (("terms", terms), ("categories", keys)):
+                entries = self._entries(destination_url, kind)
+                for key in [key for key in entries if key not in listed]:
+                    del entries[key]
+                    self._change(destination_url, kind, key)
+            self._save()
+
+    def forget_category(self, destination_url: str, category_path: List[str]):
+        """Forget a category path and every category below it"""
+        key = _category_key(category_path)
+        with self._lock:
+            categories = self._entries(destination_url, "categories")
+            for stored_key in list(categories):
+                if stored_key == key or stored_key.startswith(key + "/"):
+                    del categories[stored_key]
+                    self._change(destination_url, "categories", stored_key)
+            self._change(destination_url, "categories", key)
+            self._save()
+
+    def invalidate(self, destination_url: Optional[str] = None):
+        """Forget everything, or everything about one destination url"""
+        with self._lock:
+            data = self._read()
+            if destination_url is None:
+                data = {}
+            else:
+                data.pop(destination_url, None)
+            self._data = data
+            self._changes = {}
+            _write_json(self.path, data)
+
+
+_registry: Optional[Registry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> Registry:
+    """Return the shared registry, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = Registry()
+        return _registry
+
+
+def configure_registry(**options) -> Registry:
+    """
+    Replace the shared registry with one built from `options`.
+        e.g. configure_registry(ttl=None) for entries that never expire
+    """
+    global _registry
+    with _registry_lock:
+        _registry = Registry(**options)
+        return _registry
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pecha_uploader.registry",
+        description="Manage the local term/category registry.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    invalidate = subparsers.add_parser("invalidate", help="forget registry entries")
+    invalidate.add_argument(
+        "--destination", help="only forget entries of this destination url"
+    )
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    if args.command == "invalidate":
+        get_registry().invalidate(args.destination)
+        logger.info(f"Registry invalidated: {args.destination or 'all destinations'}")
+
+
+if __name__ == "__main__":
+    main()
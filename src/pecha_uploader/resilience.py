@@ -0,0 +1,177 @@
+"""
+Retries and circuit breaking for the requests of `PechaClient`.
+
+Transient failures (connection errors, 429, 502, 503 and 504 responses) are
+retried with jittered exponential backoff, or after the delay of a
+`Retry-After` header. Requests that are not idempotent are only retried when
+the server cannot have acted on them.
+
+Every client, and so every destination url, has its own `CircuitBreaker`.
+After repeated transient failures it rejects requests for a while instead of
+sending them, so a struggling server gets time to recover and workers fail
+fast instead of queueing behind it.
+"""
+
+import http.client
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.error import HTTPError
+
+from pecha_uploader.exceptions import CircuitOpenError
+
+RETRY_STATUS = (429, 502, 503, 504)
+# statuses telling that the request was refused, not processed
+REFUSED_STATUS = (429, 503)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.5  # seconds
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_MAX_RETRY_AFTER = 120.0
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+def is_transient(error: Exception):
+    """Whether `error` is worth retrying, and counts against the circuit breaker"""
+    if isinstance(error, HTTPError):
+        return error.code in RETRY_STATUS
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def parse_retry_after(value: Optional[str]):
+    """Seconds to wait from a `Retry-After` header, None if it is missing or invalid"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before sending a failed request again.
+        `max_attempts`: int, attempts including the first one, 1 disables retries
+        `base_delay`: float, seconds, the backoff ceiling doubles every attempt
+        `max_delay`: float, seconds, cap of the backoff ceiling
+        `max_retry_after`: float, seconds, longer `Retry-After` delays are not awaited
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        max_retry_after: float = DEFAULT_MAX_RETRY_AFTER,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1.")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, attempt: int):
+        """Full jitter backoff before retry number `attempt` (starting at 1)"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def retry_delay(self, attempt: int, error: Exception, idempotent: bool):
+        """
+        Seconds to wait before retrying after `attempt` failed with `error`,
+        None if the request should not be retried.
+        """
+        if attempt >= self.max_attempts or not is_transient(error):
+            return None
+        if isinstance(error, HTTPError):
+            if not idempotent and error.code not in REFUSED_STATUS:
+                return None
+            if error.code in REFUSED_STATUS:
+                retry_after = parse_retry_after(error.headers.get("Retry-After"))
+                if retry_after is not None:
+                    if retry_after > self.max_retry_after:
+                        return None
+                    return retry_after
+        elif not idempotent and not isinstance(error, ConnectionRefusedError):
+            # the request may have reached the server before the connection broke
+            return None
+        return self.backoff(attempt)
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a destination after `failure_threshold`
+    consecutive transient failures. After `reset_timeout` seconds a single
+    probe request is let through, its success closes the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1.")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raise `CircuitOpenError` if the request must not be sent"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(
+                f"Circuit open after {self._failures} consecutive failures, "
+                f"retry in {max(remaining, 0):.1f}s"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (
+                self._failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def record(self, error: Optional[Exception]):
+        """Record the outcome of a request, None for a response below 400"""
+        if error is not None and is_transient(error):
+            self.record_failure()
+        else:
+            # a 4xx or an application error still means the server is answering
+            self.record_success()
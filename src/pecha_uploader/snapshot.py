@@ -0,0 +1,202 @@
+"""
+Snapshot of what a destination already has, read in one bulk request.
+
+The table of contents of the destination (`GET api/index`) holds its whole
+category tree, with the tibetan title of the term of every category, and the
+titles of all its indexes. `load_snapshot` reads it once before a batch and
+keeps it per destination url until `forget_snapshot`, so that:
+
+    - the registry is seeded with every existing term and category, and
+      forgets those the destination lacks, so that `add_texts` posts only the
+      terms and categories that are missing,
+    - `add_index` knows whether an index is new without asking for it,
+    - `RemoteSnapshot.plan` tells which posts a whole corpus needs.
+
+Print the plan of a corpus without uploading anything with:
+    pecha-upload corpus/ --destination https://staging.pecha.org/ --plan
+"""
+
+import json
+import threading
+import time
+import urllib.parse
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.error import HTTPError
+
+from pecha_uploader.client import get_client
+from pecha_uploader.config import logger
+from pecha_uploader.registry import Registry
+
+
+@dataclass
+class PostPlan:
+    """Posts a corpus needs on a destination, according to a snapshot"""
+
+    terms: List[str] = field(default_factory=list)
+    categories: List[str] = field(default_factory=list)
+    new_indexes: List[str] = field(default_factory=list)
+    existing_indexes: List[str] = field(default_factory=list)
+    existing_terms: int = 0
+    existing_categories: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        return (
+            f"{len(self.terms)} terms and {len(self.categories)} categories to post "
+            f"({self.existing_terms} and {self.existing_categories} exist), "
+            f"{len(self.new_indexes)} new indexes, "
+            f"{len(self.existing_indexes)} existing indexes to update"
+        )
+
+
+class RemoteSnapshot:
+    """Terms, categories and indexes of a destination at `fetched_at`"""
+
+    def __init__(self, destination_url: str, fetched_at: Optional[float] = None):
+        self.destination_url = destination_url
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.categories: Set[Tuple[str, ...]] = set()
+        self.terms: Dict[str, Optional[str]] = {}  # english -> tibetan title
+        self.indexes: Set[str] = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_toc(cls, destination_url: str, toc: List[Dict]):
+        """Build a snapshot from the table of contents of `GET api/index`"""
+        snapshot = cls(destination_url)
+        nodes = [(node, ()) for node in toc]
+        while nodes:
+            node, parent = nodes.pop()
+            if "category" in node:
+                path = parent + (node["category"],)
+                snapshot.categories.add(path)
+                snapshot.terms[node["category"]] = node.get("heCategory")
+                nodes.extend((child, path) for child in node.get("contents", []))
+            elif "title" in node:
+                snapshot.indexes.add(node["title"])
+        return snapshot
+
+    def has_term(self, term_en: str, term_bo: Optional[str] = None):
+        """True if the term exists, and with the tibetan title `term_bo` if given"""
+        if term_en not in self.terms:
+            return False
+        return term_bo is None or self.terms[term_en] == term_bo
+
+    def has_category(self, category_path: List[str]):
+        return tuple(category_path) in self.categories
+
+    def has_index(self, index_key: str):
+        return index_key in self.indexes
+
+    def add_index(self, index_key: str):
+        with self._lock:
+            self.indexes.add(index_key)
+
+    def forget_index(self, index_key: str):
+        with self._lock:
+            self.indexes.discard(index_key)
+
+    def seed_registry(self, registry: Registry):
+        """
+        Record every term and category of the snapshot in `registry`, and
+        forget those the registry knows of the destination but the snapshot
+        does not list, e.g. deleted since they were recorded.
+        """
+        terms = {en: bo for en, bo in self.terms.items() if bo is not None}
+        registry.update(self.destination_url, terms, self.categories)
+        registry.retain(self.destination_url, self.terms, self.categories)
+
+    def plan(self, texts: Iterable[Dict]) -> PostPlan:
+        """
+        Return the posts `texts` need, each term, category and index once for
+        the whole corpus. Only the categories of the texts are read.
+        """
+        plan = PostPlan()
+        seen = set()
+        for text in texts:
+            en_categories = text["source"]["categories"]
+            bo_categories = text["target"]["categories"]
+            for i, (en, bo) in enumerate(zip(en_categories, bo_categories)):
+                term = ("term", en["name"])
+                if term not in seen:
+                    seen.add(term)
+                    if self.has_term(en["name"], bo["name"]):
+                        plan.existing_terms += 1
+                    else:
+                        plan.terms.append(en["name"])
+                path = tuple(category["name"] for category in en_categories[: i + 1])
+                if ("category", path) not in seen:
+                    seen.add(("category", path))
+                    if self.has_category(list(path)):
+                        plan.existing_categories += 1
+                    else:
+                        plan.categories.append("/".join(path))
+            index_key = en_categories[-1]["name"]
+            if ("index", index_key) not in seen:
+                seen.add(("index", index_key))
+                if self.has_index(index_key):
+                    plan.existing_indexes.append(index_key)
+                else:
+                    plan.new_indexes.append(index_key)
+        return plan
+
+
+def get_toc(destination_url: str) -> List[Dict]:
+    """Get the table of contents of the destination, its whole category tree"""
+    url = destination_url + "api/index"
+    try:
+        response = get_client(destination_url).request("GET", url, operation="get_toc")
+        return json.loads(response.read().decode("utf-8"))
+    except HTTPError as e:
+        error_message = (
+            f"Index list: HTTP Error {e.code} occurred: {e.read().decode('utf-8')}"
+        )
+        raise HTTPError(e.url, e.code, error_message, e.headers, e.fp)
+
+    except Exception as e:
+        error_message = f"Index list: {e}"
+        raise Exception(error_message)
+
+
+_snapshots: Dict[str, RemoteSnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def load_snapshot(
+    destination_url: str, registry: Optional[Registry] = None
+) -> RemoteSnapshot:
+    """
+    Fetch the snapshot of a destination and keep it for `get_snapshot`.
+        `registry`: seeded with the terms and categories of the snapshot
+    """
+    snapshot = RemoteSnapshot.from_toc(destination_url, get_toc(destination_url))
+    with _snapshots_lock:
+        _snapshots[destination_url] = snapshot
+    if registry is not None:
+        snapshot.seed_registry(registry)
+    logger.info(
+        f"SNAPSHOT: {urllib.parse.urlsplit(destination_url).netloc} has "
+        f"{len(snapshot.categories)} categories and {len(snapshot.indexes)} indexes"
+    )
+    return snapshot
+
+
+def get_snapshot(destination_url: str) -> Optional[RemoteSnapshot]:
+    """Return the snapshot `load_snapshot` kept for a destination, if any"""
+    return _snapshots.get(destination_url)
+
+
+def forget_snapshot(destination_url: str):
+    """Drop the snapshot of a destination, later uploads ask it again"""
+    with _snapshots_lock:
+        _snapshots.pop(destination_url, None)
+
+
+def forget_index(destination_url: str, index_key: str):
+    """Keep the snapshot of a destination up to date after an index was removed"""
+    snapshot = _snapshots.get(destination_url)
+    if snapshot is not None:
+        snapshot.forget_index(index_key)
@@ -0,0 +1,516 @@
+"""
+Streaming ingestion of large pecha json files.
+
+`upload_stream` never holds the whole document in memory. A first pass over
+the file keeps the categories, the book metadata and the shape of the content
+(keys and list depths, but no segments), which is all terms, categories and
+the index need. A second pass then parses the `source` and `target` books
+chapter by chapter and posts every chapter as soon as it is parsed. The links
+of a commentary are generated from a third pass, over its link side only,
+once the chapters are posted.
+"""
+
+import json
+import re
+from json.decoder import scanstring
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from pecha_uploader.client import track_transfer
+from pecha_uploader.config import logger
+from pecha_uploader.dry_run import check_dry_run, planning
+from pecha_uploader.journal import UploadJournal, hash_file, run_step
+from pecha_uploader.links.create_ref_json import iter_links
+from pecha_uploader.manifest import Manifest
+from pecha_uploader.metrics import (
+    PREPROCESS,
+    TOTAL,
+    stage,
+    timed_iter,
+    write_upload_metrics,
+)
+from pecha_uploader.pipeline import (
+    add_index,
+    add_links,
+    add_terms_and_categories,
+    build_payload,
+    build_version,
+    get_category_path,
+    get_index_key,
+    is_commentary,
+    post_text_version,
+    trace_upload,
+)
+from pecha_uploader.profiling import profiled
+from pecha_uploader.registry import Registry, get_registry
+from pecha_uploader.tracing import span
+from pecha_uploader.transaction import upload_transaction
+from pecha_uploader.utils import chapter_key, get_list_depth, parse_annotation
+
+CHUNK_SIZE = 1 << 20  # characters read from the file at a time
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+LANGUAGES = {"source": "en", "target": "he"}
+
+
+class JsonStreamReader:
+    """
+    Pull parser over a json text file.
+    Objects and arrays are walked with `iter_object`/`iter_array`, and the
+    caller consumes each member with `read_value`, `skip_value` or another
+    nested iteration before asking for the next one.
+    """
+
+    def __init__(self, fp, chunk_size: int = CHUNK_SIZE):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = 0):
+        """Read at least `size` more characters, return False at end of file"""
+        if self._eof:
+            return False
+        if self._pos:
+            self._buf = self._buf[self._pos :]  # noqa
+            self._pos = 0
+        data = self._fp.read(max(size, self._chunk_size))
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, '' at end of file"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Stream: expected '{char}' but found '{found}'")
+        self._pos += 1
+
+    def _next_member(self, closing: str):
+        """Consume the separator after a member, return False at the end"""
+        char = self.peek()
+        self._pos += 1
+        if char == closing:
+            return False
+        if char != ",":
+            raise ValueError(f"Stream: expected ',' or '{closing}' but found '{char}'")
+        return True
+
+    def _read_key(self):
+        self._expect('"')
+        while True:
+            try:
+                key, end = scanstring(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill(len(self._buf)):
+                    raise
+                continue
+            self._pos = end
+            self._expect(":")
+            return key
+
+    def read_value(self):
+        """Decode the next complete json value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # grow the buffer geometrically so large values stay linear
+                if not self._fill(len(self._buf)):
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip_value(self):
+        """Consume the next value without materialising nested containers"""
+        char = self.peek()
+        if char == "{":
+            for _ in self.iter_object():
+                self.skip_value()
+        elif char == "[":
+            for _ in self.iter_array():
+                self.skip_value()
+        else:
+            self.read_value()
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the next object"""
+        self._expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            yield self._read_key()
+            if not self._next_member("}"):
+                return
+
+    def iter_array(self) -> Iterator[int]:
+        """Yield the positions of the next array"""
+        self._expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        position = 0
+        while True:
+            yield position
+            position += 1
+            if not self._next_member("]"):
+                return
+
+
+def depth_stub(value: List):
+    """
+    Return a list with the same emptiness and depth as `value`, which is all
+    `generate_schema` needs from a segment list.
+    """
+    if not value:
+        return []
+    stub: List = [""]
+    for _ in range(get_list_depth(value) - 1):
+        stub = [stub]
+    return stub
+
+
+def _read_content_skeleton(reader: JsonStreamReader):
+    if reader.peek() == "{":
+        return {key: _read_content_skeleton(reader) for key in reader.iter_object()}
+    value = reader.read_value()
+    if isinstance(value, list):
+        return depth_stub(value)
+    return value
+
+
+def _read_book_skeleton(reader: JsonStreamReader):
+    book = {}
+    for key in reader.iter_object():
+        if key == "content":
+            book[key] = _read_content_skeleton(reader)
+        else:
+            book[key] = reader.read_value()
+    return book
+
+
+def read_skeleton(path: Union[str, Path]):
+    """
+    Read a pecha json with every segment list replaced by a `depth_stub`.
+    The result can be used wherever the pipeline needs categories, book
+    metadata or the schema, but not the text itself.
+    """
+    text: Dict = {}
+    with open(path, encoding="utf-8") as f:
+        reader = JsonStreamReader(f)
+        for side in reader.iter_object():
+            if side not in LANGUAGES:
+                text[side] = reader.read_value()
+                continue
+            text[side] = {}
+            for key in reader.iter_object():
+                if key == "books":
+                    text[side][key] = [
+                        _read_book_skeleton(reader) for _ in reader.iter_array()
+                    ]
+                else:
+                    text[side][key] = reader.read_value()
+    return text
+
+
+def read_categories(path: Union[str, Path]):
+    """Read only the categories of both sides of a pecha json"""
+    text: Dict = {}
+    with open(path, encoding="utf-8") as f:
+        reader = JsonStreamReader(f)
+        for side in reader.iter_object():
+            if side not in LANGUAGES:
+                reader.skip_value()
+                continue
+            text[side] = {}
+            for key in reader.iter_object():
+                if key == "categories":
+                    text[side][key] = reader.read_value()
+                else:
+                    reader.skip_value()
+    return text
+
+
+class Chapter(NamedTuple):
+    """One chapter of a book, as parsed from the file"""
+
+    side: str
+    book: Dict  # skeleton of the book, for its metadata
+    name: str  # ref the chapter is posted to
+    data: List  # raw segments, annotations not parsed yet
+    link_title: Optional[str]  # ref of the chapter in the english index
+
+
+def _stream_nodes(
+    reader: JsonStreamReader,
+    skeleton: Dict,
+    en_skeleton: Optional[Dict],
+    side: str,
+    book: Dict,
+    parent_keys: List[str],
+    en_parent_keys: Optional[List[str]],
+):
+    """Yield the chapters of a content dict, children are aligned by position"""
+    en_keys = list(en_skeleton) if isinstance(en_skeleton, dict) else []
+    for i, key in enumerate(reader.iter_object()):
+        if not isinstance(skeleton.get(key), dict):
+            reader.skip_value()
+            continue
+        en_key = en_keys[i] if i < len(en_keys) else None
+        en_node = en_skeleton[en_key] if en_key is not None else None
+        yield from _stream_node(
+            reader,
+            skeleton[key],
+            en_node if isinstance(en_node, dict) else None,
+            side,
+            book,
+            parent_keys + [key.strip()],
+            en_parent_keys + [en_key.strip()]
+            if en_parent_keys is not None and en_key is not None
+            else None,
+        )
+
+
+def _stream_node(
+    reader: JsonStreamReader,
+    skeleton: Dict,
+    en_skeleton: Optional[Dict],
+    side: str,
+    book: Dict,
+    parent_keys: List[str],
+    en_parent_keys: Optional[List[str]],
+):
+    has_children = any(key != "data" for key in skeleton)
+    name = chapter_key(parent_keys, has_children, book["language"])
+    link_title = None
+    if en_parent_keys is not None and en_skeleton is not None:
+        en_has_children = any(key != "data" for key in en_skeleton)
+        link_title = chapter_key(en_parent_keys, en_has_children, "en")
+
+    # the data of a node is posted after its children, like utils.walk_text
+    data: List = []
+    en_keys = list(en_skeleton) if en_skeleton is not None else []
+    for i, key in enumerate(reader.iter_object()):
+        if key == "data":
+            data = reader.read_value()
+        elif isinstance(skeleton.get(key), dict):
+            en_key = en_keys[i] if i < len(en_keys) else None
+            en_node = en_skeleton[en_key] if en_key is not None else None
+            yield from _stream_node(
+                reader,
+                skeleton[key],
+                en_node if isinstance(en_node, dict) else None,
+                side,
+                book,
+                parent_keys + [key.strip()],
+                en_parent_keys + [en_key.strip()]
+                if en_parent_keys is not None and en_key is not None
+                else None,
+            )
+        else:
+            reader.skip_value()
+    yield Chapter(side, book, name, data, link_title)
+
+
+def iter_chapters(
+    path: Union[str, Path], skeleton: Dict, sides: Iterable[str] = tuple(LANGUAGES)
+) -> Iterator[Chapter]:
+    """
+    Parse the books of a pecha json chapter by chapter.
+    `skeleton` is the result of `read_skeleton` for the same file.
+        `sides`: "source" and/or "target", the books of the other side are skipped
+    """
+    index_key = get_index_key(skeleton)
+    en_book = skeleton["source"]["books"][0] if skeleton["source"]["books"] else {}
+    with open(path, encoding="utf-8") as f:
+        reader = JsonStreamReader(f)
+        for side in reader.iter_object():
+            if side not in LANGUAGES or side not in sides:
+                reader.skip_value()
+                continue
+            for key in reader.iter_object():
+                if key != "books":
+                    reader.skip_value()
+                    continue
+                for position in reader.iter_array():
+                    book = skeleton[side]["books"][position]
+                    for book_key in reader.iter_object():
+                        if book_key != "content":
+                            reader.skip_value()
+                        elif isinstance(book["content"], dict):
+                            yield from _stream_nodes(
+                                reader,
+                                book["content"],
+                                en_book.get("content"),
+                                side,
+                                book,
+                                [],
+                                [],
+                            )
+                        elif isinstance(book["content"], list):
+                            content = reader.read_value()
+                            yield Chapter(side, book, index_key, content, index_key)
+                        else:
+                            reader.skip_value()
+
+
+def _link_side(skeleton: Dict):
+    """Links are generated from the target books, if any of them has content"""
+    if any(book.get("content") for book in skeleton["target"]["books"]):
+        return "target"
+    return "source"
+
+
+def iter_stream_links(path: Union[str, Path], skeleton: Dict) -> Iterator[Dict]:
+    """
+    Generate the links of a commentary file from another pass over its link
+    side, chapter by chapter, so that they are never all held in memory.
+    """
+    root_detail = skeleton["source"]["categories"][-1]
+    for chapter in iter_chapters(path, skeleton, (_link_side(skeleton),)):
+        if chapter.link_title:
+            yield from iter_links(chapter.link_title, chapter.data, root_detail)
+
+
+def add_stream_texts(
+    path: Union[str, Path],
+    skeleton: Dict,
+    destination_url: str,
+    registry: Optional[Registry] = None,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+):
+    """
+    Post everything of a pecha json file, parsing its books chapter by chapter.
+    `skeleton` is the result of `read_skeleton` for the same file.
+    """
+    payload = build_payload(skeleton)
+    category_path = get_category_path(payload)
+    text_index_key = payload["bookKey"]
+    commentary = is_commentary(skeleton)
+
+    try:
+        with span("add_texts", **{"pecha.commentary": commentary}):
+            # what this run created is deleted again if it fails before the links
+            with upload_transaction(destination_url, journal, manifest):
+                with stage("terms_categories"):
+                    add_terms_and_categories(
+                        payload, destination_url, registry, journal
+                    )
+                with stage("index"):
+                    run_step(
+                        journal,
+                        f"index:{text_index_key}",
+                        add_index,
+                        payload,
+                        destination_url,
+                    )
+
+                for chapter in timed_iter(
+                    iter_chapters(path, skeleton), "parse_chapters"
+                ):
+                    lang = LANGUAGES[chapter.side]
+                    with stage("clean_chapter", PREPROCESS):
+                        text = dict(
+                            build_version(chapter.book, lang),
+                            text=parse_annotation(chapter.data),
+                        )
+                    with stage("texts"):
+                        post_text_version(
+                            lang,
+                            chapter.name,
+                            text,
+                            category_path,
+                            destination_url,
+                            text_index_key,
+                            journal,
+                            manifest,
+                        )
+
+            if commentary:
+                # links are generated lazily while the batches are posted
+                links = timed_iter(iter_stream_links(path, skeleton), "link_refs")
+                with stage("links"):
+                    add_links(links, destination_url, journal, manifest)
+
+    except Exception as e:
+        logger.error(f"{e}")
+        raise Exception(f"{e}")
+
+
+def upload_stream(
+    path: Union[str, Path],
+    destination_url: str,
+    use_registry: bool = True,
+    resume: bool = False,
+    only_changed: bool = False,
+    dry_run: bool = False,
+    plan_path: Optional[Union[str, Path]] = None,
+    profile: Optional[bool] = None,
+    sync_links: bool = False,
+    tracing: Optional[bool] = None,
+):
+    """
+    Upload a pecha json file without loading the whole document.
+        `use_registry`: skip terms and categories the local registry knows exist
+        `resume`: skip the steps an earlier upload of the same file completed
+        `only_changed`: post only chapters and links that changed since the last upload
+        `dry_run`: write the requests to the jsonl `plan_path` instead of sending them
+        `profile`: write a cProfile and tracemalloc profile to `PROFILE_PATH`,
+        by default when `PECHA_UPLOADER_PROFILE` is set
+        `sync_links`: post and delete only the links that differ from those of
+        the destination, instead of deleting and posting them all again
+        `tracing`: write a trace of the upload to `TRACE_PATH`, by default when
+        `PECHA_UPLOADER_TRACE` is set
+    Return the `TransferStats` of the upload.
+    Metrics of the upload are written to `METRICS_PATH`, except for dry runs,
+    and at the end of the batch for the texts of `upload_many`.
+    """
+    with stage("read_skeleton", PREPROCESS):
+        skeleton = read_skeleton(path)
+    text_index_key = get_index_key(skeleton)
+    with profiled(text_index_key, profile):
+        if dry_run:
+            check_dry_run(resume, only_changed)
+            with planning(destination_url, text_index_key, plan_path) as stats:
+                add_stream_texts(path, skeleton, destination_url)
+            return stats
+
+        registry = get_registry() if use_registry else None
+        with track_transfer() as stats, trace_upload(
+            text_index_key, destination_url, "stream", stats, tracing
+        ):
+            journal = UploadJournal(destination_url, hash_file(path), resume)
+            manifest = Manifest(
+                destination_url, text_index_key, only_changed, sync_links=sync_links
+            )
+            try:
+                with stage("upload", TOTAL):
+                    add_stream_texts(
+                        path, skeleton, destination_url, registry, journal, manifest
+                    )
+            finally:
+                journal.close()
+                manifest.close()
+                write_upload_metrics()
+                logger.info(f"SENT: '{text_index_key}' {stats}")
+        return stats
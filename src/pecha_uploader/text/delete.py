@@ -1,7 +1,8 @@
-import urllib
 from urllib.error import HTTPError
 
-from pecha_uploader.config import PECHA_API_KEY, str, headers, logger
+from pecha_uploader.cache import INDEX, TEXT, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key, logger
 
 
 def remove_text(title: str, destination_url: str):
@@ -9,13 +10,13 @@ def remove_text(title: str, destination_url: str):
     title > text title
     """
     url = destination_url + f"api/texts/{title}"
-    values = {"apikey": PECHA_API_KEY}
-    data = urllib.parse.urlencode(values)
-    binary_key = data.encode("ascii")
-    req = urllib.request.Request(url, binary_key, method="DELETE", headers=headers)
+    values = {"apikey": get_api_key()}
     try:
-        urllib.request.urlopen(req)
-        # response = urllib.request.urlopen(req)
+        get_client(destination_url).request(
+            "DELETE", url, fields=values, operation="remove_text"
+        )
+        invalidate(destination_url, TEXT, title, prefix=True)
+        invalidate(destination_url, INDEX, title)
         logger.info(f"Successfully removed text for: {title}")
 
     except HTTPError as e:
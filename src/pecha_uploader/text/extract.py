@@ -1,8 +1,9 @@
 import json
-import urllib.request
+import urllib.parse
 from urllib.error import HTTPError
 
-from pecha_uploader.config import headers, logger
+from pecha_uploader.cache import TEXT, cached_get
+from pecha_uploader.config import logger
 
 
 def get_text(text_name: str, destination_url: str):
@@ -14,10 +15,8 @@ def get_text(text_name: str, destination_url: str):
     prepare_text_str = urllib.parse.quote(text_name)
 
     url = f"{text_url}/{prepare_text_str}?pad=0"
-    req = urllib.request.Request(url, method="GET", headers=headers)
     try:
-        response = urllib.request.urlopen(req)  # noqa
-        res = response.read().decode("utf-8")
+        res = cached_get(destination_url, TEXT, text_name, url, "get_text", "pad=0")
         return json.loads(res)
 
     except HTTPError as e:
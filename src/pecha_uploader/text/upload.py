@@ -1,29 +1,12 @@
-import json
-import urllib
+import urllib.parse
 from typing import Dict, List
 from urllib.error import HTTPError
 
-from pecha_uploader.clear_unfinished_text import remove_texts_meta
-from pecha_uploader.config import PECHA_API_KEY, headers, logger
+from pecha_uploader.cache import INDEX, TEXT, invalidate
+from pecha_uploader.client import get_client
+from pecha_uploader.config import get_api_key, logger
+from pecha_uploader.encoding import encode_json
 from pecha_uploader.exceptions import APIError
-from pecha_uploader.text.extract import get_text
-
-
-def can_remove_index(
-    text_index: str, text_title: str, destination_url: str
-):
-    """check if index can be removed"""
-
-    texts = get_text(text_title, destination_url)
-    if "error" not in texts:
-        total_versions = len(texts["versions"])
-    else:
-        total_versions = 0
-
-    if text_index != text_title:
-        return False
-    elif text_index == text_title and total_versions == 0:
-        return True
 
 
 def post_text(
@@ -57,34 +40,28 @@ def post_text(
             ]
         }
     """
-    text_input_json = json.dumps(text_content)
+    text_input_json = encode_json(text_content)
     # text_name = text_name.replace(" ", "_")
 
     prepare_text = urllib.parse.quote(text_name)
     url = destination_url + f"api/texts/{prepare_text}?count_after=1"
 
-    values = {"json": text_input_json, "apikey": f"{PECHA_API_KEY}"}
-    data = urllib.parse.urlencode(values)
-    binary_data = data.encode("ascii")
-    req = urllib.request.Request(url, binary_data, headers=headers)
+    values = {"json": text_input_json, "apikey": get_api_key()}
     try:
-        response = urllib.request.urlopen(req)
+        # posting a version again replaces its text
+        response = get_client(destination_url).request(
+            "POST", url, fields=values, idempotent=True, operation="post_text"
+        )
+        # the refs of a complex text start with the title of its schema root
+        invalidate(destination_url, TEXT, text_name, prefix=True)
+        # the content counts of the index change too
+        invalidate(destination_url, TEXT, text_index_key, prefix=True)
+        invalidate(destination_url, INDEX, text_index_key)
         res = response.read().decode("utf-8")
         if "error" in res:
             if "Failed to parse sections for ref" in res:
                 logger.warning(f"Text: Failed to parse sections for ref {text_name}")
-
-            if can_remove_index(
-                text_index_key, text_content["versionTitle"], destination_url
-            ):
-                remove_texts_meta(
-                    {
-                        "term": text_name,
-                        "category": category_path,
-                        "index": text_index_key,
-                    },
-                    destination_url,
-                )
+            # what the upload created is rolled back by its transaction
             raise APIError(f"Text : '{res}'")
         else:
             logger.info(f"UPLOADED: Text '{text_content['versionTitle']}'")
@@ -0,0 +1,275 @@
+"""
+Span based traces of uploads.
+
+An upload opens a trace with `trace`, and the pipeline nests spans in it with
+`span`: stages, terms, categories, chapters, link batches, rollbacks and every
+API call, with their timings, attributes and errors. Spans follow the current
+context, so they nest correctly on executor threads started with a copy of it.
+Outside of a trace `span` records nothing.
+
+Every trace is written to `TRACE_PATH` in the OTLP json format of
+OpenTelemetry (`resourceSpans`), which OpenTelemetry tooling can import.
+Uploads are traced on demand, with `tracing=True` of `upload`, `upload_stream`,
+`upload_async` and `upload_many`, or for every run with the environment
+variable `PECHA_UPLOADER_TRACE=1`.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from urllib.parse import quote
+
+from pecha_uploader.config import TRACE_PATH
+
+SERVICE_NAME = "pecha_uploader"
+TRACE_ENV = "PECHA_UPLOADER_TRACE"
+
+_TRUE = ("1", "true", "yes", "on")
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def tracing_enabled(tracing: Optional[bool] = None):
+    """`tracing` if given, else whether `PECHA_UPLOADER_TRACE` is set to true"""
+    if tracing is not None:
+        return tracing
+    return os.environ.get(TRACE_ENV, "").strip().lower() in _TRUE
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP json
+        return {"intValue": f"{value}"}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": f"{value}"}
+
+
+def _otlp_attributes(attributes: Dict):
+    return [
+        {"key": key, "value": _otlp_value(value)} for key, value in attributes.items()
+    ]
+
+
+class Span:
+    """One timed operation of a trace"""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        kind: int = KIND_INTERNAL,
+        attributes: Optional[Dict] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.events: List[Dict] = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, value: Union[int, float]):
+        """Add `value` to a numeric attribute, e.g. bytes of several attempts"""
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{error}"
+        self.events.append(
+            {
+                "timeUnixNano": f"{time.time_ns()}",
+                "name": "exception",
+                "attributes": _otlp_attributes(
+                    {
+                        "exception.type": type(error).__name__,
+                        "exception.message": f"{error}",
+                    }
+                ),
+            }
+        )
+
+    def end(self):
+        self.end_ns = time.time_ns()
+
+    @property
+    def duration(self):
+        """Seconds, up to now for a span still open"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": f"{self.start_ns}",
+            "endTimeUnixNano": f"{self.end_ns or time.time_ns()}",
+            "attributes": _otlp_attributes(self.attributes),
+            "events": self.events,
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class _NoSpan:
+    """Span of code running outside of a trace, records nothing"""
+
+    name = ""
+    attributes: Dict = {}
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def add(self, key: str, value: Union[int, float]):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace:
+    """Spans of one upload, written to a file when the trace ends"""
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, self.trace_id, attributes=attributes)
+        self.spans: List[Span] = [self.root]
+        self.path: Optional[Path] = None
+        self._lock = threading.Lock()
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[Span],
+        kind: int = KIND_INTERNAL,
+        attributes: Optional[Dict] = None,
+    ):
+        parent_id = parent.span_id if parent is not None else self.root.span_id
+        span = Span(name, self.trace_id, parent_id, kind, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def to_otlp(self):
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": SERVICE_NAME})
+                    },
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+
+    def write(self, directory: Optional[Union[str, Path]] = None):
+        """Write the trace as OTLP json to `directory`, `TRACE_PATH` by default"""
+        directory = Path(directory) if directory else TRACE_PATH
+        directory.mkdir(parents=True, exist_ok=True)
+        title = self.root.attributes.get("pecha.index_key", self.root.name)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self.root.start_ns / 1e9))
+        self.path = (
+            directory
+            / f"{stamp}-{quote(f'{title}', safe=' ')}-{self.trace_id[:8]}.json"
+        )
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f, ensure_ascii=False)
+        return self.path
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("pecha_trace", default=None)
+_span: contextvars.ContextVar = contextvars.ContextVar("pecha_span", default=None)
+
+
+def current_span():
+    """Return the innermost open span, a span that records nothing outside a trace"""
+    return _span.get() or NO_SPAN
+
+
+@contextmanager
+def trace(name: str, directory: Optional[Union[str, Path]] = None, **attributes):
+    """
+    Trace the block as a root span `name`, then write the trace to `directory`.
+    Yield the `Trace`, whose `path` is set once written. A trace opened inside
+    another one is only a span of it.
+        with trace("upload", **{"pecha.index_key": key}):
+            add_texts(text, destination_url)
+    """
+    if _trace.get() is not None:
+        with span(name, **attributes):
+            yield _trace.get()
+        return
+
+    current = Trace(name, attributes)
+    trace_token = _trace.set(current)
+    span_token = _span.set(current.root)
+    try:
+        yield current
+    except BaseException as e:
+        current.root.record_error(e)
+        raise
+    else:
+        current.root.status = STATUS_OK
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        current.root.end()
+        current.write(directory)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """
+    Time the block as a child span of the current one. Errors raised in the
+    block are recorded on the span and raised again.
+        with span("chapter", ref=text_name) as chapter_span:
+            chapter_span.set_attribute("segments", count)
+    """
+    current = _trace.get()
+    if current is None:
+        yield NO_SPAN
+        return
+    child = current.start_span(name, _span.get(), kind, attributes)
+    token = _span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    else:
+        child.status = STATUS_OK
+    finally:
+        _span.reset(token)
+        child.end()
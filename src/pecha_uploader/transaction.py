@@ -0,0 +1,232 @@
+"""
+Transactions of uploads: undo what a failed upload created, and only that.
+
+While an upload posts its terms, categories, index and chapters, the
+`UploadTransaction` of the current context records the resources this run
+created, as opposed to those that already existed and may be shared with other
+texts. When the upload fails, they are deleted in dependency order: the index
+(with its chapters), then the categories from the deepest up, then the terms
+the removed categories were named with. Deletes of the same level are
+independent of each other and run at the same time.
+
+An upload that keeps a journal can be resumed instead: once one of its
+chapters is posted, a failure keeps the index, the chapters and the completed
+steps of the journal, and only the metadata created before the first chapter
+is ever rolled back.
+
+Every upload in flight claims the terms and categories it uses, created or
+not. A rollback keeps those another upload of the same process has claimed,
+since that upload may already have posted its index in them.
+"""
+
+import contextvars
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pecha_uploader.category.delete import remove_category
+from pecha_uploader.config import logger
+from pecha_uploader.index.delete import remove_index
+from pecha_uploader.journal import UploadJournal
+from pecha_uploader.manifest import Manifest
+from pecha_uploader.preprocess.delete import remove_term
+from pecha_uploader.tracing import span
+
+DEFAULT_ROLLBACK_WORKERS = 8
+
+_transaction: contextvars.ContextVar = contextvars.ContextVar(
+    "pecha_transaction", default=None
+)
+
+# (destination, "term" or "category", name) -> number of uploads claiming it
+_claims: Dict[Tuple, int] = defaultdict(int)
+_claims_lock = threading.Lock()
+
+
+class UploadTransaction:
+    """Terms, categories and index created by one upload"""
+
+    def __init__(self, destination_url: str):
+        self.destination_url = destination_url
+        self.terms: List[str] = []
+        self.categories: List[Tuple[str, ...]] = []
+        self.index: Optional[str] = None
+        self.has_chapters = False
+        self._claimed: Set[Tuple] = set()
+        self._lock = threading.Lock()
+
+    def _claim(self, key: Tuple):
+        with self._lock:
+            if key in self._claimed:
+                return
+            self._claimed.add(key)
+        with _claims_lock:
+            _claims[key] += 1
+
+    def claim_term(self, term_en: str):
+        """Mark the term as used by this upload until `release`"""
+        self._claim((self.destination_url, "term", term_en))
+
+    def claim_category(self, category_path: List[str]):
+        """Mark the category as used by this upload until `release`"""
+        self._claim((self.destination_url, "category", tuple(category_path)))
+
+    def release(self):
+        """Drop the claims of this upload"""
+        with self._lock:
+            claimed, self._claimed = self._claimed, set()
+        with _claims_lock:
+            for key in claimed:
+                _claims[key] -= 1
+                if not _claims[key]:
+                    del _claims[key]
+
+    def _claimed_by_others(self, kind: str, name) -> bool:
+        key = (self.destination_url, kind, name)
+        with _claims_lock:
+            return _claims.get(key, 0) > (key in self._claimed)
+
+    def add_term(self, term_en: str):
+        with self._lock:
+            if term_en not in self.terms:
+                self.terms.append(term_en)
+
+    def add_category(self, category_path: List[str]):
+        with self._lock:
+            if tuple(category_path) not in self.categories:
+                self.categories.append(tuple(category_path))
+
+    def has_category(self, category_path: List[str]):
+        return tuple(category_path) in self.categories
+
+    def add_index(self, index_key: str):
+        self.index = index_key
+
+    def add_chapter(self):
+        """Record that a chapter of the index is on the destination"""
+        self.has_chapters = True
+
+    @property
+    def is_empty(self):
+        return not (self.terms or self.categories or self.index)
+
+    def _run_level(
+        self, fn: Callable, items: List, max_workers: int, errors: List[Exception]
+    ):
+        """Call `fn(item, destination_url)` for every item, return those that failed"""
+        if not items:
+            return set()
+
+        def run(item):
+            try:
+                result = fn(item, self.destination_url)
+            except Exception as e:
+                logger.error(f"ROLLBACK: {fn.__name__} {item} failed: {e}")
+                errors.append(e)
+                return False
+            # a category that is not empty, e.g. used by another text, stays
+            if isinstance(result, str) and "error" in result:
+                if "doesn't exist" in result:
+                    return True
+                logger.warning(f"ROLLBACK: {fn.__name__} {item} kept: {result}")
+                return False
+            return True
+
+        if len(items) == 1:
+            done = [run(items[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+                futures = [
+                    ex.submit(contextvars.copy_context().run, run, item)
+                    for item in items
+                ]
+                done = [future.result() for future in futures]
+        return {item for item, ok in zip(items, done) if not ok}
+
+    def rollback(self, max_workers: int = DEFAULT_ROLLBACK_WORKERS) -> List[Exception]:
+        """
+        Delete the recorded resources in dependency order, independent ones
+        concurrently. A term is kept when its category could not be deleted.
+        Terms and categories claimed by another upload in flight are kept.
+        Return the errors of the deletes that failed.
+        """
+        errors: List[Exception] = []
+        attributes = {
+            "pecha.index": self.index or "",
+            "pecha.categories": len(self.categories),
+            "pecha.terms": len(self.terms),
+        }
+        with span("rollback", **attributes):
+            if self.index:
+                self._run_level(remove_index, [self.index], max_workers, errors)
+
+            by_depth = defaultdict(list)
+            kept: Set[Tuple[str, ...]] = set()
+            for category_path in self.categories:
+                if self._claimed_by_others("category", category_path):
+                    logger.warning(
+                        f"ROLLBACK: category {category_path} kept, used by "
+                        "another upload"
+                    )
+                    kept.add(category_path)
+                else:
+                    by_depth[len(category_path)].append(category_path)
+            for depth in sorted(by_depth, reverse=True):
+                kept |= self._run_level(
+                    remove_category, by_depth[depth], max_workers, errors
+                )
+
+            in_use = {path[-1] for path in kept}
+            terms = [
+                term
+                for term in self.terms
+                if term not in in_use and not self._claimed_by_others("term", term)
+            ]
+            self._run_level(remove_term, terms, max_workers, errors)
+        return errors
+
+
+def current_transaction() -> Optional[UploadTransaction]:
+    """Return the transaction of the upload running in this context, if any"""
+    return _transaction.get()
+
+
+@contextmanager
+def upload_transaction(
+    destination_url: str,
+    journal: Optional[UploadJournal] = None,
+    manifest: Optional[Manifest] = None,
+):
+    """
+    Record what the block creates, and roll it back if the block raises.
+    After a rollback, `journal` and `manifest` forget the undone steps, so that
+    a resumed or `only_changed` upload posts them again. With a `journal`,
+    nothing is rolled back once a chapter was posted, so that a resumed upload
+    continues from the completed steps. The error of the block is raised again,
+    rollback errors are only logged.
+        with upload_transaction(destination_url, journal, manifest):
+            add_terms_and_categories(payload, destination_url, registry, journal)
+    """
+    transaction = UploadTransaction(destination_url)
+    token = _transaction.set(transaction)
+    try:
+        yield transaction
+    except Exception:
+        _transaction.reset(token)
+        if journal is not None and transaction.has_chapters:
+            logger.warning(
+                "ROLLBACK: skipped, chapters were posted and the upload can resume"
+            )
+        elif not transaction.is_empty:
+            transaction.rollback()
+            if journal is not None:
+                journal.clear()
+            if manifest is not None and transaction.index:
+                manifest.clear()
+        raise
+    else:
+        _transaction.reset(token)
+    finally:
+        transaction.release()
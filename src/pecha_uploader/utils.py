@@ -1,54 +1,15 @@
 import json
 import re
-from typing import Dict, List, Union
+from itertools import zip_longest
+from typing import Dict, List, Optional, Tuple, Union
 
+LINK_SIDES = ("en", "bo")
 
-def generate_schema(enbook: Dict, bobook: Dict, en_key: str = "", bo_key: str = ""):
-
-    nodes = []
-    # generate schema node for complex text
-    if "content" in bobook:
-        botext = bobook["content"]
-        entext = enbook["content"]
-    else:
-        botext = bobook
-        entext = enbook
-
-    if isinstance(entext, dict):
-        for (enkey, envalue), (bokey, bovalue) in zip(entext.items(), botext.items()):
-            en_full_key = enkey.strip() if en_key else enkey
-            bo_full_key = bokey.strip() if bo_key else bokey
-            if isinstance(envalue, dict) and enkey != "data":
-                # Check if the dictionary has any children other than 'data'
-
-                has_children = any(sub_key != "data" for sub_key in envalue.keys())
-                child_nodes = generate_schema(
-                    envalue, bovalue, en_full_key, bo_full_key
-                )
-                # if data is only
-                if not has_children:
-                    data_node = create_data_node(
-                        en_full_key, bo_full_key, envalue["data"], bovalue["data"]
-                    )
-                    nodes.append(data_node)
-                else:
-                    node = {
-                        "nodes": child_nodes,
-                        "titles": [
-                            {"lang": "he", "text": bo_full_key, "primary": True},
-                            {"lang": "en", "text": en_full_key, "primary": True},
-                        ],
-                        "key": en_full_key,
-                    }
-                    nodes.append(node)
 
-            elif enkey == "data":
-                data_node = create_data_node(enkey, "གནས་བབས", envalue, bovalue)
-                nodes.append(data_node)
-    if isinstance(entext, list):
-        data_node = create_data_node(enbook["title"], bobook["title"], entext, botext)
-        nodes.append(data_node)
-    return nodes
+def generate_schema(enbook: Dict, bobook: Dict, en_key: str = "", bo_key: str = ""):
+    """generate schema nodes of a pair of books"""
+    walker = ContentWalker(schema=True)
+    return walker.walk_books(enbook, bobook, en_key, bo_key)
 
 
 def create_data_node(
@@ -56,16 +17,21 @@ def create_data_node(
     bo_key: str,
     envalue: Union[List[str], List[List]],
     bovalue: Union[List[str], List[List]],
+    en_depth: Optional[int] = None,
+    bo_depth: Optional[int] = None,
 ):
-    """This function generate node for schema"""
+    """
+    This function generate node for schema
+        `en_depth`, `bo_depth`: list depths of the values, if already known
+    """
     text_depth = None
     sections = ["Chapters", "Verses", "Paragraphs"]
 
     if len(envalue) > 0:
-        text_depth = get_list_depth(envalue)
+        text_depth = get_list_depth(envalue) if en_depth is None else en_depth
 
     elif len(bovalue) > 0:
-        text_depth = get_list_depth(bovalue)
+        text_depth = get_list_depth(bovalue) if bo_depth is None else bo_depth
 
     else:
         text_depth = 1
@@ -83,43 +49,85 @@ def create_data_node(
     }
 
 
-def parse_annotation(value: Union[List[str], List[List]]):
-    """clean and parse annotation"""
+_NUMBERED_TAG = re.compile(r"<\d+>")
 
-    def process_item(item):
-        # If the item is a list, recursively process its contents
-        if isinstance(item, list):
-            return [process_item(sub_item) for sub_item in item]
+SAPCHE_OPEN = '<span class="text-subche-style">'
+CITATION_OPEN = '<span class="text-citation-style">'
+QUOTATION_OPEN = '<span class="text-quotation-style">'
+SPAN_CLOSE = "</span>"
 
-        # Convert item to string and apply transformations
-        if not isinstance(item, str):
-            item = str(item)
 
-        # Replace newlines
+def clean_segment(item):
+    """
+    clean and parse the annotation of one segment
+    Every rule is applied only if its marker occurs in the segment, so a plain
+    segment costs a few substring checks and a strip.
+    """
+    if not isinstance(item, str):
+        item = str(item)
+
+    # Replace newlines
+    if "\n" in item:
         item = item.replace("\n", "<br>")
 
-        # Sapche transformation
-        if "<sapche>" in item:
-            item = item.replace("<sapche>", '<span class="text-subche-style">')
-            item = item.replace("</sapche>", "</span>")
+    # Sapche transformation
+    if "<sapche>" in item:
+        item = item.replace("<sapche>", SAPCHE_OPEN).replace("</sapche>", SPAN_CLOSE)
+
+    # Citation transformation
+    if "{" in item:
+        item = item.replace("{", CITATION_OPEN).replace("}", SPAN_CLOSE)
+
+    # Quotation transformation
+    if "(" in item:
+        item = item.replace("(", QUOTATION_OPEN).replace(")", SPAN_CLOSE)
+
+    # Remove numbered tags, after stripping like before
+    item = item.strip()
+    if "<" in item:
+        item = _NUMBERED_TAG.sub("", item)
 
-        # Citation transformation
-        if "{" in item:
-            item = item.replace("{", '<span class="text-citation-style">')
-            item = item.replace("}", "</span>")
+    return item
+
+
+def parse_annotation(value: Union[List[str], List[List]]):
+    """clean and parse annotation"""
+    if not isinstance(value, list):
+        return clean_segment(value)
+    return clean_with_depth(value)[0]
 
-        # Quotation transformation
-        if "(" in item:
-            item = item.replace("(", '<span class="text-quotation-style">')
-            item = item.replace(")", "</span>")
 
-        # Remove numbered tags
-        item = re.sub(r"<\d+>", "", item.strip())
+def clean_with_depth(value: Union[str, List]):
+    """
+    Return `(parse_annotation(value), get_list_depth(value))`, computed in the
+    same pass. Segments of a list are cleaned in one loop, only nested lists
+    recurse.
+    """
+    if not isinstance(value, list):
+        return clean_segment(value), 0
+    cleaned = []
+    max_depth = 0
+    for item in value:
+        if isinstance(item, list):
+            item, depth = clean_with_depth(item)
+            if depth > max_depth:
+                max_depth = depth
+        else:
+            item = clean_segment(item)
+        cleaned.append(item)
+    return cleaned, max_depth + 1
 
-        return item
 
-    # Process the entire input recursively
-    return process_item(value)
+def chapter_key(parent_keys: List[str], has_children: bool, language: str):
+    """
+    Return the ref the data of a content node is posted to.
+    The data of a node with children gets its own, language specific, section.
+    """
+    if not has_children:
+        return ", ".join(parent_keys)
+    if language == "bo":
+        return ", ".join(parent_keys) + ", གནས་བབས"
+    return ", ".join(parent_keys) + ", data"
 
 
 def generate_chapters(
@@ -129,38 +137,308 @@ def generate_chapters(
     parent_keys: List[str] = None,
 ):
     """generate text content"""
-    result = {}
-    if parent_keys is None:
-        parent_keys = []
+    walker = ContentWalker(en_language=language, en_chapters=True)
+    walker.walk_content(book, None, parent_keys=parent_keys)
+    return walker.en_chapters
+
+
+class ContentWalker:
+    """
+    Walk the contents of an english and a tibetan book together, once, and
+    collect what the upload needs from them.
+        `schema`: collect the schema nodes of the pairs of nodes of both books
+        `en_chapters`, `bo_chapters`: collect the cleaned data of every node of
+        the book, keyed by chapter ref
+        `link_side`: "en" or "bo", collect the raw data of that book as link
+        input, keyed by the chapter ref in the english book
+    """
+
+    def __init__(
+        self,
+        en_language: str = "en",
+        bo_language: str = "bo",
+        schema: bool = False,
+        en_chapters: bool = False,
+        bo_chapters: bool = False,
+        link_side: Optional[str] = None,
+    ):
+        if link_side is not None and link_side not in LINK_SIDES:
+            raise ValueError(f"link_side must be one of {LINK_SIDES}.")
+        self.en_language = en_language
+        self.bo_language = bo_language
+        self.schema = schema
+        self.link_side = link_side
+        self.en_chapters: Optional[Dict[str, List]] = {} if en_chapters else None
+        self.bo_chapters: Optional[Dict[str, List]] = {} if bo_chapters else None
+        self.link_inputs: List[Tuple[str, List]] = []
+
+    def walk_books(
+        self,
+        enbook: Dict,
+        bobook: Optional[Dict],
+        en_key: str = "",
+        bo_key: str = "",
+        index_key: str = "",
+    ):
+        """
+        Walk a pair of books, or `enbook` alone if `bobook` is None, and
+        return the schema nodes.
+            `index_key`: chapter ref of a simple text, whose content is a list
+        """
+        if bobook is None:
+            botext = None
+            entext = enbook.get("content", enbook)
+        elif "content" in bobook:
+            botext = bobook["content"]
+            entext = enbook["content"]
+        else:
+            botext = bobook
+            entext = enbook
+
+        if isinstance(entext, list):
+            return self._walk_list(enbook, bobook, entext, botext, index_key)
+        return self.walk_content(entext, botext, en_key, bo_key)
+
+    def walk_content(
+        self,
+        entext,
+        botext,
+        en_key: str = "",
+        bo_key: str = "",
+        parent_keys: Optional[List[str]] = None,
+    ):
+        """Walk the children of two content dicts, return their schema nodes"""
+        parent_keys = parent_keys or []
+        return self._walk_children(
+            entext if isinstance(entext, dict) else None,
+            botext if isinstance(botext, dict) else None,
+            en_key,
+            bo_key,
+            parent_keys,
+            parent_keys,
+            self.schema and botext is not None,
+        )
+
+    def _clean(self, value, chapters: Optional[Dict]):
+        """Return the cleaned value and its depth, as far as they are needed"""
+        if chapters is not None:
+            return clean_with_depth(value)
+        if self.schema:
+            return None, get_list_depth(value)
+        return None, None
+
+    def _walk_list(self, enbook: Dict, bobook, entext: List, botext, index_key: str):
+        en_clean, en_depth = self._clean(entext, self.en_chapters)
+        if self.en_chapters is not None:
+            self.en_chapters[index_key] = en_clean
+        bo_depth = None
+        if isinstance(botext, list):
+            bo_clean, bo_depth = self._clean(botext, self.bo_chapters)
+            if self.bo_chapters is not None:
+                self.bo_chapters[index_key] = bo_clean
+
+        if self.link_side == "bo" and isinstance(botext, list) and len(botext) > 0:
+            self.link_inputs.append((index_key, botext))
+        elif self.link_side is not None and len(entext) > 0:
+            self.link_inputs.append((index_key, entext))
+
+        if not self.schema or bobook is None:
+            return []
+        return [
+            create_data_node(
+                enbook["title"], bobook["title"], entext, botext, en_depth, bo_depth
+            )
+        ]
+
+    def _walk_children(
+        self,
+        en: Optional[Dict],
+        bo: Optional[Dict],
+        en_key: str,
+        bo_key: str,
+        en_parents: List[str],
+        bo_parents: List[str],
+        schema: bool,
+        en_depth: Optional[int] = None,
+        bo_depth: Optional[int] = None,
+    ):
+        """
+        Walk the children of a node of either or both books, paired by
+        position, and return their schema nodes.
+            `en_depth`, `bo_depth`: depths of the node's own data
+        """
+        nodes = []
+        en_items = en.items() if en is not None else ()
+        bo_items = bo.items() if bo is not None else ()
+        for en_item, bo_item in zip_longest(en_items, bo_items):
+            enkey, envalue = en_item if en_item is not None else ("", None)
+            bokey, bovalue = bo_item if bo_item is not None else ("", None)
+            paired = schema and en_item is not None and bo_item is not None
+            en_child = envalue if isinstance(envalue, dict) else None
+            bo_child = bovalue if isinstance(bovalue, dict) else None
+
+            if en_child is None:
+                if paired and enkey == "data":
+                    nodes.append(
+                        create_data_node(
+                            enkey,
+                            "གནས་བབས",
+                            envalue,
+                            bovalue,
+                            en_depth,
+                            bo_depth if bokey == "data" else None,
+                        )
+                    )
+                if bo_child is None:
+                    continue
 
-    for key, value in book.items():
-        full_key = key if current_key else key
-        new_parent_keys = parent_keys + [key.strip()]  # Update list of parent key
-        clean_value = []
-        if isinstance(value, dict):
+            paired = paired and en_child is not None and enkey != "data"
+            en_full_key = enkey.strip() if en_key else enkey
+            bo_full_key = bokey.strip() if bo_key else bokey
+            child_nodes, child_en_depth, child_bo_depth = self._walk_node(
+                en_child,
+                bo_child,
+                en_full_key,
+                bo_full_key,
+                en_parents + [enkey.strip()],
+                bo_parents + [bokey.strip()],
+                paired,
+            )
+            if not paired:
+                continue
 
             # Check if the dictionary has any children other than 'data'
-            has_children = any(sub_key != "data" for sub_key in value.keys())
-            child_data = generate_chapters(value, language, full_key, new_parent_keys)
-            result.update(child_data)  # Merge results from children
-
-            # Determine the key for 'data' depending on whether there are other children
-            if "data" in value:
-                clean_value = parse_annotation(value["data"])
-
-                # If there are other children, include 'data' in the key, else exclude it
-            if has_children:
-                if language == "bo":
-                    data_key = ", ".join(new_parent_keys) + ", གནས་བབས"
-                else:
-                    data_key = ", ".join(new_parent_keys) + ", data"
+            if not any(sub_key != "data" for sub_key in envalue.keys()):
+                nodes.append(
+                    create_data_node(
+                        en_full_key,
+                        bo_full_key,
+                        envalue["data"],
+                        bovalue["data"],
+                        child_en_depth,
+                        child_bo_depth,
+                    )
+                )
             else:
-                data_key = ", ".join(
-                    new_parent_keys
-                )  # Exclude 'data' from the key if no other children
-            result[data_key] = clean_value
+                nodes.append(
+                    {
+                        "nodes": child_nodes,
+                        "titles": [
+                            {"lang": "he", "text": bo_full_key, "primary": True},
+                            {"lang": "en", "text": en_full_key, "primary": True},
+                        ],
+                        "key": en_full_key,
+                    }
+                )
+        return nodes
+
+    def _walk_node(
+        self,
+        en: Optional[Dict],
+        bo: Optional[Dict],
+        en_key: str,
+        bo_key: str,
+        en_parents: List[str],
+        bo_parents: List[str],
+        schema: bool,
+    ):
+        """
+        Walk a content node of either or both books.
+        Return its schema child nodes and the depths of its own data.
+        """
+        en_clean = bo_clean = en_depth = bo_depth = None
+        if en is not None and "data" in en:
+            en_clean, en_depth = self._clean(en["data"], self.en_chapters)
+        if bo is not None and "data" in bo:
+            bo_clean, bo_depth = self._clean(bo["data"], self.bo_chapters)
+
+        nodes = self._walk_children(
+            en, bo, en_key, bo_key, en_parents, bo_parents, schema, en_depth, bo_depth
+        )
+
+        # chapters of the children come before the data of their parent
+        if en is not None:
+            en_has_children = any(sub_key != "data" for sub_key in en.keys())
+            if self.en_chapters is not None:
+                ref = chapter_key(en_parents, en_has_children, self.en_language)
+                self.en_chapters[ref] = en_clean if en_clean is not None else []
+            if self.link_side is not None:
+                # links always refer to the chapter refs of the english book
+                ref = chapter_key(en_parents, en_has_children, "en")
+                if self.link_side == "en":
+                    self.link_inputs.append((ref, en.get("data", [])))
+                elif bo is not None:
+                    self.link_inputs.append((ref, bo.get("data", [])))
+        if bo is not None and self.bo_chapters is not None:
+            bo_has_children = any(sub_key != "data" for sub_key in bo.keys())
+            ref = chapter_key(bo_parents, bo_has_children, self.bo_language)
+            self.bo_chapters[ref] = bo_clean if bo_clean is not None else []
+        return nodes, en_depth, bo_depth
+
+
+class TextTree:
+    """
+    Result of walking every book of a pecha json once.
+        `schema`: schema nodes of the first english and tibetan books
+        `en_chapters`, `bo_chapters`: per book, cleaned data keyed by chapter ref
+        `link_inputs`: `(english chapter ref, raw data)` of every chapter
+    """
+
+    def __init__(self):
+        self.schema: List[Dict] = []
+        self.en_chapters: List[Dict[str, List]] = []
+        self.bo_chapters: List[Dict[str, List]] = []
+        self.link_inputs: List[Tuple[str, List]] = []
+
 
-    return result
+def walk_text(
+    text: Dict, schema: bool = True, chapters: bool = True, links: bool = False
+):
+    """
+    Collect the schema, the chapters and the link inputs of a pecha json in a
+    single walk over its books.
+        `links`: collect link inputs, from the tibetan books if they have
+        content, otherwise from the english books
+    """
+    index_key = text["source"]["categories"][-1]["name"]
+    enbooks = text["source"]["books"]
+    bobooks = text["target"]["books"]
+    link_side = None
+    if links:
+        link_side = "bo" if any(book.get("content") for book in bobooks) else "en"
+
+    tree = TextTree()
+    # every tibetan book is walked together with the first english book
+    enbook = enbooks[0] if enbooks else {}
+    for i, bobook in enumerate(bobooks or [None]):
+        walker = ContentWalker(
+            enbook.get("language", "en"),
+            bobook.get("language", "bo") if bobook is not None else "bo",
+            schema=schema and i == 0 and bobook is not None,
+            en_chapters=chapters and i == 0 and bool(enbooks),
+            bo_chapters=chapters and bobook is not None,
+            link_side=link_side if i == 0 or link_side == "bo" else None,
+        )
+        nodes = walker.walk_books(enbook, bobook, index_key=index_key)
+        if walker.schema:
+            tree.schema = nodes
+        if walker.en_chapters is not None:
+            tree.en_chapters.append(walker.en_chapters)
+        if walker.bo_chapters is not None:
+            tree.bo_chapters.append(walker.bo_chapters)
+        tree.link_inputs.extend(walker.link_inputs)
+
+    for enbook in enbooks[1:]:
+        walker = ContentWalker(
+            enbook.get("language", "en"),
+            en_chapters=chapters,
+            link_side="en" if link_side == "en" else None,
+        )
+        walker.walk_books(enbook, None, index_key=index_key)
+        if walker.en_chapters is not None:
+            tree.en_chapters.append(walker.en_chapters)
+        tree.link_inputs.extend(walker.link_inputs)
+    return tree
 
 
 def get_list_depth(lst):
@@ -0,0 +1,105 @@
+"""
+Fixtures of the test suite, which runs against `MockSefariaServer` instead
+of staging.
+
+The uploader keeps its state (registry, journal, manifest, logs, plans,
+metrics and traces) under the home directory, so the whole session gets a
+temporary home, set before `pecha_uploader` is imported.
+"""
+
+import copy
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+os.environ["HOME"] = tempfile.mkdtemp(prefix="pecha-uploader-tests-")
+os.environ["PECHA_API_KEY"] = "test-api-key"
+
+import pytest  # noqa: E402
+
+from pecha_uploader import pipeline  # noqa: E402
+from pecha_uploader.cache import configure_cache  # noqa: E402
+from pecha_uploader.client import close_clients, configure_client  # noqa: E402
+from pecha_uploader.mock_server import MockSefariaServer  # noqa: E402
+from pecha_uploader.registry import configure_registry  # noqa: E402
+from pecha_uploader.resilience import RetryPolicy  # noqa: E402
+from pecha_uploader.text.upload import post_text  # noqa: E402
+
+DATA_PATH = Path(__file__).parent / "data"
+API_KEY = os.environ["PECHA_API_KEY"]
+
+# verses 1:2, 1:3 and 2:1 of the root text, with annotations to clean
+SEGMENTS = ["a{b}<1><2>", "c(d)<1><3>", "e<2><1>"]
+
+
+def read_data(name: str):
+    with open(DATA_PATH / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def make_complex(text: Dict, segments: List[str] = SEGMENTS) -> Dict:
+    """A copy of `text` whose books have a dict schema of nested chapters"""
+    text = copy.deepcopy(text)
+    for side, chapter in (("source", "Chapter"), ("target", "ལེའུ")):
+        text[side]["books"][0]["content"] = {
+            chapter: {"data": [list(segments)], "Part 1": {"data": list(segments)}}
+        }
+    return text
+
+
+def write_text(path: Path, text: Dict) -> Path:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(text, f, ensure_ascii=False)
+    return path
+
+
+def record_posts(
+    monkeypatch, fail_at: Optional[int] = None, error=KeyboardInterrupt
+) -> List:
+    """
+    Record the (ref, language) of the chapters posted by the pipeline.
+        `fail_at`: number of the post that raises `error`, by default as if
+        the process died
+    """
+    posted = []
+
+    def recording(text_name, text, *args):
+        if len(posted) + 1 == fail_at:
+            raise error
+        post_text(text_name, text, *args)
+        posted.append((text_name, text["language"]))
+
+    monkeypatch.setattr(pipeline, "post_text", recording)
+    return posted
+
+
+@pytest.fixture
+def server(tmp_path):
+    """A mock destination, with fast retries and a registry of its own"""
+    with MockSefariaServer(api_key=API_KEY) as server:
+        configure_client(server.url, retry=RetryPolicy(base_delay=0.01))
+        configure_registry(path=tmp_path / "registry.json")
+        configure_cache()
+        yield server
+    close_clients()
+
+
+@pytest.fixture
+def root_text():
+    return read_data("base_text.json")
+
+
+@pytest.fixture
+def commentary_text():
+    return read_data("commentary_text.json")
+
+
+@pytest.fixture
+def linked_commentary(root_text, commentary_text):
+    """A complex commentary of `root_text`, with a link per segment"""
+    root_title = pipeline.get_index_key(root_text)
+    for side in ("source", "target"):
+        commentary_text[side]["categories"][-1]["base_text_titles"] = [root_title]
+    return make_complex(commentary_text)
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from conftest import make_complex
+
+from pecha_uploader import pipeline
+from pecha_uploader.async_pipeline import upload_async
+from pecha_uploader.pipeline import get_index_key, upload
+
+
+def track_calls(monkeypatch, name: str, delay: float = 0.05, fail_at=None):
+    """
+    Replace `pipeline.<name>` with a call that takes at least `delay` seconds,
+    and record how many calls ran at the same time.
+        `fail_at`: number of the call that raises instead, as soon as it starts
+    """
+    original = getattr(pipeline, name)
+    state = {"calls": 0, "running": 0, "max_running": 0, "done": 0}
+    lock = threading.Lock()
+
+    def tracking(*args):
+        with lock:
+            state["calls"] += 1
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+            call = state["calls"]
+        try:
+            if call == fail_at:
+                raise RuntimeError("boom")
+            time.sleep(delay)
+            result = original(*args)
+            state["done"] += 1
+            return result
+        finally:
+            with lock:
+                state["running"] -= 1
+
+    monkeypatch.setattr(pipeline, name, tracking)
+    return state
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_terms_and_chapters_are_posted_concurrently(
+    server, root_text, monkeypatch, max_in_flight
+):
+    text = make_complex(root_text)
+    terms = track_calls(monkeypatch, "post_term")
+    chapters = track_calls(monkeypatch, "post_text")
+
+    asyncio.run(upload_async(text, server.url, max_in_flight=max_in_flight))
+
+    assert terms["calls"] == len(text["source"]["categories"])
+    assert chapters["calls"] == 4
+    assert terms["max_running"] == min(max_in_flight, terms["calls"])
+    assert chapters["max_running"] == min(max_in_flight, chapters["calls"])
+    assert len(server.store.texts) == 4
+
+
+def test_upload_matches_the_sync_pipeline(server, root_text):
+    text = make_complex(root_text)
+    upload(text, server.url)
+    expected = {ref: dict(versions) for ref, versions in server.store.texts.items()}
+    server.store.texts.clear()
+
+    asyncio.run(upload_async(text, server.url, max_in_flight=4))
+
+    assert server.store.texts == expected
+
+
+def test_running_chapters_are_drained_before_the_rollback(
+    server, root_text, monkeypatch
+):
+    text = make_complex(root_text)
+    chapters = track_calls(monkeypatch, "post_text", delay=0.2, fail_at=1)
+
+    with pytest.raises(Exception, match="boom"):
+        asyncio.run(upload_async(text, server.url, max_in_flight=2))
+
+    # the chapters that had started finished, the others never start, and
+    # those posted while the failure was handled are rolled back too
+    calls = chapters["calls"]
+    assert chapters["running"] == 0
+    assert calls < 4
+    assert chapters["done"] == calls - 1
+    time.sleep(0.3)
+    assert chapters["calls"] == calls
+    assert server.store.texts == {}
+    assert get_index_key(text) not in server.store.indexes
@@ -0,0 +1,48 @@
+from conftest import write_text
+
+from pecha_uploader.batch import FAILED, SUCCESS, upload_many
+from pecha_uploader.pipeline import get_index_key
+
+
+def test_commentary_waits_for_its_root(server, root_text, commentary_text):
+    root_title = get_index_key(root_text)
+    for side in ("source", "target"):
+        commentary_text[side]["categories"][-1]["base_text_titles"] = [root_title]
+    done = []
+
+    results = upload_many(
+        [commentary_text, root_text], server.url, workers=2, on_result=done.append
+    )
+
+    assert [result.status for result in results] == [SUCCESS, SUCCESS]
+    assert [result.title for result in done] == [
+        root_title,
+        get_index_key(commentary_text),
+    ]
+
+
+def test_unreadable_files_fail_on_their_own(server, root_text, tmp_path):
+    root_path = write_text(tmp_path / "root.json", root_text)
+    malformed_path = tmp_path / "malformed.json"
+    malformed_path.write_text('{"source": {"categories": [', encoding="utf-8")
+    del root_text["source"]["categories"]
+    invalid_path = write_text(tmp_path / "invalid.json", root_text)
+    missing_path = tmp_path / "missing.json"
+    done = []
+
+    results = upload_many(
+        [malformed_path, root_path, invalid_path, missing_path],
+        server.url,
+        on_result=done.append,
+    )
+
+    assert [result.status for result in results] == [FAILED, SUCCESS, FAILED, FAILED]
+    assert [result.source for result in results] == [
+        str(malformed_path),
+        str(root_path),
+        str(invalid_path),
+        str(missing_path),
+    ]
+    failed = [results[0], results[2], results[3]]
+    assert all(result.error.startswith("Unreadable text") for result in failed)
+    assert len(done) == 4
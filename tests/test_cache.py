@@ -0,0 +1,24 @@
+from pecha_uploader.pipeline import get_index_key, upload
+from pecha_uploader.text.extract import get_text
+from pecha_uploader.text.upload import post_text
+
+
+def version_titles(ref, server):
+    return sorted(
+        version["versionTitle"] for version in get_text(ref, server.url)["versions"]
+    )
+
+
+def test_text_read_after_a_post_is_fresh(server, root_text, linked_commentary):
+    upload(root_text, server.url)
+    upload(linked_commentary, server.url)
+    ref = "Chapter, Part 1"
+    before = version_titles(ref, server)
+    requests = server.requests
+    assert version_titles(ref, server) == before
+    assert server.requests == requests
+
+    version = {"versionTitle": "New version", "language": "en", "text": ["a"]}
+    post_text(ref, version, [], server.url, get_index_key(linked_commentary))
+
+    assert version_titles(ref, server) == sorted(before + ["New version"])
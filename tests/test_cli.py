@@ -0,0 +1,148 @@
+import io
+import json
+
+import pytest
+from conftest import write_text
+
+from pecha_uploader.batch import FAILED, SUCCESS, UploadResult
+from pecha_uploader.cli import Progress, expand_paths, main
+from pecha_uploader.pipeline import get_index_key
+
+
+@pytest.fixture
+def corpus(tmp_path, root_text, commentary_text):
+    """A directory with a root text and, in a subdirectory, its commentary"""
+    for side in ("source", "target"):
+        commentary_text[side]["categories"][-1]["base_text_titles"] = [
+            get_index_key(root_text)
+        ]
+    corpus = tmp_path / "corpus"
+    (corpus / "commentaries").mkdir(parents=True)
+    write_text(corpus / "root.json", root_text)
+    write_text(corpus / "commentaries" / "commentary.json", commentary_text)
+    (corpus / "notes.txt").write_text("not a text", encoding="utf-8")
+    return corpus
+
+
+def run(capsys, *argv):
+    status = main(list(argv))
+    return status, json.loads(capsys.readouterr().out)
+
+
+def test_paths_are_expanded_in_order_without_duplicates(corpus, tmp_path):
+    extra = write_text(tmp_path / "extra.json", {})
+    root, commentary = corpus / "root.json", corpus / "commentaries/commentary.json"
+
+    assert expand_paths([str(corpus)]) == [commentary, root]
+    assert expand_paths(
+        [str(extra), str(tmp_path / "**" / "root.json"), str(corpus), str(extra)]
+    ) == [extra, root, commentary]
+    assert expand_paths([str(corpus / "*.json")]) == [root]
+    with pytest.raises(FileNotFoundError):
+        expand_paths([str(tmp_path / "missing" / "*.json")])
+
+
+def test_upload_prints_a_summary_of_every_text(server, corpus, capsys):
+    status, summary = run(capsys, str(corpus), "-d", server.url, "-q")
+
+    assert status == 0
+    assert summary["destination_url"] == server.url
+    assert summary["texts"] == {"success": 2, "failed": 0, "skipped": 0}
+    assert summary["chapters"] == 4
+    assert summary["bytes_sent"] > 0
+    assert [result["source"] for result in summary["results"]] == [
+        str(corpus / "commentaries/commentary.json"),
+        str(corpus / "root.json"),
+    ]
+    assert set(summary["results"][0]) == {
+        "source",
+        "title",
+        "status",
+        "error",
+        "elapsed",
+        "bytes_sent",
+    }
+    for key in ("elapsed", "texts_per_minute", "chapters_per_second"):
+        assert summary[key] > 0
+    assert "megabytes_per_second" in summary
+
+
+def test_failed_text_exits_with_status_1(server, corpus, capsys, tmp_path):
+    summary_path = tmp_path / "summary.json"
+    (corpus / "malformed.json").write_text('{"source": {', encoding="utf-8")
+
+    status = main([str(corpus), "-d", server.url, "-q", "--summary", str(summary_path)])
+
+    assert status == 1
+    assert capsys.readouterr().out == ""
+    with open(summary_path, encoding="utf-8") as f:
+        summary = json.load(f)
+    assert summary["texts"] == {"success": 2, "failed": 1, "skipped": 0}
+    assert summary["results"][1]["status"] == FAILED
+
+
+@pytest.mark.parametrize(
+    "options, message",
+    [
+        (["--dry-run", "--snapshot"], "cannot be combined with --snapshot"),
+        (["--dry-run", "--resume"], "cannot be combined with resume"),
+        (["--workers", "0"], "--workers must be at least 1"),
+        ([], "No pecha json file matches"),
+    ],
+)
+def test_invalid_options_are_usage_errors(server, corpus, capsys, options, message):
+    paths = [str(corpus)] if options else [str(corpus), str(corpus / "*.xml")]
+    with pytest.raises(SystemExit) as exit:
+        main(options + ["-d", server.url, "-q"] + paths)
+
+    assert exit.value.code == 2
+    assert message in capsys.readouterr().err
+    assert server.requests == 0
+
+
+def test_api_key_is_required_unless_dry_run(server, corpus, capsys, monkeypatch):
+    monkeypatch.delenv("PECHA_API_KEY")
+
+    with pytest.raises(SystemExit) as exit:
+        main([str(corpus), "-d", server.url, "-q"])
+    assert exit.value.code == 2
+    assert "$PECHA_API_KEY is not set" in capsys.readouterr().err
+
+    status, summary = run(capsys, str(corpus), "-d", server.url, "-q", "--dry-run")
+    assert status == 0
+    assert summary["texts"]["success"] == 2
+    assert server.requests == 0
+
+
+def test_plan_reports_unreadable_files_on_their_own(server, corpus, capsys):
+    (corpus / "malformed.json").write_text('{"source": {', encoding="utf-8")
+
+    status, plan = run(capsys, str(corpus), "-d", server.url, "--plan")
+
+    assert status == 1
+    assert len(plan["new_indexes"]) == 2
+    assert [result["source"] for result in plan["results"]] == [
+        str(corpus / "malformed.json")
+    ]
+    assert plan["results"][0]["error"].startswith("Unreadable text")
+    assert server.store.indexes == {}
+
+
+def test_progress_reports_counts_and_eta():
+    stream = io.StringIO()
+    progress = Progress(4, stream=stream)
+    progress.add(UploadResult("a.json", "A", SUCCESS))
+    progress.add(UploadResult("b.json", "B", FAILED, "boom"))
+
+    progress.stop()
+
+    line = stream.getvalue()
+    assert line.startswith("[2/4 texts] ")
+    assert "ETA " in line and "ETA ?" not in line
+    assert line.rstrip().endswith(", 1 failed")
+    assert progress.snapshot()["texts"] == {
+        "success": 1,
+        "failed": 1,
+        "skipped": 0,
+        "total": 4,
+    }
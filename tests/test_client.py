@@ -0,0 +1,85 @@
+from urllib.error import HTTPError
+
+import pytest
+
+from pecha_uploader.client import ConnectionPool, PechaClient
+from pecha_uploader.exceptions import CircuitOpenError
+from pecha_uploader.resilience import CircuitBreaker, RetryPolicy
+
+
+def count_connections(monkeypatch):
+    opened = []
+    new_connection = ConnectionPool._new_connection
+
+    def counting(pool):
+        opened.append(pool.host)
+        return new_connection(pool)
+
+    monkeypatch.setattr(ConnectionPool, "_new_connection", counting)
+    return opened
+
+
+def test_requests_reuse_a_keep_alive_connection(server, monkeypatch):
+    opened = count_connections(monkeypatch)
+    client = PechaClient(server.url)
+    for i in range(20):
+        response = client.request("GET", server.url + f"api/terms/term{i}")
+        assert response.status == 200
+    client.close()
+
+    assert server.requests == 20
+    assert len(opened) == 1
+
+
+def failing_client(server, status: int, **options):
+    server.error_rate = 1.0
+    server.error_status = (status,)
+    server.retry_after = 0
+    return PechaClient(server.url, retry=RetryPolicy(base_delay=0.01), **options)
+
+
+def test_transient_failure_is_retried(server):
+    client = failing_client(server, 503)
+    # the first attempt fails, the retry reaches a healthy server
+    client.add_listener(lambda event: setattr(server, "error_rate", 0.0))
+
+    response = client.request("GET", server.url + "api/terms/term")
+
+    assert response.status == 200
+    assert server.requests == 2
+
+
+def test_retries_stop_after_max_attempts(server):
+    client = failing_client(server, 502)
+    client.retry.max_attempts = 3
+
+    with pytest.raises(HTTPError) as error:
+        client.request("GET", server.url + "api/terms/term")
+
+    assert error.value.code == 502
+    assert server.requests == 3
+
+
+def test_post_that_may_have_been_applied_is_not_retried(server):
+    client = failing_client(server, 500)
+
+    with pytest.raises(HTTPError):
+        client.request(
+            "POST", server.url + "api/links/", fields={"json": "[]"}, idempotent=False
+        )
+
+    assert server.requests == 1
+
+
+def test_circuit_opens_after_consecutive_failures(server):
+    client = failing_client(
+        server, 503, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    )
+    client.retry.max_attempts = 1
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            client.request("GET", server.url + "api/terms/term")
+
+    with pytest.raises(CircuitOpenError):
+        client.request("GET", server.url + "api/terms/term")
+    assert server.requests == 2
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+from pecha_uploader import config
+from pecha_uploader.config import API_KEY_ENV, get_api_key
+
+# imports every module of the package, and prints the variables it read
+IMPORT_ALL = """
+import json, os, pkgutil, sys
+read = []
+environ_type = type(os.environ)
+getitem = environ_type.__getitem__
+environ_type.__getitem__ = lambda self, key: read.append(key) or getitem(self, key)
+import pecha_uploader
+for module in pkgutil.walk_packages(pecha_uploader.__path__, "pecha_uploader."):
+    __import__(module.name)
+print(json.dumps(read))
+"""
+
+
+def test_import_has_no_side_effects(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key != API_KEY_ENV}
+    env["HOME"] = str(tmp_path)
+    env["PECHA_DESTINATION_URL"] = "https://staging.pecha.org/"
+
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_ALL],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+
+    assert [key for key in json.loads(output) if key.startswith("PECHA_")] == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_api_key_is_read_when_used(monkeypatch):
+    monkeypatch.delenv(API_KEY_ENV)
+    assert get_api_key() is None
+    assert config.PECHA_API_KEY is None
+
+    monkeypatch.setenv(API_KEY_ENV, "set-after-import")
+
+    assert get_api_key() == "set-after-import"
+    assert config.PECHA_API_KEY == "set-after-import"
@@ -0,0 +1,62 @@
+import json
+
+from conftest import API_KEY
+
+from pecha_uploader.dry_run import REDACTED, read_plan, replay_plan
+from pecha_uploader.mock_server import MockSefariaServer
+from pecha_uploader.pipeline import upload
+
+
+def operations(plan):
+    return [planned["operation"] for planned in plan]
+
+
+def test_dry_run_plans_every_request_without_sending(
+    server, root_text, linked_commentary, tmp_path
+):
+    root_plan = tmp_path / "root.jsonl"
+    commentary_plan = tmp_path / "commentary.jsonl"
+
+    upload(root_text, server.url, dry_run=True, plan_path=root_plan)
+    upload(linked_commentary, server.url, dry_run=True, plan_path=commentary_plan)
+
+    assert server.requests == 0
+    plan = list(read_plan(root_plan))
+    assert operations(plan)[-3:] == ["post_index", "post_text", "post_text"]
+    assert {"post_term", "post_category"} <= set(operations(plan[:-3]))
+    assert all(planned["destination_url"] == server.url for planned in plan)
+    posts = [planned for planned in plan if planned["method"] == "POST"]
+    assert all(planned["fields"]["apikey"] == REDACTED for planned in posts)
+    assert all(planned["bytes"] > 0 for planned in posts)
+
+    plan = list(read_plan(commentary_plan))
+    assert operations(plan).count("post_text") == 4
+    posted_links = [
+        link
+        for planned in plan
+        if planned["operation"] == "post_link"
+        for link in json.loads(planned["fields"]["json"])
+    ]
+    assert len(posted_links) == 6
+    # links are planned after every chapter
+    assert operations(plan).index("post_link") > max(
+        i for i, operation in enumerate(operations(plan)) if operation == "post_text"
+    )
+
+
+def test_replayed_plan_uploads_what_an_upload_does(
+    server, root_text, linked_commentary, tmp_path
+):
+    plans = [tmp_path / "root.jsonl", tmp_path / "commentary.jsonl"]
+    for text, plan in zip((root_text, linked_commentary), plans):
+        upload(text, server.url, dry_run=True, plan_path=plan)
+        upload(text, server.url)
+
+    with MockSefariaServer(api_key=API_KEY) as replayed:
+        for plan in plans:
+            replay_plan(plan, replayed.url, API_KEY)
+        assert replayed.store.indexes == server.store.indexes
+        assert replayed.store.texts == server.store.texts
+        assert sorted(link["refs"] for link in replayed.store.links) == sorted(
+            link["refs"] for link in server.store.links
+        )
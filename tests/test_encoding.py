@@ -0,0 +1,69 @@
+import json
+
+from conftest import API_KEY
+
+from pecha_uploader.client import PechaClient
+from pecha_uploader.encoding import FORM, ascii_json, encode_form, encode_json
+from pecha_uploader.mock_server import MockSefariaServer
+
+TERM = {
+    "name": "ཀུན་བཟང་ 🙏",
+    "titles": [{"text": '"quoted" \\ ཀ', "lang": "he"}],
+    # large enough to be compressed
+    "description": "ཀུན་ཏུ་བཟང་པོ། " * 100,
+}
+
+
+def post_term(client, url):
+    fields = {"json": encode_json(TERM), "apikey": API_KEY, "update": True}
+    return client.request("POST", url + "api/terms/term", fields=fields)
+
+
+def test_form_bodies_carry_ascii_escaped_json():
+    assert ascii_json(encode_json(TERM)) == json.dumps(TERM, separators=(",", ":"))
+
+    body, _ = encode_form({"json": encode_json(TERM), "apikey": API_KEY})
+    assert b"%5Cu0f40" in body
+    assert b"%E0" not in body
+
+
+def test_client_falls_back_to_form_bodies():
+    with MockSefariaServer(api_key=API_KEY, accept_multipart=False) as server:
+        client = PechaClient(server.url)
+        assert post_term(client, server.url).status == 200
+        client.close()
+
+        assert client.encoding == FORM
+        assert server.store.terms["term"] == TERM
+
+
+def test_gzip_is_opt_in_and_dropped_when_the_server_rejects_it():
+    with MockSefariaServer(api_key=API_KEY, accept_gzip=False) as server:
+        assert PechaClient(server.url).compress is False
+        client = PechaClient(server.url, compress=True)
+        post_term(client, server.url)
+        client.close()
+
+        assert client.compress is False
+        assert server.requests == 2
+        assert server.store.terms["term"] == TERM
+
+
+def test_gzip_is_dropped_when_the_server_does_not_decode_it(server, monkeypatch):
+    # a server that ignores Content-Encoding fails to parse the first body
+    server.error_status = (400,)
+    count_request = server.count_request
+
+    def count_and_fail_first():
+        count_request()
+        server.error_rate = 1.0 if server.requests == 1 else 0.0
+
+    monkeypatch.setattr(server, "count_request", count_and_fail_first)
+    client = PechaClient(server.url, compress=True)
+
+    post_term(client, server.url)
+    client.close()
+
+    assert client.compress is False
+    assert server.requests == 2
+    assert server.store.terms["term"] == TERM
@@ -0,0 +1,58 @@
+from urllib.error import HTTPError
+
+import pytest
+from conftest import make_complex, record_posts
+
+from pecha_uploader import journal as journal_module
+from pecha_uploader.exceptions import APIError
+from pecha_uploader.journal import UploadJournal, hash_text
+from pecha_uploader.pipeline import upload
+
+
+@pytest.mark.parametrize(
+    "error, raised",
+    [
+        (KeyboardInterrupt, KeyboardInterrupt),
+        (APIError("Text : 'error'"), Exception),
+        (HTTPError("url", 502, "Bad Gateway", None, None), Exception),
+    ],
+    ids=["crash", "api-error", "http-error"],
+)
+def test_resume_skips_the_steps_completed_before_a_crash(
+    server, root_text, monkeypatch, error, raised
+):
+    text = make_complex(root_text)
+    posted = record_posts(monkeypatch)
+    upload(text, server.url, resume=True)
+    server.store.texts.clear()
+    all_posts = list(posted)
+    assert len(all_posts) == 4
+
+    posted = record_posts(monkeypatch, fail_at=2, error=error)
+    with pytest.raises(raised):
+        upload(text, server.url, input_hash="run")
+    done = list(posted)
+    posted = record_posts(monkeypatch)
+    upload(text, server.url, resume=True, input_hash="run")
+
+    assert done == all_posts[:1]
+    assert posted == all_posts[1:]
+    assert len(server.store.texts) == len(all_posts)
+
+
+def test_text_is_hashed_only_when_resuming(server, root_text, monkeypatch):
+    hashed = []
+    monkeypatch.setattr(
+        journal_module, "hash_text", lambda text: hashed.append(text) or "hash"
+    )
+
+    assert UploadJournal.for_text(root_text, server.url) is None
+    assert hashed == []
+    journal = UploadJournal.for_text(root_text, server.url, resume=True)
+    assert journal.input_hash == "hash"
+    journal.close()
+    assert (
+        UploadJournal.for_text(root_text, server.url, input_hash="file").input_hash
+        == "file"
+    )
+    assert hash_text(root_text) == hash_text(dict(reversed(list(root_text.items()))))
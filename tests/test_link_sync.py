@@ -0,0 +1,41 @@
+from pecha_uploader.client import get_client
+from pecha_uploader.pipeline import upload
+
+
+def record_link_writes(server):
+    writes = []
+    get_client(server.url).add_listener(
+        lambda event: event.method != "GET"
+        and "/api/links/" in event.url
+        and writes.append(event.method)
+    )
+    return writes
+
+
+def link_ids(server):
+    return {tuple(link["refs"]): link["_id"] for link in server.store.links}
+
+
+def test_sync_posts_and_deletes_only_the_changed_links(
+    server, root_text, linked_commentary
+):
+    upload(root_text, server.url)
+    upload(linked_commentary, server.url, sync_links=True)
+    before = link_ids(server)
+    assert len(before) == 6
+
+    writes = record_link_writes(server)
+    upload(linked_commentary, server.url, sync_links=True)
+    assert writes == []
+    assert link_ids(server) == before
+
+    # the first segment of "Part 1" now comments on verse 1:1 instead of 1:2
+    content = linked_commentary["target"]["books"][0]["content"]
+    content["ལེའུ"]["Part 1"]["data"][0] = "a<1><1>"
+    upload(linked_commentary, server.url, sync_links=True)
+
+    after = link_ids(server)
+    assert sorted(writes) == ["DELETE", "POST"]
+    assert len(after) == 6
+    assert len(set(after.items()) & set(before.items())) == 5
+    assert ("Prayer of Kuntuzangpo 1:1", "Chapter, Part 1 1") in after
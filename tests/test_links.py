@@ -0,0 +1,148 @@
+from urllib.error import HTTPError
+
+import pytest
+from conftest import read_data
+
+from pecha_uploader.config import LINK_ERROR_ID_LOG
+from pecha_uploader.exceptions import CircuitOpenError
+from pecha_uploader.links import batching
+from pecha_uploader.links.batching import MAX_BATCH_BYTES, BatchSizer, post_links
+from pecha_uploader.links.create_ref_json import create_links, get_range, link_mapper
+from pecha_uploader.links.upload import post_link
+
+
+def make_links(count: int):
+    return [
+        {"refs": [f"Root 1:{i}", f"Commentary 1:{i}"], "type": "commentary"}
+        for i in range(count)
+    ]
+
+
+def failing_post(monkeypatch, fails):
+    """Post links with `post_link`, raising `fails(batch)` when it is an error"""
+    batches = []
+
+    def post(links, destination_url):
+        batches.append(links)
+        error = fails(links)
+        if error is not None:
+            raise error
+        post_link(links, destination_url)
+
+    monkeypatch.setattr(batching, "post_link", post)
+    return batches
+
+
+class FailedLinks:
+    """Refs of the links written to the error log since creation"""
+
+    def __init__(self):
+        self.start = len(self.read())
+
+    def read(self):
+        if not LINK_ERROR_ID_LOG.exists():
+            return []
+        return LINK_ERROR_ID_LOG.read_text(encoding="utf-8").splitlines()
+
+    def __call__(self):
+        start = self.start
+        return self.read()[start:]
+
+
+def post_in_one_batch(links, server, **options):
+    sizer = BatchSizer(initial_bytes=MAX_BATCH_BYTES)
+    post_links(links, server.url, max_in_flight=1, sizer=sizer, **options)
+
+
+def test_failed_batch_is_bisected_to_the_bad_link(server, monkeypatch):
+    links = make_links(16)
+    error = HTTPError(server.url, 500, "Internal Server Error", {}, None)
+    batches = failing_post(
+        monkeypatch, lambda batch: error if links[5] in batch else None
+    )
+    failed = FailedLinks()
+
+    with pytest.raises(Exception, match="1 links could not be posted"):
+        post_in_one_batch(links, server, max_split_depth=8)
+
+    assert len(server.store.links) == 15
+    assert failed() == ["Root 1:5 | Commentary 1:5"]
+    # the batch of 16, then both halves of 8, 4, 2 and 1 links
+    assert len(batches) == 9
+
+
+def test_split_depth_bounds_the_requests_of_a_failing_batch(server, monkeypatch):
+    links = make_links(64)
+    error = HTTPError(server.url, 500, "Internal Server Error", {}, None)
+    batches = failing_post(monkeypatch, lambda batch: error)
+    failed = FailedLinks()
+
+    with pytest.raises(Exception, match="64 links could not be posted"):
+        post_in_one_batch(links, server, max_split_depth=2)
+
+    assert len(batches) == 1 + 2 + 4
+    assert len(failed()) == 64
+    assert server.store.links == []
+
+
+def test_open_circuit_stops_the_links_and_reports_the_rest(server, monkeypatch):
+    links = make_links(64)
+    batches = failing_post(
+        monkeypatch,
+        lambda batch: CircuitOpenError("open") if len(batches) > 1 else None,
+    )
+    failed = FailedLinks()
+
+    with pytest.raises(CircuitOpenError) as error:
+        post_links(
+            links, server.url, max_in_flight=1, sizer=BatchSizer(initial_bytes=1024)
+        )
+
+    # nothing is sent after the first batch that found the circuit open
+    assert len(batches) == 2
+    posted = len(server.store.links)
+    assert 0 < posted < 64
+    assert len(failed()) == 64 - posted
+    assert f"{64 - posted} links could not be posted" in str(error.value)
+
+
+def test_commentary_links_match_the_expected_links():
+    expected = read_data("preprocessing_expected.json")["commentary_text"]["links"]
+
+    assert create_links(read_data("commentary_text.json")) == expected
+
+
+@pytest.mark.parametrize(
+    "contents, refs",
+    [
+        (
+            ["a<1><1>", "b<1><1><9>", "c", "d<1><2>"],
+            [("Root 1:1", "Com 1-2"), ("Root 1:2", "Com 4")],
+        ),
+        (
+            [["a<1><1>"], "not a section", ["b<2><1>", "c<2><1>"]],
+            [("Root 1:1", "Com 1:1"), ("Root 2:1", "Com 3:1-2")],
+        ),
+        (
+            [[["a<1><1>", "b", "c<1><1>"]], [["d<3><4>"], ["e<3><4>"]]],
+            [
+                ("Root 1:1", "Com 1:1:1-3"),
+                ("Root 3:4", "Com 2:1:1"),
+                ("Root 3:4", "Com 2:2:1"),
+            ],
+        ),
+        (["no marker", "<1>"], []),
+    ],
+    ids=["depth-1", "depth-2", "depth-3", "no-markers"],
+)
+def test_links_of_every_depth(contents, refs):
+    links = link_mapper("Com", contents, {"base_text_titles": ["Root"]})
+
+    assert links == [{"refs": list(pair), "type": "commentary"} for pair in refs]
+
+
+def test_range_of_every_marker():
+    assert get_range(["a<1><2>", "b", "c<1><2>", "d<10><3>"]) == {
+        "<1><2>": ["1-3", [1, 2]],
+        "<10><3>": ["4", [10, 3]],
+    }
@@ -0,0 +1,23 @@
+from conftest import record_posts
+
+from pecha_uploader.pipeline import upload
+
+
+def test_only_changed_posts_only_what_changed(
+    server, root_text, linked_commentary, monkeypatch
+):
+    upload(root_text, server.url)
+    upload(linked_commentary, server.url, only_changed=True)
+    links = list(server.store.links)
+    assert len(links) == 6
+
+    posted = record_posts(monkeypatch)
+    upload(linked_commentary, server.url, only_changed=True)
+    assert posted == []
+    assert server.store.links == links
+
+    source = linked_commentary["source"]["books"][0]["content"]
+    source["Chapter"]["Part 1"]["data"][0] = "changed<1><2>"
+    upload(linked_commentary, server.url, only_changed=True)
+    assert posted == [("Chapter, Part 1", "en")]
+    assert server.store.links == links
@@ -0,0 +1,124 @@
+import json
+import re
+
+import pytest
+from conftest import write_text
+
+from pecha_uploader import metrics as metrics_module
+from pecha_uploader.batch import upload_many
+from pecha_uploader.metrics import (
+    METRICS_JSON,
+    METRICS_TEXTFILE,
+    NETWORK,
+    PREPROCESS,
+    MetricsRegistry,
+    write_metrics,
+)
+from pecha_uploader.pipeline import upload
+
+SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$")
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"(?:,|$)')
+
+
+def parse_textfile(text: str):
+    """Parse the Prometheus text format into types and (name, labels, value)"""
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+        elif line.startswith("# HELP "):
+            assert line.split(" ")[2] not in types
+        else:
+            name, labels, value = SAMPLE.match(line).groups()
+            pairs = LABEL.findall(labels or "")
+            assert ",".join(f'{k}="{v}"' for k, v in pairs) == (labels or "")
+            labels = {
+                key: re.sub(r"\\(.)", lambda m: {"n": "\n"}.get(m[1], m[1]), value)
+                for key, value in pairs
+            }
+            samples.append((name, labels, float(value)))
+    return types, samples
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics_module, "_metrics", registry)
+    return registry
+
+
+def test_registry_sums_calls_and_stages(registry):
+    registry.record_call("post_text", "200", 0.02, 1)
+    registry.record_call("post_text", "503", 1.5, 3)
+    registry.record_bytes("post_text", 100, 10)
+    registry.observe("pecha_stage_seconds", 0.3, stage="walk_text", kind=PREPROCESS)
+
+    summary = registry.summary()
+    assert summary["operations"]["post_text"] == {
+        "calls": 2,
+        "errors": 1,
+        "attempts": 4,
+        "bytes_sent": 100,
+        "bytes_received": 10,
+        "seconds": 1.52,
+        "p50": 0.025,
+        "p99": 2.5,
+    }
+    assert summary["seconds"] == {PREPROCESS: 0.3, NETWORK: 1.52}
+    assert registry.total("pecha_api_calls_total", operation="post_text") == 2
+    assert registry.total("pecha_api_calls_total", status="503") == 1
+
+
+def test_metrics_are_written_as_json_and_textfile(registry, tmp_path):
+    registry.record_call("post_text", "200", 0.02, 1)
+    registry.record_call("post_text", "200", 7.0, 2)
+    registry.record_bytes("post_text", 2048, 64)
+    registry.inc("pecha_cache_requests_total", result='hit "a\\b"\n')
+
+    json_path = write_metrics(tmp_path)
+
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert set(data) == {"written_at", "summary", "metrics"}
+    assert data["summary"]["operations"]["post_text"]["calls"] == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        [METRICS_JSON, METRICS_TEXTFILE]
+    )
+
+    types, samples = parse_textfile((tmp_path / METRICS_TEXTFILE).read_text())
+    assert types["pecha_api_calls_total"] == "counter"
+    assert types["pecha_api_call_seconds"] == "histogram"
+    assert types["pecha_metrics_written_timestamp_seconds"] == "gauge"
+    assert ("pecha_api_bytes_sent_total", {"operation": "post_text"}, 2048) in samples
+    assert (
+        "pecha_cache_requests_total",
+        {"result": 'hit "a\\b"\n'},
+        1,
+    ) in samples
+
+    buckets = [
+        (labels["le"], value)
+        for name, labels, value in samples
+        if name == "pecha_api_call_seconds_bucket"
+    ]
+    assert buckets[-1] == ("+Inf", 2)
+    assert [value for _, value in buckets] == sorted(value for _, value in buckets)
+    assert dict(buckets)["0.025"] == 1 and dict(buckets)["5"] == 1
+    assert ("pecha_api_call_seconds_count", {"operation": "post_text"}, 2) in samples
+    assert ("pecha_api_call_seconds_sum", {"operation": "post_text"}, 7.02) in samples
+
+
+def test_a_batch_writes_its_metrics_once(server, root_text, tmp_path, monkeypatch):
+    writes = []
+    monkeypatch.setattr(metrics_module, "write_metrics", lambda: writes.append(1))
+
+    upload(root_text, server.url)
+    assert len(writes) == 1
+
+    paths = [write_text(tmp_path / f"{i}.json", root_text) for i in range(3)]
+    upload_many(paths, server.url, workers=2)
+    assert len(writes) == 2
+
+    upload_many(paths, server.url, dry_run=True)
+    assert len(writes) == 2
@@ -0,0 +1,43 @@
+from conftest import make_complex
+
+from pecha_uploader.mock_server import SefariaStore
+from pecha_uploader.pipeline import get_index_key, upload
+
+
+def test_index_of_resolves_section_and_node_refs():
+    store = SefariaStore()
+    store.categories["Root"] = {"path": ["Root"]}
+    schema = {
+        "titles": [{"lang": "en", "text": "Book", "primary": True}],
+        "key": "Book",
+        "nodes": [
+            {"key": "Part 1", "titles": [{"lang": "en", "text": "Part 1"}]},
+            {"key": "Part 10", "titles": [{"lang": "he", "text": "ལེའུ"}]},
+        ],
+    }
+    store.post_index(
+        "Long title, of a book", {"categories": ["Root"], "schema": schema}
+    )
+    store.post_index("Long", {"categories": ["Root"], "schema": {}})
+
+    assert store.index_of("Long title, of a book 1:2") == "Long title, of a book"
+    assert store.index_of("Long 3") == "Long"
+    assert store.index_of("Book, Part 1 2:3") == "Long title, of a book"
+    assert store.index_of("Book, Part 10") == "Long title, of a book"
+    assert store.index_of("Book, ལེའུ") == "Long title, of a book"
+    assert store.index_of("Book, Part 2") is None
+    assert store.index_of("Longer") is None
+
+    store.delete_index("Long title, of a book")
+    assert store.index_of("Book, Part 1") is None
+
+
+def test_complex_text_uploads(server, root_text, commentary_text):
+    upload(root_text, server.url)
+    upload(make_complex(commentary_text), server.url)
+
+    title = get_index_key(commentary_text)
+    refs = [ref for ref in server.store.texts if server.store.index_of(ref) == title]
+    # both chapters of both books, posted under the titles of the schema root
+    assert len(refs) == 4
+    assert {ref.split(",")[0] for ref in refs} == {"Chapter", "ལེའུ"}
@@ -0,0 +1,52 @@
+import pstats
+
+import pytest
+
+from pecha_uploader import profiling
+from pecha_uploader.pipeline import get_index_key, upload
+from pecha_uploader.profiling import PROFILE_ENV
+
+
+@pytest.fixture
+def profile_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_PATH", tmp_path / "profiles")
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    return tmp_path / "profiles"
+
+
+def test_profile_writes_cpu_and_memory_reports(server, root_text, profile_path):
+    upload(root_text, server.url, profile=True)
+
+    prof, report = sorted(profile_path.iterdir())
+    assert prof.suffix == ".prof" and report.suffix == ".txt"
+    assert prof.stem == report.stem
+    assert prof.stem.endswith(get_index_key(root_text))
+    assert pstats.Stats(str(prof)).total_calls > 0
+    lines = report.read_text(encoding="utf-8").splitlines()
+    assert lines[0].startswith(f"Profile of '{get_index_key(root_text)}'")
+    assert "Peak memory by stage" in lines
+    assert any(line.endswith("  walk_text") for line in lines)
+
+
+def test_profile_environment_variable_turns_profiling_on(
+    server, root_text, profile_path, monkeypatch
+):
+    monkeypatch.setenv(PROFILE_ENV, "1")
+    upload(root_text, server.url)
+    assert len(list(profile_path.iterdir())) == 2
+
+    # an explicit argument wins over the variable
+    upload(root_text, server.url, profile=False)
+    assert len(list(profile_path.iterdir())) == 2
+
+
+@pytest.mark.parametrize("value", [None, "0", "no"])
+def test_nothing_is_profiled_by_default(
+    server, root_text, profile_path, monkeypatch, value
+):
+    if value is not None:
+        monkeypatch.setenv(PROFILE_ENV, value)
+
+    upload(root_text, server.url)
+
+    assert not profile_path.exists()
@@ -0,0 +1,53 @@
+import json
+
+from pecha_uploader import registry as registry_module
+from pecha_uploader.registry import Registry
+
+URL = "https://staging.pecha.org/"
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_changes_are_written_in_batches(tmp_path, monkeypatch):
+    writes = []
+    write_json = registry_module._write_json
+    monkeypatch.setattr(
+        registry_module,
+        "_write_json",
+        lambda path, data: writes.append(path) or write_json(path, data),
+    )
+    path = tmp_path / "registry.json"
+    registry = Registry(path, save_interval=60)
+
+    for i in range(100):
+        registry.add_term(URL, f"term {i}", f"bo {i}")
+        registry.add_category(URL, ["Root", f"category {i}"])
+    assert writes == []
+    assert registry.has_term(URL, "term 99", "bo 99")
+
+    registry.flush()
+    registry.flush()
+    assert writes == [path]
+    assert len(read(path)[URL]["terms"]) == 100
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_writers_merge_their_changes(tmp_path):
+    path = tmp_path / "registry.json"
+    first = Registry(path, save_interval=60)
+    second = Registry(path, save_interval=60)
+
+    first.add_term(URL, "Root", "རྩ་བ།")
+    first.add_category(URL, ["Root", "Commentary"])
+    first.flush()
+    second.add_category(URL, ["Root"])
+    second.forget_term(URL, "Root")
+    second.flush()
+
+    data = read(path)[URL]
+    assert data["terms"] == {}
+    assert sorted(data["categories"]) == ["Root", "Root/Commentary"]
+    assert Registry(path).has_category(URL, ["Root", "Commentary"])
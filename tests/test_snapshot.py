@@ -0,0 +1,51 @@
+from pecha_uploader.batch import SUCCESS, upload_many
+from pecha_uploader.pipeline import get_index_key, upload
+from pecha_uploader.registry import get_registry
+from pecha_uploader.snapshot import get_snapshot, load_snapshot
+
+
+def category_paths(text):
+    names = [category["name"] for category in text["source"]["categories"]]
+    return ["/".join(names[: i + 1]) for i in range(len(names))]
+
+
+def test_snapshot_plans_only_the_missing_posts(server, root_text, commentary_text):
+    plan = load_snapshot(server.url).plan([root_text])
+    assert plan.categories == category_paths(root_text)
+    assert len(plan.terms) == len(plan.categories)
+    assert plan.new_indexes == [get_index_key(root_text)]
+
+    upload(root_text, server.url)
+    plan = load_snapshot(server.url).plan([root_text, commentary_text])
+
+    assert plan.existing_indexes == [get_index_key(root_text)]
+    assert plan.new_indexes == [get_index_key(commentary_text)]
+    assert plan.existing_categories == len(category_paths(root_text))
+    missing = set(category_paths(commentary_text)) - set(category_paths(root_text))
+    assert set(plan.categories) == missing
+
+
+def test_snapshot_seeds_the_registry_with_what_exists_only(server, root_text):
+    upload(root_text, server.url, use_registry=False)
+    registry = get_registry()
+    registry.add_category(server.url, ["Deleted"])
+    registry.add_term(server.url, "Deleted", "བསུབས")
+    registry.add_category("https://other.org/", ["Deleted"])
+
+    load_snapshot(server.url, registry)
+
+    names = [category["name"] for category in root_text["source"]["categories"]]
+    assert registry.has_category(server.url, names)
+    assert registry.has_term(
+        server.url, names[0], root_text["target"]["categories"][0]["name"]
+    )
+    assert not registry.has_category(server.url, ["Deleted"])
+    assert not registry.has_term(server.url, "Deleted", "བསུབས")
+    assert registry.has_category("https://other.org/", ["Deleted"])
+
+
+def test_snapshot_lasts_for_one_batch(server, root_text):
+    results = upload_many([root_text], server.url, snapshot=True)
+
+    assert [result.status for result in results] == [SUCCESS]
+    assert get_snapshot(server.url) is None
@@ -0,0 +1,45 @@
+from conftest import API_KEY, write_text
+
+from pecha_uploader.links.create_ref_json import iter_links
+from pecha_uploader.mock_server import MockSefariaServer
+from pecha_uploader.pipeline import upload
+from pecha_uploader.stream import iter_stream_links, read_skeleton, upload_stream
+
+
+def contents(server):
+    store = server.store
+    links = sorted(tuple(link["refs"]) for link in store.links)
+    return store.terms, store.categories, store.indexes, store.texts, links
+
+
+def test_stream_uploads_what_a_whole_file_upload_does(
+    server, root_text, linked_commentary, tmp_path
+):
+    root_path = write_text(tmp_path / "root.json", root_text)
+    commentary_path = write_text(tmp_path / "commentary.json", linked_commentary)
+    upload(root_text, server.url)
+    upload(linked_commentary, server.url)
+
+    with MockSefariaServer(api_key=API_KEY) as streamed:
+        upload_stream(root_path, streamed.url, use_registry=False)
+        upload_stream(commentary_path, streamed.url, use_registry=False)
+        assert contents(streamed) == contents(server)
+    assert len(server.store.links) == 6
+
+
+def test_stream_links_are_generated_lazily(linked_commentary, tmp_path, monkeypatch):
+    path = write_text(tmp_path / "commentary.json", linked_commentary)
+    skeleton = read_skeleton(path)
+    generated = []
+
+    def recording(*args):
+        for link in iter_links(*args):
+            generated.append(link)
+            yield link
+
+    monkeypatch.setattr("pecha_uploader.stream.iter_links", recording)
+    links = iter_stream_links(path, skeleton)
+
+    assert next(links)["refs"] == generated[0]["refs"]
+    assert len(generated) < 6
+    assert len(list(links)) + 1 == len(generated) == 6
@@ -0,0 +1,30 @@
+import json
+
+from pecha_uploader.config import TRACE_PATH
+from pecha_uploader.pipeline import upload
+from pecha_uploader.tracing import TRACE_ENV
+
+
+def new_traces(before):
+    traces = set(TRACE_PATH.glob("*.json")) if TRACE_PATH.exists() else set()
+    return sorted(traces - before)
+
+
+def test_uploads_are_traced_on_demand(server, root_text, monkeypatch):
+    monkeypatch.delenv(TRACE_ENV, raising=False)
+    before = set(new_traces(set()))
+
+    upload(root_text, server.url)
+    assert new_traces(before) == []
+
+    upload(root_text, server.url, tracing=True)
+    (path,) = new_traces(before)
+    with open(path, encoding="utf-8") as f:
+        spans = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["name"] for s in spans].count("chapter") == 2
+
+    monkeypatch.setenv(TRACE_ENV, "1")
+    upload(root_text, server.url)
+    assert len(new_traces(before)) == 2
+    upload(root_text, server.url, tracing=False)
+    assert len(new_traces(before)) == 2
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+
+import pytest
+from conftest import make_complex, record_posts
+
+from pecha_uploader.async_pipeline import upload_async
+from pecha_uploader.client import get_client
+from pecha_uploader.exceptions import APIError
+from pecha_uploader.pipeline import (
+    add_terms_and_categories,
+    build_payload,
+    get_index_key,
+    upload,
+)
+from pecha_uploader.registry import get_registry
+from pecha_uploader.transaction import upload_transaction
+
+
+def contents(server):
+    store = server.store
+    return set(store.terms), set(store.categories), set(store.indexes), store.texts
+
+
+def run_upload(mode: str, text, destination_url: str, **options):
+    if mode == "sync":
+        return upload(text, destination_url, **options)
+    return asyncio.run(upload_async(text, destination_url, max_in_flight=1, **options))
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_failed_upload_is_rolled_back(server, root_text, mode, monkeypatch):
+    record_posts(monkeypatch, fail_at=2, error=RuntimeError("boom"))
+
+    with pytest.raises(Exception, match="boom"):
+        run_upload(mode, root_text, server.url)
+
+    assert contents(server) == (set(), set(), set(), {})
+    categories = root_text["source"]["categories"]
+    assert not get_registry().has_category(
+        server.url, [category["name"] for category in categories]
+    )
+
+    posted = record_posts(monkeypatch)
+    upload(root_text, server.url)
+    assert len(posted) == 2
+    assert get_index_key(root_text) in server.store.indexes
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_journaled_upload_keeps_its_chapters_to_resume(
+    server, root_text, mode, monkeypatch
+):
+    text = make_complex(root_text)
+    done = record_posts(monkeypatch, fail_at=3, error=APIError("Text : 'error'"))
+
+    with pytest.raises(Exception, match="error"):
+        run_upload(mode, text, server.url, input_hash="run")
+
+    assert get_index_key(text) in server.store.indexes
+    # a chapter already started when the async upload failed is kept as well
+    assert len(done) >= 2
+    assert len(server.store.texts) == len(done)
+    posted = record_posts(monkeypatch)
+    run_upload(mode, text, server.url, resume=True, input_hash="run")
+    assert len(set(done + posted)) == len(done + posted) == 4
+    assert len(server.store.texts) == 4
+
+
+def test_journaled_upload_rolls_back_before_its_first_chapter(
+    server, root_text, monkeypatch
+):
+    record_posts(monkeypatch, fail_at=1, error=APIError("Text : 'error'"))
+
+    with pytest.raises(Exception, match="error"):
+        upload(root_text, server.url, input_hash="run")
+
+    assert contents(server) == (set(), set(), set(), {})
+    posted = record_posts(monkeypatch)
+    upload(root_text, server.url, resume=True, input_hash="run")
+    assert len(posted) == 2
+    assert get_index_key(root_text) in server.store.indexes
+
+
+def test_existing_terms_are_told_by_the_post_answer(server, root_text):
+    lookups = []
+    get_client(server.url).add_listener(
+        lambda event: event.method == "GET" and lookups.append(event.url)
+    )
+    server.store.terms["Root text"] = {"name": "Root text"}
+
+    with upload_transaction(server.url) as transaction:
+        add_terms_and_categories(build_payload(root_text), server.url)
+
+    assert lookups == []
+    assert "Root text" not in transaction.terms
+    assert len(transaction.terms) == len(root_text["source"]["categories"]) - 1
+
+
+def test_rollback_keeps_what_another_upload_uses(server, root_text, monkeypatch):
+    claimed, done = threading.Event(), threading.Event()
+
+    def other_upload():
+        # uses the categories the failing upload created, until `done`
+        with upload_transaction(server.url):
+            add_terms_and_categories(build_payload(root_text), server.url)
+            claimed.set()
+            done.wait(10)
+
+    other = threading.Thread(target=other_upload)
+
+    def post_text(*args):
+        other.start()
+        claimed.wait(10)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr("pecha_uploader.pipeline.post_text", post_text)
+    with pytest.raises(Exception, match="boom"):
+        upload(root_text, server.url, use_registry=False)
+    done.set()
+    other.join()
+
+    terms, categories, indexes, _ = contents(server)
+    assert len(categories) == len(root_text["source"]["categories"])
+    assert len(terms) == len(categories)
+    assert indexes == set()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_links_wait_for_every_chapter(
+    server, root_text, linked_commentary, mode, monkeypatch
+):
+    upload(root_text, server.url)
+    upload(linked_commentary, server.url)
+    links = list(server.store.links)
+
+    record_posts(monkeypatch, fail_at=3, error=RuntimeError("boom"))
+    with pytest.raises(Exception, match="boom"):
+        if mode == "sync":
+            upload(linked_commentary, server.url)
+        else:
+            asyncio.run(upload_async(linked_commentary, server.url, max_in_flight=1))
+
+    assert server.store.links == links
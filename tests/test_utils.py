@@ -0,0 +1,175 @@
+"""
+The preprocessing of a pecha json against the outputs of the implementations
+it replaced: `preprocessing_expected.json` holds the schema, the cleaned
+chapters (as sha256 digests for the large commentary) and the links they
+generated for the texts of `tests/data`.
+"""
+
+import hashlib
+import json
+
+import pytest
+from conftest import read_data
+
+from pecha_uploader.pipeline import get_index_key
+from pecha_uploader.utils import (
+    generate_chapters,
+    generate_schema,
+    parse_annotation,
+    walk_text,
+)
+
+SAPCHE = '<span class="text-subche-style">ས་བཅད།</span>'
+CITATION = '<span class="text-citation-style">cite</span>'
+QUOTATION = '<span class="text-quotation-style">quote</span>'
+
+SEGMENTS = [
+    "  <sapche>ས་བཅད།</sapche><1><2>\n",
+    "{cite} and (quote)<1><2>",
+    7,
+    "plain<2><1>",
+]
+CLEAN_SEGMENTS = [SAPCHE + "<br>", f"{CITATION} and {QUOTATION}", "7", "plain"]
+
+EN_CONTENT = {
+    "Chapter 1": {"data": [SEGMENTS[:2], [SEGMENTS[2:]]]},
+    "Chapter 2 ": {
+        "data": ["intro<1><3>"],
+        "Part 1": {"data": ["a<2><2>", "b<2><2>", "c<2><3>"]},
+        "Part 2": {"data": [], "Section": {"data": [["x<3><1>"]]}},
+    },
+}
+BO_CONTENT = {
+    "ལེའུ་༡": {"data": [SEGMENTS[:2], [SEGMENTS[2:]]]},
+    "ལེའུ་༢ ": {
+        "data": ["intro<1><3>"],
+        "ཚན་༡": {"data": ["a<2><2>", "b<2><2>", "c<2><3>"]},
+        "ཚན་༢": {"data": [], "ས་བཅད": {"data": [["x<3><1>"]]}},
+    },
+}
+
+
+def digest(value):
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def data_node(en_key: str, bo_key: str, depth: int):
+    sections = ["Chapters", "Verses", "Paragraphs"][:depth]
+    return {
+        "nodeType": "JaggedArrayNode",
+        "depth": depth,
+        "addressTypes": ["Integer"] * depth,
+        "sectionNames": sections,
+        "titles": [
+            {"lang": "he", "text": bo_key, "primary": True},
+            {"lang": "en", "text": en_key, "primary": True},
+        ],
+        "key": en_key,
+    }
+
+
+def parent_node(en_key: str, bo_key: str, nodes):
+    return {
+        "nodes": nodes,
+        "titles": [
+            {"lang": "he", "text": bo_key, "primary": True},
+            {"lang": "en", "text": en_key, "primary": True},
+        ],
+        "key": en_key,
+    }
+
+
+@pytest.fixture(scope="module")
+def expected():
+    return read_data("preprocessing_expected.json")
+
+
+@pytest.mark.parametrize("name", ["base_text", "commentary_text"])
+def test_preprocessing_matches_the_expected_outputs(name, expected):
+    text = read_data(f"{name}.json")
+    expected = expected[name]
+
+    schema = generate_schema(text["source"]["books"][0], text["target"]["books"][0])
+    chapters = {
+        side: [parse_annotation(book["content"]) for book in text[side]["books"]]
+        for side in ("source", "target")
+    }
+    tree = walk_text(text)
+
+    assert schema == tree.schema == expected["schema"]
+    walked = {"source": tree.en_chapters, "target": tree.bo_chapters}
+    for side in ("source", "target"):
+        assert walked[side] == [
+            {get_index_key(text): cleaned} for cleaned in chapters[side]
+        ]
+    if "chapters" in expected:
+        assert chapters == expected["chapters"]
+    else:
+        assert {
+            side: [digest(cleaned) for cleaned in chapters[side]] for side in chapters
+        } == expected["chapters_sha256"]
+
+
+@pytest.mark.parametrize(
+    "value, cleaned",
+    [
+        ("a\nb\n", "a<br>b<br>"),
+        ("  <sapche>ས་བཅད།</sapche> ", SAPCHE),
+        ("{cite}(quote)", CITATION + QUOTATION),
+        ("  text<12><3>  ", "text"),
+        ("<b>bold</b><1>", "<b>bold</b>"),
+        ("}) without opening", "}) without opening"),
+        (12, "12"),
+        ([], []),
+        (SEGMENTS + [[SEGMENTS, []]], CLEAN_SEGMENTS + [[CLEAN_SEGMENTS, []]]),
+    ],
+)
+def test_annotations_are_cleaned(value, cleaned):
+    assert parse_annotation(value) == cleaned
+
+
+def test_schema_pairs_nested_nodes_of_both_books():
+    schema = generate_schema({"content": EN_CONTENT}, {"content": BO_CONTENT})
+
+    assert schema == [
+        data_node("Chapter 1", "ལེའུ་༡", 3),
+        parent_node(
+            "Chapter 2 ",
+            "ལེའུ་༢ ",
+            [
+                data_node("data", "གནས་བབས", 1),
+                data_node("Part 1", "ཚན་༡", 1),
+                parent_node(
+                    "Part 2",
+                    "ཚན་༢",
+                    [
+                        data_node("data", "གནས་བབས", 1),
+                        data_node("Section", "ས་བཅད", 2),
+                    ],
+                ),
+            ],
+        ),
+    ]
+
+
+@pytest.mark.parametrize(
+    "content, language, data_key",
+    [(EN_CONTENT, "en", "data"), (BO_CONTENT, "bo", "གནས་བབས")],
+)
+def test_chapters_of_children_come_before_their_parent_data(
+    content, language, data_key
+):
+    chapter_1, chapter_2 = [key.strip() for key in content]
+    part_1, part_2 = list(content[f"{chapter_2} "])[1:]
+    section = list(content[f"{chapter_2} "][part_2])[1]
+
+    chapters = generate_chapters(content, language)
+
+    assert list(chapters.items()) == [
+        (chapter_1, [CLEAN_SEGMENTS[:2], [CLEAN_SEGMENTS[2:]]]),
+        (f"{chapter_2}, {part_1}", ["a", "b", "c"]),
+        (f"{chapter_2}, {part_2}, {section}", [["x"]]),
+        (f"{chapter_2}, {part_2}, {data_key}", []),
+        (f"{chapter_2}, {data_key}", ["intro"]),
+    ]